@@ -1,23 +1,54 @@
 """
 名人经历向量数据库构建工具包
+
+各模块在首次访问对应属性时才导入，只做检索时不会加载构建阶段用到的openai/tiktoken等依赖
 """
+import importlib
+from typing import TYPE_CHECKING
+
+# 导出名称 -> 所在模块
+_EXPORTS = {
+    "CelebrityExperienceSearcher": "search_celebrity_experiences",
+    "StructuredDataExtractor": "extract_structured_data",
+    "TagMatcher": "tag_matching",
+    "TextProcessor": "text_processing",
+    "ElasticsearchSetup": "elasticsearch_setup",
+    "VectorDatabaseBuilder": "build_vector_database",
+    "ChunkRecord": "records",
+    "ProfileMatcher": "profile_matching",
+    "CelebrityMatcher": "centroids",
+    "QueryPlanner": "query_planner",
+    "RerankStage": "reranking",
+    "load_env": "config",
+}
+
+__all__ = list(_EXPORTS)
 
-from .search_celebrity_experiences import CelebrityExperienceSearcher
-from .extract_structured_data import StructuredDataExtractor
-from .tag_matching import TagMatcher
-from .text_processing import TextProcessor
-from .elasticsearch_setup import ElasticsearchSetup
-from .build_vector_database import VectorDatabaseBuilder
 
-__all__ = [
-    "CelebrityExperienceSearcher",
-    "StructuredDataExtractor",
-    "TagMatcher",
-    "TextProcessor",
-    "ElasticsearchSetup",
-    "VectorDatabaseBuilder",
-]
+def __getattr__(name: str):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    # 缓存到模块命名空间，之后的访问不再经过__getattr__
+    globals()[name] = value
+    return value
 
 
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
 
 
+if TYPE_CHECKING:
+    from .search_celebrity_experiences import CelebrityExperienceSearcher
+    from .extract_structured_data import StructuredDataExtractor
+    from .tag_matching import TagMatcher
+    from .text_processing import TextProcessor
+    from .elasticsearch_setup import ElasticsearchSetup
+    from .build_vector_database import VectorDatabaseBuilder
+    from .records import ChunkRecord
+    from .profile_matching import ProfileMatcher
+    from .centroids import CelebrityMatcher
+    from .query_planner import QueryPlanner
+    from .reranking import RerankStage
+    from .config import load_env
@@ -0,0 +1,299 @@
+"""
+ANN调参：以精确最近邻为基准扫描HNSW参数，输出 recall@k 与p95延迟的对照表并给出推荐配置
+
+从构建输出的chunk缓存加载向量，用NumPy暴力计算全维度精确top-k作为基准（见recall_eval），
+然后对每一组索引配置（m、ef_construction、量化方式、Matryoshka截断维度）建一个临时索引，
+写入同一批向量，再对每个 num_candidates 回放全部查询，记录召回率和延迟：
+    - recall@k 始终以全维度精确检索为基准，截断维度的召回损失也计入
+    - 延迟为客户端往返耗时（只取_id，不拉取_source）和ES返回的took
+推荐配置：满足目标召回率的组合中p95延迟最低者（相同时取向量内存更小者），
+没有组合达到目标时取召回率最高者。临时索引在扫描结束后删除。
+"""
+import itertools
+import math
+import time
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+try:
+    from .records import load_chunk_cache
+    from .jsonl_cache import iter_experience_chunks
+    from .recall_eval import to_matrix, truncate_matrix, exact_top_k, recall_at_k, split_queries
+    from .elasticsearch_setup import ElasticsearchSetup, build_vector_options
+except ImportError:
+    from records import load_chunk_cache
+    from jsonl_cache import iter_experience_chunks
+    from recall_eval import to_matrix, truncate_matrix, exact_top_k, recall_at_k, split_queries
+    from elasticsearch_setup import ElasticsearchSetup, build_vector_options
+
+
+# 每个量化方式下单个向量分量的字节数（用于估算向量内存）
+QUANTIZATION_BYTES = {"none": 4, "int8": 1}
+
+
+def load_vectors(path: Path, max_vectors: int = None) -> np.ndarray:
+    """
+    从嵌入阶段的缓存加载向量（支持 .json 和内存受限模式的 .jsonl / .jsonl.zst）
+
+    Args:
+        path: 缓存文件路径
+        max_vectors: 最多加载的向量数，None表示全部
+
+    Returns:
+        归一化的float32矩阵
+    """
+    if path.suffix == ".json":
+        _, chunks = load_chunk_cache(path)
+    else:
+        chunks = (chunk for _, record_chunks in iter_experience_chunks(path) for chunk in record_chunks)
+    vectors = []
+    for chunk in chunks:
+        if len(chunk.embedding):
+            vectors.append(chunk.embedding)
+            if max_vectors and len(vectors) >= max_vectors:
+                break
+    if not vectors:
+        raise ValueError(f"缓存中没有向量: {path}")
+    return to_matrix(vectors)
+
+
+def index_configs(m_list: List[int], ef_construction_list: List[int], quantizations: List[str],
+                  dims_list: List[int], full_dims: int) -> List[Dict[str, Any]]:
+    """
+    展开索引配置的笛卡尔积（超过全维度的截断维度被忽略）
+
+    Returns:
+        配置列表，每项包含 m、ef_construction、quantization、dims
+    """
+    dims_list = sorted({dims for dims in dims_list if dims <= full_dims} | {full_dims}, reverse=True)
+    return [
+        {"m": m, "ef_construction": ef_construction, "quantization": quantization, "dims": dims}
+        for m, ef_construction, quantization, dims
+        in itertools.product(m_list, ef_construction_list, quantizations, dims_list)
+    ]
+
+
+class AnnTuner:
+    def __init__(self, es_setup: ElasticsearchSetup = None, scratch_index: str = "ann_tuning_scratch",
+                 k: int = 10, warmup: int = 10):
+        """
+        初始化调参器
+
+        Args:
+            es_setup: ElasticSearch设置（临时索引总是使用flat布局）
+            scratch_index: 临时索引名称，已存在时会被删除
+            k: top-k
+            warmup: 每个索引配置正式计时前的预热查询数
+        """
+        self.es_setup = es_setup or ElasticsearchSetup(layout="flat")
+        if self.es_setup.layout != "flat":
+            self.es_setup = ElasticsearchSetup(host=self.es_setup.host, port=self.es_setup.port, layout="flat")
+        self.scratch_index = scratch_index
+        self.k = k
+        self.warmup = warmup
+
+    def build_scratch_index(self, corpus: np.ndarray, config: Dict[str, Any]) -> Optional[float]:
+        """
+        按配置重建临时索引并写入（截断后的）语料向量
+
+        Args:
+            corpus: 全维度归一化语料矩阵
+            config: 索引配置
+
+        Returns:
+            写入耗时（秒），失败时返回None
+        """
+        vector_options = build_vector_options(
+            m=config["m"], ef_construction=config["ef_construction"], quantization=config["quantization"],
+            similarity="dot_product",
+        )
+        if not self.es_setup.create_index(self.scratch_index, delete_existing=True, layout="flat",
+                                          dims=config["dims"], vector_options=vector_options):
+            return None
+
+        vectors = truncate_matrix(corpus, config["dims"])
+        start = time.perf_counter()
+        documents = ({"chunk_id": str(i), "embedding": vector.tolist()} for i, vector in enumerate(vectors))
+        count = self.es_setup.bulk_index(self.scratch_index, documents, id_field="chunk_id")
+        self.es_setup.refresh_index(self.scratch_index)
+        if count < len(vectors):
+            print(f"警告: 只写入了 {count}/{len(vectors)} 个向量，召回率会偏低")
+        return time.perf_counter() - start
+
+    def measure(self, queries: np.ndarray, ground_truth: np.ndarray, dims: int,
+                num_candidates: int) -> Dict[str, Any]:
+        """
+        用当前临时索引回放全部查询
+
+        Args:
+            queries: 全维度归一化查询矩阵
+            ground_truth: 全维度精确top-k下标
+            dims: 临时索引的向量维度
+            num_candidates: HNSW候选数
+
+        Returns:
+            recall@k 和延迟分位数
+        """
+        queries = truncate_matrix(queries, dims)
+        predicted = np.full((len(queries), self.k), -1, dtype=np.int64)
+        latencies, took = [], []
+        for i, query in enumerate(queries):
+            vector = query.tolist()
+            start = time.perf_counter()
+            ids, took_ms = self.es_setup.knn_ids(self.scratch_index, vector, self.k, num_candidates)
+            latencies.append((time.perf_counter() - start) * 1000)
+            took.append(took_ms)
+            predicted[i, :len(ids)] = [int(doc_id) for doc_id in ids]
+        return {
+            "num_candidates": num_candidates,
+            "recall": recall_at_k(ground_truth, predicted),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "took_p95_ms": float(np.percentile(took, 95)),
+        }
+
+    def sweep(self, corpus: np.ndarray, queries: np.ndarray, configs: List[Dict[str, Any]],
+              num_candidates_list: List[int]) -> List[Dict[str, Any]]:
+        """
+        扫描全部 索引配置 × num_candidates
+
+        Args:
+            corpus: 全维度归一化语料矩阵
+            queries: 全维度归一化查询矩阵
+            configs: index_configs返回的索引配置
+            num_candidates_list: 要评估的HNSW候选数
+
+        Returns:
+            每个组合一行的结果列表
+        """
+        ground_truth = exact_top_k(corpus, queries, self.k)
+        rows = []
+        try:
+            for config in configs:
+                print(f"\n构建临时索引: m={config['m']}, ef_construction={config['ef_construction']}, "
+                      f"量化={config['quantization']}, 维度={config['dims']}")
+                build_seconds = self.build_scratch_index(corpus, config)
+                if build_seconds is None:
+                    print("创建临时索引失败，跳过该配置")
+                    continue
+                warmup = truncate_matrix(queries[:self.warmup], config["dims"])
+                for query in warmup:
+                    self.es_setup.knn_ids(self.scratch_index, query.tolist(), self.k, max(num_candidates_list))
+                vector_mb = corpus.shape[0] * config["dims"] * QUANTIZATION_BYTES[config["quantization"]] / (1024 * 1024)
+                for num_candidates in sorted(set(num_candidates_list)):
+                    if num_candidates < self.k:
+                        continue
+                    row = {**config, "build_seconds": build_seconds, "vector_mb": vector_mb}
+                    row.update(self.measure(queries, ground_truth, config["dims"], num_candidates))
+                    rows.append(row)
+        finally:
+            self.es_setup.delete_index(self.scratch_index)
+        return rows
+
+
+def recommend(rows: List[Dict[str, Any]], target_recall: float) -> Optional[Dict[str, Any]]:
+    """
+    选择推荐配置
+
+    Args:
+        rows: sweep的结果
+        target_recall: 目标recall@k
+
+    Returns:
+        满足目标召回率且p95延迟最低的组合（相同时取向量内存更小者），都不满足时取召回率最高者
+    """
+    if not rows:
+        return None
+    qualified = [row for row in rows if row["recall"] >= target_recall]
+    if qualified:
+        return min(qualified, key=lambda row: (round(row["p95_ms"], 1), row["vector_mb"], row["num_candidates"]))
+    return max(rows, key=lambda row: (row["recall"], -row["p95_ms"]))
+
+
+def print_tuning_table(rows: List[Dict[str, Any]], k: int):
+    """打印召回率与延迟对照表"""
+    print(f"\n{'m':>4} | {'ef_c':>5} | {'量化':>5} | {'维度':>5} | {'候选数':>6} | {'recall@' + str(k):>10} | "
+          f"{'p50(ms)':>8} | {'p95(ms)':>8} | {'took p95':>8} | {'向量(MB)':>8}")
+    print("-" * 104)
+    for row in rows:
+        print(f"{row['m']:>4} | {row['ef_construction']:>5} | {row['quantization']:>5} | {row['dims']:>5} | "
+              f"{row['num_candidates']:>6} | {row['recall']:>10.4f} | {row['p50_ms']:>8.2f} | "
+              f"{row['p95_ms']:>8.2f} | {row['took_p95_ms']:>8.1f} | {row['vector_mb']:>8.2f}")
+
+
+def print_recommendation(row: Optional[Dict[str, Any]], target_recall: float, k: int, full_dims: int):
+    """打印推荐配置及对应的环境变量"""
+    if row is None:
+        print("\n没有可用的扫描结果")
+        return
+    if row["recall"] >= target_recall:
+        print(f"\n推荐配置（recall@{k} >= {target_recall} 中p95延迟最低）:")
+    else:
+        print(f"\n没有组合达到 recall@{k} >= {target_recall}，以下为召回率最高的组合:")
+    print(f"  recall@{k}={row['recall']:.4f}，p95={row['p95_ms']:.2f}ms，向量内存约 {row['vector_mb']:.2f}MB")
+    print(f"  ELASTICSEARCH_HNSW_M={row['m']}")
+    print(f"  ELASTICSEARCH_HNSW_EF_CONSTRUCTION={row['ef_construction']}")
+    print(f"  ELASTICSEARCH_VECTOR_QUANTIZATION={row['quantization']}")
+    if row["dims"] < full_dims:
+        print(f"  EMBEDDING_OUTPUT_DIMS={row['dims']}")
+    # 查询规划器在无过滤时使用 num_candidates = size * QUERY_PLANNER_CANDIDATE_FACTOR
+    print(f"  QUERY_PLANNER_CANDIDATE_FACTOR={math.ceil(row['num_candidates'] / k)}")
+
+
+def main():
+    """命令行入口"""
+    import argparse
+    import json
+
+    try:
+        from .config import load_env
+    except ImportError:
+        from config import load_env
+    load_env()
+
+    parser = argparse.ArgumentParser(description="以精确最近邻为基准扫描HNSW参数（召回率 vs 延迟）")
+    parser.add_argument("--cache-file", type=str,
+                        default=str(Path(__file__).parent / "cache" / "chunks_with_embeddings.json"),
+                        help="包含向量的chunk缓存文件（.json 或 .jsonl/.jsonl.zst）")
+    parser.add_argument("--max-vectors", type=int, help="最多加载的向量数")
+    parser.add_argument("--num-queries", type=int, default=200, help="从语料中抽出作为查询的向量数量")
+    parser.add_argument("--k", type=int, default=10, help="top-k")
+    parser.add_argument("--num-candidates", type=int, nargs="+", default=[20, 50, 100, 200, 500],
+                        help="要评估的num_candidates")
+    parser.add_argument("--m", type=int, nargs="+", default=[16], help="要评估的HNSW m")
+    parser.add_argument("--ef-construction", type=int, nargs="+", default=[100],
+                        help="要评估的HNSW ef_construction")
+    parser.add_argument("--quantization", type=str, nargs="+", choices=list(QUANTIZATION_BYTES),
+                        default=["none"], help="要评估的量化方式")
+    parser.add_argument("--dims", type=int, nargs="+", default=[],
+                        help="要额外评估的Matryoshka截断维度（全维度总是参与评估）")
+    parser.add_argument("--target-recall", type=float, default=0.95, help="推荐配置需要达到的recall@k")
+    parser.add_argument("--warmup", type=int, default=10, help="每个索引配置的预热查询数")
+    parser.add_argument("--scratch-index", type=str, default="ann_tuning_scratch",
+                        help="临时索引名称（已存在时会被删除）")
+    parser.add_argument("--output", type=str, help="将结果写入JSON文件")
+    args = parser.parse_args()
+
+    matrix = load_vectors(Path(args.cache_file), args.max_vectors)
+    corpus, queries = split_queries(matrix, args.num_queries)
+    full_dims = corpus.shape[1]
+    configs = index_configs(args.m, args.ef_construction, args.quantization, args.dims + [full_dims], full_dims)
+    print(f"语料向量: {corpus.shape[0]} × {full_dims} 维，查询: {queries.shape[0]}，"
+          f"索引配置: {len(configs)} 组 × {len(args.num_candidates)} 个候选数")
+
+    tuner = AnnTuner(scratch_index=args.scratch_index, k=args.k, warmup=args.warmup)
+    rows = tuner.sweep(corpus, queries, configs, args.num_candidates)
+    print_tuning_table(rows, args.k)
+    best = recommend(rows, args.target_recall)
+    print_recommendation(best, args.target_recall, args.k, full_dims)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"rows": rows, "recommended": best}, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
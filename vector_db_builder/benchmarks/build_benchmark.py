@@ -0,0 +1,377 @@
+"""
+构建流程基准测试：使用本地OpenAI模拟服务和ES替身测量 VectorDatabaseBuilder 五个阶段的性能
+
+对每个语料规模（合成名人列表）在独立子进程中依次执行 搜索→提取→标签→嵌入→索引，
+报告各阶段的吞吐、API调用次数、429次数、API延迟分位数（p50/p95/p99）和峰值RSS。
+
+用法:
+    python benchmarks/build_benchmark.py --sizes 100 1000 10000
+    python benchmarks/build_benchmark.py --sizes 100 --latency-ms 200 --jitter-ms 50 --rate-429 0.02
+    python benchmarks/build_benchmark.py --sizes 1000 --es-mode docker --output results.json
+"""
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+from queue import Empty
+from typing import Dict, Any, List
+
+import numpy as np
+
+BENCHMARK_DIR = Path(__file__).parent
+sys.path.insert(0, str(BENCHMARK_DIR))
+sys.path.insert(0, str(BENCHMARK_DIR.parent))
+
+from mock_openai_server import MockOpenAIServer
+from mock_elasticsearch import MockElasticsearch
+
+
+PROFESSIONS = [
+    "politicians", "scientists", "entrepreneurs", "artists", "athletes",
+    "actors_entertainers", "writers_philosophers", "activists", "educators",
+]
+
+ES_DOCKER_IMAGE = "docker.elastic.co/elasticsearch/elasticsearch:8.13.4"
+
+
+def generate_corpus(root: Path, num_celebrities: int) -> Path:
+    """
+    生成合成名人列表（与data_construct/celebrity_deeds相同的文件格式）
+
+    Args:
+        root: 输出目录
+        num_celebrities: 名人总数，平均分配到9个职业
+
+    Returns:
+        名人列表目录
+    """
+    data_dir = root / "celebrity_deeds"
+    data_dir.mkdir(parents=True, exist_ok=True)
+    for p, profession in enumerate(PROFESSIONS):
+        lines = [
+            f"Celebrity {i:05d}--名人{i:05d}"
+            for i in range(p, num_celebrities, len(PROFESSIONS))
+        ]
+        (data_dir / f"{profession}.txt").write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return data_dir
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """计算p50/p95/p99"""
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    arr = np.asarray(values, dtype=np.float64)
+    return {
+        "p50": float(np.percentile(arr, 50)),
+        "p95": float(np.percentile(arr, 95)),
+        "p99": float(np.percentile(arr, 99)),
+    }
+
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值RSS（MB）"""
+    # Linux上ru_maxrss跨execve保留：spawn的子进程会继承父进程（内含ES替身的全部文档）的峰值，
+    # 改读只统计本进程地址空间的VmHWM
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux返回KB，macOS返回字节
+    return usage / 1024 / 1024 if sys.platform == "darwin" else usage / 1024
+
+
+def _fetch_stats(stats_url: str) -> Dict[str, Any]:
+    with urllib.request.urlopen(stats_url) as response:
+        return json.loads(response.read())
+
+
+def _stats_delta(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+    """计算两次统计之间的API调用增量"""
+    calls = errors_429 = prompt_tokens = completion_tokens = 0
+    latencies = []
+    for route, entry in after.items():
+        previous = before.get(route, {"calls": 0, "errors_429": 0, "latencies_ms": [],
+                                       "prompt_tokens": 0, "completion_tokens": 0})
+        calls += entry["calls"] - previous["calls"]
+        errors_429 += entry["errors_429"] - previous["errors_429"]
+        prompt_tokens += entry["prompt_tokens"] - previous["prompt_tokens"]
+        completion_tokens += entry["completion_tokens"] - previous["completion_tokens"]
+        latencies.extend(entry["latencies_ms"][len(previous["latencies_ms"]):])
+    return {
+        "api_calls": calls,
+        "errors_429": errors_429,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "latency_ms": percentiles(latencies),
+    }
+
+
+def run_build(num_celebrities: int, env: Dict[str, str], stats_url: str,
+              workdir: str) -> Dict[str, Any]:
+    """
+    在当前进程中执行一次完整构建并记录各阶段指标（在子进程中调用）
+
+    Args:
+        num_celebrities: 名人数量
+        env: 指向模拟服务的环境变量
+        stats_url: 模拟OpenAI服务的统计接口
+        workdir: 工作目录（合成语料和缓存）
+
+    Returns:
+        各阶段指标
+    """
+    os.environ.update(env)
+
+    from search_celebrity_experiences import CelebrityExperienceSearcher
+    from extract_structured_data import StructuredDataExtractor
+    from tag_matching import TagMatcher
+    from text_processing import TextProcessor
+    from elasticsearch_setup import ElasticsearchSetup
+
+    data_dir = generate_corpus(Path(workdir), num_celebrities)
+    index_name = env["ELASTICSEARCH_INDEX"]
+
+    searcher = CelebrityExperienceSearcher()
+    extractor = StructuredDataExtractor()
+    tag_matcher = TagMatcher()
+    text_processor = TextProcessor()
+    es_setup = ElasticsearchSetup()
+
+    stages = []
+    state = {}
+
+    def run_stage(name: str, fn, count_items):
+        before = _fetch_stats(stats_url)
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        items = count_items(result)
+        stage = {
+            "stage": name,
+            "items": items,
+            "seconds": elapsed,
+            "items_per_sec": items / elapsed if elapsed > 0 else 0.0,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        stage.update(_stats_delta(before, _fetch_stats(stats_url)))
+        stages.append(stage)
+        return result
+
+    state["search"] = run_stage(
+        "search", lambda: searcher.search_all_celebrities(str(data_dir)),
+        lambda result: sum(len(v) for v in result.values()),
+    )
+    state["experiences"] = run_stage(
+        "extract", lambda: extractor.extract_all(state["search"]), len,
+    )
+    state["experiences"] = run_stage(
+        "tags", lambda: tag_matcher.match_all_experiences(state["experiences"], use_llm=True), len,
+    )
+    state["chunks"] = run_stage(
+        "embed", lambda: text_processor.process_all_experiences(state["experiences"], max_tokens=500), len,
+    )
+
+    def index_stage():
+        dims = next((len(c.embedding) for c in state["chunks"] if len(c.embedding)), text_processor.dims)
+        es_setup.create_index(index_name, delete_existing=True, dims=dims)
+        return es_setup.index_chunks(index_name, state["experiences"], state["chunks"])
+
+    run_stage("index", index_stage, lambda count: count)
+
+    return {
+        "num_celebrities": num_celebrities,
+        "num_experiences": len(state["experiences"]),
+        "num_chunks": len(state["chunks"]),
+        "total_seconds": sum(stage["seconds"] for stage in stages),
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": stages,
+    }
+
+
+def wait_for_child(queue, process, num_celebrities: int, poll_interval: float = 1.0) -> Dict[str, Any]:
+    """
+    等待子进程返回结果；子进程异常退出（没有写入结果）时返回错误记录而不是一直阻塞
+
+    Args:
+        queue: 子进程写入结果的队列
+        process: 子进程
+        num_celebrities: 语料规模（用于错误记录）
+        poll_interval: 检查子进程存活的间隔（秒）
+
+    Returns:
+        子进程的构建结果或错误记录
+    """
+    while True:
+        try:
+            return queue.get(timeout=poll_interval)
+        except Empty:
+            if not process.is_alive():
+                # 退出前刚写入的结果可能还在管道中
+                try:
+                    return queue.get(timeout=poll_interval)
+                except Empty:
+                    return {"num_celebrities": num_celebrities,
+                            "error": f"子进程异常退出（exitcode={process.exitcode}）"}
+
+
+def _child_main(queue, num_celebrities, env, stats_url, workdir):
+    try:
+        queue.put(run_build(num_celebrities, env, stats_url, workdir))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        queue.put({"num_celebrities": num_celebrities, "error": f"{type(e).__name__}: {e}"})
+
+
+class DockerElasticsearch:
+    """一次性ES容器（基准测试结束后删除）"""
+
+    def __init__(self, port: int = 9250, image: str = ES_DOCKER_IMAGE):
+        self.port = port
+        self.image = image
+        self.container_id = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout: float = 120.0) -> "DockerElasticsearch":
+        self.container_id = subprocess.check_output([
+            "docker", "run", "-d", "--rm",
+            "-p", f"{self.port}:9200",
+            "-e", "discovery.type=single-node",
+            "-e", "xpack.security.enabled=false",
+            "-e", "ES_JAVA_OPTS=-Xms512m -Xmx512m",
+            self.image,
+        ], text=True).strip()
+        print(f"已启动ES容器 {self.container_id[:12]}，等待就绪...")
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                with urllib.request.urlopen(f"{self.url}/_cluster/health?wait_for_status=yellow&timeout=1s") as r:
+                    if r.status == 200:
+                        return self
+            except Exception:
+                time.sleep(1)
+        self.stop()
+        raise TimeoutError(f"ES容器在 {timeout} 秒内未就绪")
+
+    def stop(self):
+        if self.container_id:
+            subprocess.run(["docker", "stop", self.container_id], capture_output=True)
+            self.container_id = None
+
+
+def print_report(results: List[Dict[str, Any]]):
+    """打印各规模各阶段的指标表"""
+    header = (f"{'名人数':>7} | {'阶段':<7} | {'条目':>7} | {'耗时(s)':>8} | {'条目/s':>8} | "
+              f"{'API调用':>7} | {'429':>5} | {'p50(ms)':>8} | {'p95(ms)':>8} | {'p99(ms)':>8} | {'峰值RSS(MB)':>10}")
+    print("\n" + header)
+    print("-" * len(header))
+    for result in results:
+        if "error" in result:
+            print(f"{result['num_celebrities']:>7} | 失败: {result['error']}")
+            continue
+        for stage in result["stages"]:
+            latency = stage["latency_ms"]
+            print(f"{result['num_celebrities']:>7} | {stage['stage']:<7} | {stage['items']:>7} | "
+                  f"{stage['seconds']:>8.2f} | {stage['items_per_sec']:>8.1f} | {stage['api_calls']:>7} | "
+                  f"{stage['errors_429']:>5} | {latency['p50']:>8.1f} | {latency['p95']:>8.1f} | "
+                  f"{latency['p99']:>8.1f} | {stage['peak_rss_mb']:>10.1f}")
+        print(f"{result['num_celebrities']:>7} | 合计: {result['total_seconds']:.2f}s，"
+              f"{result['num_experiences']} 条经历，{result['num_chunks']} 个chunks")
+
+
+def main():
+    """命令行入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="构建流程端到端基准测试（本地模拟服务）")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="合成语料的名人数量")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="模拟API平均延迟（毫秒）")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="模拟API延迟标准差（毫秒）")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="模拟API返回429的概率")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429的Retry-After秒数")
+    parser.add_argument("--experiences-per-celebrity", type=int, default=4,
+                        help="每位名人模拟提取出的经历数量")
+    parser.add_argument("--dims", type=int, default=1024, help="模拟嵌入向量维度")
+    parser.add_argument("--es-mode", choices=["stub", "docker", "external"], default="stub",
+                        help="stub: 内存ES替身; docker: 一次性ES容器; external: 使用ELASTICSEARCH_HOST")
+    parser.add_argument("--output", type=str, help="将结果写入JSON文件")
+
+    args = parser.parse_args()
+
+    openai_server = MockOpenAIServer(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_429=args.rate_429,
+        retry_after=args.retry_after, embedding_dims=args.dims,
+        experiences_per_celebrity=args.experiences_per_celebrity,
+    ).start()
+
+    es_server = None
+    if args.es_mode == "stub":
+        es_server = MockElasticsearch().start()
+        es_url = es_server.url
+    elif args.es_mode == "docker":
+        es_server = DockerElasticsearch().start()
+        es_url = es_server.url
+    else:
+        es_url = os.getenv("ELASTICSEARCH_HOST", "localhost")
+
+    print(f"模拟OpenAI服务: {openai_server.url}")
+    print(f"ElasticSearch ({args.es_mode}): {es_url}")
+
+    stats_url = openai_server.url.rsplit("/v1", 1)[0] + "/stats"
+    context = multiprocessing.get_context("spawn")
+    results = []
+    try:
+        for size in args.sizes:
+            env = {
+                "OPENROUTER_API_KEY": "benchmark",
+                "OPENROUTER_BASE_URL": openai_server.url,
+                "EMBEDDING_API_KEY": "benchmark",
+                "EMBEDDING_API_BASE_URL": openai_server.url,
+                "EMBEDDING_MODEL": "mock-embedding",
+                "EMBEDDING_DIMS": str(args.dims),
+                "ELASTICSEARCH_HOST": es_url,
+                "ELASTICSEARCH_INDEX": f"benchmark_{size}",
+            }
+            workdir = tempfile.mkdtemp(prefix=f"inspirematch_bench_{size}_")
+            print(f"\n===== 语料规模: {size} 位名人 =====")
+            try:
+                queue = context.Queue()
+                process = context.Process(
+                    target=_child_main, args=(queue, size, env, stats_url, workdir)
+                )
+                process.start()
+                result = wait_for_child(queue, process, size)
+                process.join()
+                results.append(result)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        openai_server.stop()
+        if es_server is not None:
+            es_server.stop()
+
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+导入耗时检查：在全新的子进程中测量包和查询脚本的冷启动导入时间
+
+每个场景重复运行取中位数，超过预算或加载了不应加载的重依赖（openai/tiktoken）时以非0状态退出，
+可以直接放进CI。失败时打印 -X importtime 中最慢的浅层模块，便于定位是谁引入了重依赖。
+
+用法:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --budget 0.8 --repeat 7 --top 15
+"""
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, Any, List
+
+PACKAGE_DIR = Path(__file__).resolve().parent.parent
+PROJECT_ROOT = PACKAGE_DIR.parent
+
+# 只做查询时不应加载的模块
+HEAVY_MODULES = ["openai", "tiktoken"]
+
+# (名称, 工作目录, 导入语句, 预算倍数)
+SCENARIOS = [
+    ("import vector_db_builder", PROJECT_ROOT, "import vector_db_builder", 0.1),
+    ("import vector_search_example", PACKAGE_DIR, "import vector_search_example", 1.0),
+    ("TextProcessor() for a query", PACKAGE_DIR,
+     "from text_processing import TextProcessor; TextProcessor(api_key='x')", 1.0),
+]
+
+CHILD_TEMPLATE = """
+import contextlib, io, json, sys, time
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    {statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def parse_importtime(stderr: str, max_depth: int = 1) -> List[tuple]:
+    """
+    解析 -X importtime 输出中浅层的模块（被测模块本身及其直接导入的模块）
+
+    Args:
+        stderr: 子进程的标准错误输出
+        max_depth: 保留的最大嵌套深度（0为顶层）
+
+    Returns:
+        [(模块名, 累计耗时秒)]，按耗时降序
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # 顶层模块名前有一个空格，每深一层多两个空格
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if depth <= max_depth:
+            modules.append(("  " * depth + name.strip(), int(cumulative) / 1e6))
+    return sorted(modules, key=lambda item: item[1], reverse=True)
+
+
+def measure(cwd: Path, statement: str, repeat: int) -> Dict[str, Any]:
+    """
+    在全新子进程中重复执行导入语句
+
+    Args:
+        cwd: 工作目录
+        statement: 导入语句
+        repeat: 重复次数
+
+    Returns:
+        中位数耗时、各次耗时、加载的重依赖和最慢的浅层模块
+    """
+    code = CHILD_TEMPLATE.format(statement=statement, heavy=HEAVY_MODULES)
+    timings, loaded, slowest = [], set(), []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=cwd, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"子进程执行失败: {statement}\n{result.stderr[-2000:]}")
+        data = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(data["elapsed"])
+        loaded.update(data["loaded"])
+        slowest = parse_importtime(result.stderr)
+    return {
+        "median_s": statistics.median(timings),
+        "timings_s": timings,
+        "heavy_modules_loaded": sorted(loaded),
+        "slowest_modules": slowest,
+    }
+
+
+def main():
+    """命令行入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="冷启动导入耗时检查")
+    parser.add_argument("--budget", type=float, default=1.0, help="查询路径的导入耗时预算（秒）")
+    parser.add_argument("--repeat", type=int, default=5, help="每个场景的重复次数（取中位数）")
+    parser.add_argument("--top", type=int, default=10, help="失败时打印最慢的模块数量")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'场景':<32} | {'中位数(s)':>9} | {'预算(s)':>7} | 重依赖")
+    print("-" * 70)
+    for name, cwd, statement, factor in SCENARIOS:
+        result = measure(cwd, statement, args.repeat)
+        budget = args.budget * factor
+        over_budget = result["median_s"] > budget
+        heavy = result["heavy_modules_loaded"]
+        status = "✗" if over_budget or heavy else "✓"
+        print(f"{name:<32} | {result['median_s']:>9.3f} | {budget:>7.2f} | "
+              f"{', '.join(heavy) or '-'} {status}")
+        if over_budget or heavy:
+            failed = True
+            for module, seconds in result["slowest_modules"][:args.top]:
+                print(f"    {seconds * 1000:>8.1f} ms  {module}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
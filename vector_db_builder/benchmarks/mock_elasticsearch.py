@@ -0,0 +1,749 @@
+"""
+本地ElasticSearch替身：基准测试用的内存实现
+
+只实现构建和查询流程用到的接口子集（索引增删、_bulk、_search、_msearch、_mget、_count、_refresh、terms聚合、
+PIT + search_after + slice、文件系统快照仓库、集群健康），
+kNN和script_score使用NumPy暴力检索。用于在没有真实集群的环境中测量客户端侧的吞吐和开销，
+其延迟特性不代表真实ES，需要真实数据时请使用 build_benchmark.py --es-mode docker。
+"""
+import json
+import re
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+
+ES_VERSION = "8.13.4"
+
+
+def _get_path(source: Dict[str, Any], path: str):
+    """按点号路径取字段值"""
+    value = source
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _matches(source: Dict[str, Any], query: Optional[Dict[str, Any]]) -> bool:
+    """判断文档是否满足过滤条件（支持term/terms/ids/bool/match_all）"""
+    if not query:
+        return True
+    if isinstance(query, list):
+        return all(_matches(source, item) for item in query)
+    if "match_all" in query:
+        return True
+    if "term" in query:
+        field, value = next(iter(query["term"].items()))
+        value = value.get("value") if isinstance(value, dict) else value
+        actual = _get_path(source, field)
+        return value in actual if isinstance(actual, list) else actual == value
+    if "terms" in query:
+        field, values = next((k, v) for k, v in query["terms"].items() if k != "boost")
+        actual = _get_path(source, field)
+        actual = actual if isinstance(actual, list) else [actual]
+        return any(value in actual for value in values)
+    if "bool" in query:
+        clause = query["bool"]
+        for key in ("must", "filter"):
+            if key in clause and not _matches(source, clause[key]):
+                return False
+        should = clause.get("should")
+        if should:
+            should = should if isinstance(should, list) else [should]
+            if not any(_matches(source, item) for item in should):
+                return False
+        must_not = clause.get("must_not")
+        if must_not:
+            must_not = must_not if isinstance(must_not, list) else [must_not]
+            if any(_matches(source, item) for item in must_not):
+                return False
+        return True
+    # 其他查询类型（multi_match、script_score等）不做过滤
+    return True
+
+
+def _find_script_score(query: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """在bool.must / nested.query中查找script_score子句"""
+    if not isinstance(query, dict):
+        return None
+    if "script_score" in query:
+        return query["script_score"]
+    if "nested" in query:
+        return _find_script_score(query["nested"].get("query"))
+    must = query.get("bool", {}).get("must")
+    for item in must if isinstance(must, list) else [must]:
+        found = _find_script_score(item)
+        if found:
+            return found
+    return None
+
+
+def _apply_source_filter(source: Dict[str, Any], source_filter, prefix: str = "") -> Dict[str, Any]:
+    """处理_source的excludes（支持一级嵌套路径，如chunks.embedding；nested inner_hits传入prefix="chunks."）"""
+    if source_filter is False:
+        return {}
+    if not isinstance(source_filter, dict):
+        return source
+    excludes = source_filter.get("excludes", [])
+    if not excludes:
+        return source
+    result = dict(source)
+    for path in excludes:
+        if prefix and path.startswith(prefix):
+            path = path[len(prefix):]
+        head, _, tail = path.partition(".")
+        if not tail:
+            result.pop(head, None)
+        elif isinstance(result.get(head), list):
+            result[head] = [{k: v for k, v in item.items() if k != tail} for item in result[head]]
+        elif isinstance(result.get(head), dict):
+            result[head] = {k: v for k, v in result[head].items() if k != tail}
+    return result
+
+
+class MockIndex:
+    """单个内存索引"""
+
+    def __init__(self, name: str, mappings: Dict[str, Any], settings: Dict[str, Any]):
+        self.name = name
+        self.mappings = mappings or {}
+        self.settings = settings or {}
+        self.docs = {}
+        self.closed = False
+        self.version = 0
+        self._auto_id = 0
+        self._vector_cache = {}
+
+    def put(self, doc_id: Optional[str], source: Dict[str, Any]) -> tuple:
+        if doc_id is None:
+            self._auto_id += 1
+            doc_id = f"auto-{self._auto_id}"
+        created = doc_id not in self.docs
+        self.docs[doc_id] = source
+        self.version += 1
+        return doc_id, created
+
+    def _field_mapping(self, field: str) -> Dict[str, Any]:
+        properties = self.mappings.get("properties", {})
+        mapping = {}
+        for part in field.split("."):
+            mapping = properties.get(part, {})
+            properties = mapping.get("properties", {})
+        return mapping
+
+    def _is_nested(self, field: str) -> bool:
+        head = field.split(".")[0]
+        return "." in field and self.mappings.get("properties", {}).get(head, {}).get("type") == "nested"
+
+    def vectors(self, field: str) -> tuple:
+        """
+        返回(文档ID列表, 行所属文档下标, 向量矩阵, nested对象下标)，按写入版本缓存
+        """
+        cached = self._vector_cache.get(field)
+        if cached and cached[0] == self.version:
+            return cached[1]
+
+        doc_ids, owners, rows, inner_offsets = [], [], [], []
+        nested = self._is_nested(field)
+        head, _, tail = field.partition(".")
+        for doc_id, source in self.docs.items():
+            if nested:
+                items = source.get(head) or []
+                vectors = [(offset, item.get(tail)) for offset, item in enumerate(items)]
+            else:
+                vectors = [(None, _get_path(source, field))]
+            vectors = [(offset, v) for offset, v in vectors if v]
+            if not vectors:
+                continue
+            doc_ids.append(doc_id)
+            for offset, vector in vectors:
+                owners.append(len(doc_ids) - 1)
+                inner_offsets.append(offset)
+                rows.append(vector)
+
+        matrix = np.asarray(rows, dtype=np.float32) if rows else np.zeros((0, 1), dtype=np.float32)
+        result = (doc_ids, np.asarray(owners, dtype=np.int64), matrix, inner_offsets)
+        self._vector_cache[field] = (self.version, result)
+        return result
+
+    def similarity_scores(self, field: str, query_vector: List[float]) -> tuple:
+        doc_ids, owners, matrix, inner_offsets = self.vectors(field)
+        if matrix.shape[0] == 0:
+            return doc_ids, owners, np.zeros(0, dtype=np.float32), inner_offsets
+        query = np.asarray(query_vector, dtype=np.float32)
+        raw = matrix @ query
+        if self._field_mapping(field).get("similarity", "cosine") == "cosine":
+            norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+            norms[norms == 0] = 1.0
+            raw = raw / norms
+        return doc_ids, owners, (1.0 + raw) / 2.0, inner_offsets
+
+
+class MockElasticsearch:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        """
+        初始化ES替身
+
+        Args:
+            host: 监听地址
+            port: 监听端口（0表示自动分配）
+        """
+        self.indices = {}
+        # PIT ID -> 打开时刻各索引文档的快照 [(索引名, 文档ID, _source), ...]
+        self.pits = {}
+        # 快照仓库名 -> {"settings": 仓库设置, "snapshots": {快照名: (快照信息, {索引名: MockIndex副本})}}
+        self.repositories = {}
+        self._lock = threading.RLock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockElasticsearch":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    # ------------------------------------------------------------------
+    # 接口实现
+    # ------------------------------------------------------------------
+
+    def _bulk(self, default_index: Optional[str], payload: bytes) -> Dict[str, Any]:
+        lines = [line for line in payload.decode("utf-8").split("\n") if line.strip()]
+        items = []
+        errors = False
+        i = 0
+        with self._lock:
+            while i < len(lines):
+                action = json.loads(lines[i])
+                op, meta = next(iter(action.items()))
+                index_name = meta.get("_index", default_index)
+                source = json.loads(lines[i + 1]) if op in ("index", "create") else None
+                i += 2 if source is not None else 1
+
+                index = self.indices.get(index_name)
+                if index is None:
+                    index = self.indices[index_name] = MockIndex(index_name, {}, {})
+                if op in ("index", "create"):
+                    doc_id, created = index.put(meta.get("_id"), source)
+                    items.append({op: {
+                        "_index": index_name, "_id": doc_id,
+                        "status": 201 if created else 200,
+                        "result": "created" if created else "updated",
+                    }})
+                elif op == "delete":
+                    existed = index.docs.pop(meta.get("_id"), None) is not None
+                    index.version += 1
+                    items.append({op: {"_index": index_name, "_id": meta.get("_id"),
+                                       "status": 200 if existed else 404}})
+                else:
+                    errors = True
+                    items.append({op: {"_index": index_name, "status": 400,
+                                       "error": {"type": "illegal_argument_exception",
+                                                 "reason": f"unsupported bulk op {op}"}}})
+        return {"took": 1, "errors": errors, "items": items}
+
+    def _search(self, index_name: str, body: Dict[str, Any], params: Dict[str, str]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        size = int(body.get("size", params.get("size", 10)))
+        from_ = int(body.get("from", params.get("from", 0)))
+        source_filter = body.get("_source", True)
+
+        with self._lock:
+            indices = [self.indices[name] for name in index_name.split(",") if name in self.indices]
+            hits = []
+            for index in indices:
+                hits.extend(self._search_index(index, body))
+
+        hits.sort(key=lambda hit: hit["_score"] if hit["_score"] is not None else 0.0, reverse=True)
+        total = len(hits)
+        collapse = body.get("collapse")
+        if collapse:
+            # 折叠：每个字段值只保留得分最高的一条（hits.total仍为折叠前的数量）
+            seen = set()
+            collapsed = []
+            for hit in hits:
+                value = _get_path(hit["_source"], collapse["field"])
+                key = json.dumps(value, sort_keys=True)
+                if key not in seen:
+                    seen.add(key)
+                    hit["fields"] = {collapse["field"]: [value]}
+                    collapsed.append(hit)
+            hits = collapsed
+        page = hits[from_:from_ + size]
+        for hit in page:
+            hit["_source"] = _apply_source_filter(hit["_source"], source_filter)
+
+        response = {
+            "took": int((time.perf_counter() - start) * 1000),
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {
+                "total": {"value": total, "relation": "eq"},
+                "max_score": page[0]["_score"] if page else None,
+                "hits": page,
+            },
+        }
+        aggs = body.get("aggs") or body.get("aggregations")
+        if aggs:
+            response["aggregations"] = self._terms_aggregations(hits, aggs)
+        return response
+
+    def _open_pit(self, index_name: str) -> Dict[str, Any]:
+        with self._lock:
+            snapshot = [
+                (name, doc_id, source)
+                for name in index_name.split(",")
+                for doc_id, source in self.indices[name].docs.items()
+            ]
+            pit_id = uuid.uuid4().hex
+            self.pits[pit_id] = snapshot
+        return {"id": pit_id}
+
+    def _pit_search(self, body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """PIT检索：按快照中的顺序（_shard_doc）分页，支持search_after和slice，不打分"""
+        start = time.perf_counter()
+        pit_id = body["pit"]["id"]
+        with self._lock:
+            snapshot = self.pits.get(pit_id)
+        if snapshot is None:
+            return None
+        size = int(body.get("size", 10))
+        after = body.get("search_after", [-1])[0]
+        slicing = body.get("slice")
+        query = body.get("query")
+        page = []
+        for position in range(after + 1, len(snapshot)):
+            index_name, doc_id, source = snapshot[position]
+            if slicing and zlib.crc32(doc_id.encode("utf-8")) % slicing["max"] != slicing["id"]:
+                continue
+            if not _matches(source, query):
+                continue
+            page.append({"_index": index_name, "_id": doc_id, "_score": None,
+                         "_source": _apply_source_filter(source, body.get("_source", True)),
+                         "sort": [position]})
+            if len(page) >= size:
+                break
+        return {
+            "pit_id": pit_id,
+            "took": int((time.perf_counter() - start) * 1000),
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": {"value": len(page), "relation": "gte"}, "max_score": None, "hits": page},
+        }
+
+    def _snapshot(self, method: str, parts: List[str], body: Dict[str, Any]) -> tuple:
+        """快照接口：注册仓库、创建/列出/删除快照、恢复（总是同步完成），返回 (状态码, 响应)"""
+        def error(status: int, error_type: str, reason: str) -> tuple:
+            return status, {"error": {"type": error_type, "reason": reason}, "status": status}
+
+        with self._lock:
+            if len(parts) == 1 and method in ("PUT", "POST"):
+                repository = self.repositories.setdefault(parts[0], {"snapshots": {}})
+                repository["settings"] = body
+                return 200, {"acknowledged": True}
+            repository = self.repositories.get(parts[0]) if parts else None
+            if repository is None:
+                return error(404, "repository_missing_exception", f"[{parts[0] if parts else ''}] missing")
+            snapshots = repository["snapshots"]
+            if len(parts) == 1:
+                return 200, {parts[0]: repository["settings"]}
+
+            name = parts[1]
+            if method == "GET":
+                infos = [info for info, _ in snapshots.values()] if name == "_all" else (
+                    [snapshots[name][0]] if name in snapshots else None
+                )
+                if infos is None:
+                    return error(404, "snapshot_missing_exception", f"[{parts[0]}:{name}] is missing")
+                return 200, {"snapshots": infos, "total": len(infos), "remaining": 0}
+            if method == "DELETE":
+                if snapshots.pop(name, None) is None:
+                    return error(404, "snapshot_missing_exception", f"[{parts[0]}:{name}] is missing")
+                return 200, {"acknowledged": True}
+
+            if len(parts) == 3 and parts[2] == "_restore":
+                if name not in snapshots:
+                    return error(404, "snapshot_missing_exception", f"[{parts[0]}:{name}] is missing")
+                info, saved = snapshots[name]
+                wanted = body.get("indices", ",".join(saved))
+                wanted = wanted.split(",") if isinstance(wanted, str) else wanted
+                # 与ES一致：关闭的索引可以被快照覆盖，打开的同名索引会被拒绝
+                existing = [index_name for index_name in wanted
+                            if index_name in self.indices and not self.indices[index_name].closed]
+                if existing:
+                    return error(500, "snapshot_restore_exception",
+                                 f"cannot restore index [{existing[0]}] because an open index with same name "
+                                 f"already exists in the cluster")
+                for index_name in wanted:
+                    index = saved[index_name]
+                    restored = MockIndex(index_name, index.mappings, index.settings)
+                    restored.docs = dict(index.docs)
+                    self.indices[index_name] = restored
+                shards = {"total": len(wanted), "failed": 0, "successful": len(wanted)}
+                return 200, {"snapshot": {"snapshot": name, "indices": wanted, "shards": shards}}
+
+            if name in snapshots:
+                return error(400, "invalid_snapshot_name_exception",
+                             f"[{parts[0]}:{name}] Invalid snapshot name [{name}], snapshot with the same name "
+                             f"already exists")
+            wanted = body.get("indices") or ",".join(self.indices)
+            wanted = wanted.split(",") if isinstance(wanted, str) else wanted
+            missing = [index_name for index_name in wanted if index_name not in self.indices]
+            if missing:
+                return error(404, "index_not_found_exception", f"no such index [{missing[0]}]")
+            saved = {}
+            for index_name in wanted:
+                index = self.indices[index_name]
+                saved[index_name] = MockIndex(index_name, index.mappings, index.settings)
+                saved[index_name].docs = dict(index.docs)
+            now = int(time.time() * 1000)
+            info = {"snapshot": name, "uuid": uuid.uuid4().hex, "indices": wanted, "state": "SUCCESS",
+                    "metadata": body.get("metadata"), "start_time_in_millis": now, "end_time_in_millis": now,
+                    "shards": {"total": len(wanted), "failed": 0, "successful": len(wanted)}}
+            snapshots[name] = (info, saved)
+            return 200, {"snapshot": info}
+
+    @staticmethod
+    def _terms_aggregations(hits: List[Dict[str, Any]], aggs: Dict[str, Any]) -> Dict[str, Any]:
+        """terms聚合（只支持field和size）"""
+        result = {}
+        for name, agg in aggs.items():
+            terms = agg.get("terms")
+            if not terms:
+                continue
+            counts = {}
+            for hit in hits:
+                value = _get_path(hit["_source"], terms["field"])
+                for item in value if isinstance(value, list) else [value]:
+                    if item is not None:
+                        counts[item] = counts.get(item, 0) + 1
+            ranked = sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))
+            top = ranked[:terms.get("size", 10)]
+            result[name] = {
+                "doc_count_error_upper_bound": 0,
+                "sum_other_doc_count": sum(count for _, count in ranked[len(top):]),
+                "buckets": [{"key": key, "doc_count": count} for key, count in top],
+            }
+        return result
+
+    def _msearch(self, default_index: Optional[str], payload: bytes) -> Dict[str, Any]:
+        lines = [json.loads(line) for line in payload.decode("utf-8").split("\n") if line.strip()]
+        responses = []
+        for header, body in zip(lines[0::2], lines[1::2]):
+            index_name = header.get("index", default_index)
+            if isinstance(index_name, list):
+                index_name = ",".join(index_name)
+            with self._lock:
+                missing = [name for name in index_name.split(",") if name not in self.indices]
+            if missing:
+                responses.append({"error": {"type": "index_not_found_exception",
+                                            "reason": f"no such index [{missing[0]}]"}, "status": 404})
+                continue
+            response = self._search(index_name, body, {})
+            response["status"] = 200
+            responses.append(response)
+        return {"took": sum(r.get("took", 0) for r in responses), "responses": responses}
+
+    def _search_index(self, index: MockIndex, body: Dict[str, Any]) -> List[Dict[str, Any]]:
+        knn = body.get("knn")
+        query = body.get("query")
+
+        if knn:
+            knn = knn[0] if isinstance(knn, list) else knn
+            field = knn["field"]
+            doc_ids, owners, scores, inner_offsets = index.similarity_scores(field, knn["query_vector"])
+            best = {}
+            for row, owner in enumerate(owners.tolist()):
+                doc_id = doc_ids[owner]
+                if not _matches(index.docs[doc_id], knn.get("filter")):
+                    continue
+                if doc_id not in best or scores[row] > best[doc_id][0]:
+                    best[doc_id] = (float(scores[row]), inner_offsets[row])
+            ranked = sorted(best.items(), key=lambda item: item[1][0], reverse=True)[:knn.get("k", 10)]
+
+            hits = []
+            head = field.split(".")[0]
+            for doc_id, (score, offset) in ranked:
+                if query and not _matches(index.docs[doc_id], query):
+                    continue
+                hit = {"_index": index.name, "_id": doc_id, "_score": score,
+                       "_source": index.docs[doc_id]}
+                if offset is not None and "inner_hits" in knn:
+                    inner_source = _apply_source_filter(
+                        index.docs[doc_id][head][offset], knn["inner_hits"].get("_source", True), f"{head}."
+                    )
+                    hit["inner_hits"] = {head: {"hits": {
+                        "total": {"value": 1, "relation": "eq"},
+                        "hits": [{"_index": index.name, "_id": doc_id,
+                                  "_nested": {"field": head, "offset": offset},
+                                  "_score": score, "_source": inner_source}],
+                    }}}
+                hits.append(hit)
+            return hits
+
+        script = _find_script_score(query)
+        if script:
+            return self._script_score_hits(index, query, script)
+
+        return [
+            {"_index": index.name, "_id": doc_id, "_score": self._text_score(source, query),
+             "_source": source}
+            for doc_id, source in index.docs.items()
+            if _matches(source, query)
+        ]
+
+    @staticmethod
+    def _script_score_hits(index: MockIndex, query: Dict[str, Any],
+                           script: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """script_score精确打分（只支持基于cosineSimilarity/dotProduct的 (sim + 1.0) 和 (sim + 1.0) / 2.0，nested取最大值）"""
+        source = script["script"]["source"]
+        field = re.search(r"'([^']+)'", source).group(1)
+        doc_ids, owners, scores, _ = index.similarity_scores(field, script["script"]["params"]["query_vector"])
+        # similarity_scores返回 (1 + sim) / 2，脚本不除以2时得分为 sim + 1
+        scale = 1.0 if "/ 2.0" in source else 2.0
+        best = {}
+        for row, owner in enumerate(owners.tolist()):
+            doc_id = doc_ids[owner]
+            score = float(scores[row]) * scale
+            if score > best.get(doc_id, -1.0):
+                best[doc_id] = score
+        return [
+            {"_index": index.name, "_id": doc_id, "_score": score, "_source": index.docs[doc_id]}
+            for doc_id, score in best.items()
+            if _matches(index.docs[doc_id], query)
+        ]
+
+    @staticmethod
+    def _text_score(source: Dict[str, Any], query: Optional[Dict[str, Any]]) -> float:
+        """multi_match的简化打分：查询字符在字段文本中的覆盖率"""
+        if not query or "multi_match" not in query:
+            return 1.0
+        text = query["multi_match"].get("query", "")
+        fields = query["multi_match"].get("fields", [])
+        content = " ".join(str(_get_path(source, field) or "") for field in fields)
+        if not text:
+            return 0.0
+        return sum(1 for char in set(text) if char in content) / len(set(text))
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # keep-alive下头部和正文分两次写出，不关闭Nagle时每个请求都要等约40ms的延迟ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, payload: Any = None):
+                data = json.dumps(payload).encode("utf-8") if payload is not None else b""
+                self.send_response(status)
+                self.send_header("X-Elastic-Product", "Elasticsearch")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(data)
+
+            def _read(self) -> bytes:
+                length = int(self.headers.get("Content-Length", 0))
+                return self.rfile.read(length) if length else b""
+
+            def _route(self):
+                parsed = urlparse(self.path)
+                parts = [part for part in parsed.path.split("/") if part]
+                params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+                return parts, params
+
+            def _not_found(self, index_name: str):
+                self._send(404, {"error": {"type": "index_not_found_exception",
+                                           "reason": f"no such index [{index_name}]"},
+                                 "status": 404})
+
+            def do_HEAD(self):
+                parts, _ = self._route()
+                if not parts:
+                    self._send(200)
+                    return
+                with server._lock:
+                    exists = all(name in server.indices for name in parts[0].split(","))
+                self._send(200 if exists else 404)
+
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+            def do_PUT(self):
+                self._handle()
+
+            def do_DELETE(self):
+                parts, _ = self._route()
+                raw = self._read()
+                if parts == ["_pit"]:
+                    pit_id = json.loads(raw).get("id") if raw else None
+                    with server._lock:
+                        freed = server.pits.pop(pit_id, None) is not None
+                    self._send(200 if freed else 404, {"succeeded": freed, "num_freed": int(freed)})
+                    return
+                if parts and parts[0] == "_snapshot":
+                    self._send(*server._snapshot("DELETE", parts[1:], {}))
+                    return
+                with server._lock:
+                    if parts and parts[0] in server.indices:
+                        del server.indices[parts[0]]
+                        self._send(200, {"acknowledged": True})
+                    else:
+                        self._not_found(parts[0] if parts else "")
+
+            def _handle(self):
+                parts, params = self._route()
+                raw = self._read()
+
+                if not parts:
+                    self._send(200, {
+                        "name": "mock-es",
+                        "cluster_name": "mock-cluster",
+                        "version": {"number": ES_VERSION, "build_flavor": "default"},
+                        "tagline": "You Know, for Search",
+                    })
+                    return
+
+                if parts[-1] == "_bulk":
+                    self._send(200, server._bulk(parts[0] if len(parts) > 1 else None, raw))
+                    return
+
+                if parts[-1] == "_msearch":
+                    self._send(200, server._msearch(parts[0] if len(parts) > 1 else None, raw))
+                    return
+
+                body = json.loads(raw) if raw else {}
+
+                if parts[0] == "_snapshot":
+                    self._send(*server._snapshot(self.command, parts[1:], body))
+                    return
+
+                if parts[0] == "_cluster":
+                    # 单节点、副本数为0，索引总是green
+                    self._send(200, {"cluster_name": "mock-cluster", "status": "green", "timed_out": False,
+                                     "number_of_nodes": 1})
+                    return
+
+                if parts == ["_search"] and "pit" in body:
+                    result = server._pit_search(body)
+                    if result is None:
+                        self._send(404, {"error": {"type": "search_context_missing_exception",
+                                                   "reason": "No search context found"}, "status": 404})
+                    else:
+                        self._send(200, result)
+                    return
+
+                if parts[-1] == "_mget":
+                    default_index = parts[0] if len(parts) > 1 else None
+                    requests = body.get("docs") or [{"_id": doc_id} for doc_id in body.get("ids", [])]
+                    docs = []
+                    with server._lock:
+                        for request in requests:
+                            index_name = request.get("_index", default_index)
+                            index = server.indices.get(index_name)
+                            source = index.docs.get(request["_id"]) if index else None
+                            doc = {"_index": index_name, "_id": request["_id"], "found": source is not None}
+                            if source is not None:
+                                doc["_source"] = source
+                            docs.append(doc)
+                    self._send(200, {"docs": docs})
+                    return
+
+                index_name = parts[0]
+                if len(parts) == 1 and self.command == "PUT":
+                    with server._lock:
+                        if index_name in server.indices:
+                            self._send(400, {"error": {
+                                "type": "resource_already_exists_exception",
+                                "reason": f"index [{index_name}] already exists"}, "status": 400})
+                            return
+                        server.indices[index_name] = MockIndex(
+                            index_name, body.get("mappings", {}), body.get("settings", {})
+                        )
+                    self._send(200, {"acknowledged": True, "shards_acknowledged": True, "index": index_name})
+                    return
+
+                with server._lock:
+                    missing = [name for name in index_name.split(",") if name not in server.indices]
+                if missing:
+                    self._not_found(missing[0])
+                    return
+
+                action = parts[1] if len(parts) > 1 else ""
+                if action == "_pit":
+                    self._send(200, server._open_pit(index_name))
+                elif action == "_search":
+                    self._send(200, server._search(index_name, body, params))
+                elif action == "_count":
+                    with server._lock:
+                        count = sum(
+                            1 for name in index_name.split(",")
+                            for source in server.indices[name].docs.values()
+                            if _matches(source, body.get("query"))
+                        )
+                    self._send(200, {"count": count, "_shards": {"total": 1, "successful": 1}})
+                elif action in ("_doc", "_create") and len(parts) > 2:
+                    with server._lock:
+                        doc_id, created = server.indices[index_name].put(parts[2], body)
+                    self._send(201 if created else 200, {"_index": index_name, "_id": doc_id,
+                                                         "result": "created" if created else "updated"})
+                elif action == "_doc" and self.command == "POST":
+                    with server._lock:
+                        doc_id, _ = server.indices[index_name].put(None, body)
+                    self._send(201, {"_index": index_name, "_id": doc_id, "result": "created"})
+                elif action in ("_close", "_open"):
+                    with server._lock:
+                        for name in index_name.split(","):
+                            server.indices[name].closed = action == "_close"
+                    self._send(200, {"acknowledged": True, "shards_acknowledged": True})
+                else:
+                    # _refresh、_settings、_forcemerge等维护接口直接确认
+                    self._send(200, {"acknowledged": True, "_shards": {"total": 1, "successful": 1, "failed": 0}})
+
+        return Handler
+
+
+def main():
+    """命令行入口：单独启动ES替身"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="本地ElasticSearch替身（内存实现）")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9201)
+    args = parser.parse_args()
+
+    server = MockElasticsearch(host=args.host, port=args.port).start()
+    print(f"ES替身已启动: {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
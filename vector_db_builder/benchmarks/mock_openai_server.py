@@ -0,0 +1,361 @@
+"""
+本地OpenAI兼容模拟服务：用于基准测试，不产生真实API费用
+
+- POST */chat/completions: 根据请求内容返回确定性的搜索文本、经历提取JSON、标签匹配结果或重排分数
+- POST */embeddings: 返回基于文本哈希的确定性单位向量
+- GET  /stats: 返回各接口的调用次数、429次数、延迟和token统计
+- POST /reset: 清空统计
+
+支持配置固定延迟/抖动以及按比例注入429（带Retry-After头）。
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List
+
+import numpy as np
+
+
+EXPERIENCE_TEMPLATES = [
+    {
+        "event_summary": "{cn}在事业早期屡次碰壁，第{n}次尝试仍以失败告终，外界普遍不看好。",
+        "challenge_type": "职业挑战",
+        "coping_strategy": "{cn}复盘每一次失败的原因，调整方向并坚持学习新技能，同时寻找志同道合的伙伴。",
+        "final_result": "经过多年积累，{cn}最终在所在领域取得突破，成为行业内的标志性人物。",
+    },
+    {
+        "event_summary": "{cn}创业初期资金短缺，团队只有{n}个人，产品迟迟无法上线。",
+        "challenge_type": "创业困难",
+        "coping_strategy": "{cn}四处寻找投资人，压缩开支，亲自参与产品研发和市场推广。",
+        "final_result": "公司获得关键融资并实现盈利，{cn}的坚持被广泛传颂。",
+    },
+    {
+        "event_summary": "{cn}在人生低谷期遭遇健康问题，被迫停下手头工作休养{n}个月。",
+        "challenge_type": "身体健康",
+        "coping_strategy": "{cn}积极配合治疗，调整作息，借助阅读和写作保持心态稳定。",
+        "final_result": "康复后{cn}以更成熟的心态重返工作，并投身公益事业帮助他人。",
+    },
+    {
+        "event_summary": "{cn}在公开场合遭受质疑和批评，舆论压力持续了{n}年之久。",
+        "challenge_type": "心理压力",
+        "coping_strategy": "{cn}选择用作品和行动回应质疑，同时向亲友和专业人士寻求支持。",
+        "final_result": "{cn}赢得了公众的重新认可，其经历激励了许多面临类似困境的人。",
+    },
+]
+
+
+def _stable_int(text: str) -> int:
+    """文本的稳定哈希整数"""
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:16], 16)
+
+
+def _estimate_tokens(text: str) -> int:
+    """粗略估算token数（模拟服务不依赖tiktoken）"""
+    return max(1, len(text) // 2)
+
+
+def hash_embedding(text: str, dims: int) -> List[float]:
+    """
+    基于文本哈希生成确定性的单位向量
+
+    Args:
+        text: 输入文本
+        dims: 向量维度
+
+    Returns:
+        单位长度向量
+    """
+    rng = np.random.default_rng(_stable_int(text))
+    vector = rng.standard_normal(dims).astype(np.float32)
+    vector /= np.linalg.norm(vector)
+    return vector.tolist()
+
+
+class MockOpenAIServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0, rate_429: float = 0.0, retry_after: float = 1.0,
+                 embedding_dims: int = 1024, experiences_per_celebrity: int = 4,
+                 seed: int = 42):
+        """
+        初始化模拟服务
+
+        Args:
+            host: 监听地址
+            port: 监听端口（0表示自动分配）
+            latency_ms: 每个请求的平均注入延迟（毫秒）
+            jitter_ms: 延迟的标准差（毫秒）
+            rate_429: 返回429的概率（0-1）
+            retry_after: 429响应的Retry-After秒数
+            embedding_dims: 嵌入向量维度
+            experiences_per_celebrity: 每位名人提取出的经历数量
+            seed: 延迟和429注入的随机种子
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.embedding_dims = embedding_dims
+        self.experiences_per_celebrity = experiences_per_celebrity
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {}
+
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """OpenAI客户端使用的base_url"""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockOpenAIServer":
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止服务"""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset(self):
+        """清空统计"""
+        with self._lock:
+            self._stats = {}
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        返回各接口的统计
+
+        Returns:
+            {接口: {calls, errors_429, latencies_ms, prompt_tokens, completion_tokens}}
+        """
+        with self._lock:
+            return json.loads(json.dumps(self._stats))
+
+    # ------------------------------------------------------------------
+    # 请求处理
+    # ------------------------------------------------------------------
+
+    def _record(self, route: str, latency_ms: float, status: int,
+                prompt_tokens: int = 0, completion_tokens: int = 0):
+        with self._lock:
+            entry = self._stats.setdefault(route, {
+                "calls": 0,
+                "errors_429": 0,
+                "latencies_ms": [],
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+            })
+            entry["calls"] += 1
+            entry["latencies_ms"].append(round(latency_ms, 3))
+            if status == 429:
+                entry["errors_429"] += 1
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+
+    def _draw(self) -> tuple:
+        """抽取本次请求的注入延迟和是否返回429"""
+        with self._lock:
+            delay = max(0.0, self._random.gauss(self.latency_ms, self.jitter_ms)) if self.latency_ms else 0.0
+            throttled = self._random.random() < self.rate_429
+        return delay, throttled
+
+    def _chat_content(self, body: Dict[str, Any]) -> tuple:
+        """根据请求内容生成回复，返回(路由名, 回复文本)"""
+        messages = body.get("messages", [])
+        content = messages[-1].get("content", "") if messages else ""
+        if isinstance(content, list):
+            content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+        if "sonar" in body.get("model", ""):
+            return "search", self._search_text(content)
+        if "可用标签列表" in content:
+            return "tags", self._tag_reply(content)
+        if "event_summary" in content:
+            return "extract", self._extraction_reply(content)
+        if "候选经历：" in content:
+            return "rerank", self._rerank_reply(content)
+        return "chat", "OK"
+
+    def _search_text(self, prompt: str) -> str:
+        match = re.search(r"请详细介绍(.+?)\((.+?)\)", prompt)
+        cn, en = (match.group(1), match.group(2)) if match else ("某名人", "Someone")
+        paragraphs = [
+            f"{cn}（{en}）是一位具有广泛影响力的人物。",
+            f"{cn}早年经历了诸多挑战，包括事业上的挫折、经济上的困难以及来自外界的质疑。",
+            f"面对困境，{cn}坚持学习、不断调整策略，并依靠团队和家人的支持渡过难关。",
+            f"最终，{cn}在自己的领域取得了卓越成就，其经历成为许多人学习的榜样。",
+        ]
+        return "\n\n".join(paragraphs * 3)
+
+    def _extraction_reply(self, prompt: str) -> str:
+        match = re.search(r"关于(.+?)\((.+?)\)的搜索结果", prompt)
+        cn = match.group(1) if match else "某名人"
+        seed = _stable_int(prompt)
+        experiences = []
+        for i in range(self.experiences_per_celebrity):
+            template = EXPERIENCE_TEMPLATES[(seed + i) % len(EXPERIENCE_TEMPLATES)]
+            experiences.append({
+                field: value.format(cn=cn, n=(seed >> i) % 9 + 1)
+                for field, value in template.items()
+            })
+        return json.dumps(experiences, ensure_ascii=False)
+
+    def _tag_reply(self, prompt: str) -> str:
+        tags = re.findall(r"^- (.+?) \(", prompt, re.MULTILINE)
+        if not tags:
+            return ""
+        seed = _stable_int(prompt)
+        picked = [tags[(seed + i * 7919) % len(tags)] for i in range(2)]
+        return ", ".join(dict.fromkeys(picked))
+
+    def _rerank_reply(self, prompt: str) -> str:
+        candidates = re.findall(r"^\[\d+\] (.*)$", prompt, re.MULTILINE)
+        return json.dumps([_stable_int(candidate) % 11 for candidate in candidates])
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # keep-alive下头部和正文分两次写出，不关闭Nagle时每个请求都要等约40ms的延迟ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, payload: Any, headers: Dict[str, str] = None):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_body(self) -> Dict[str, Any]:
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length) if length else b""
+                return json.loads(raw) if raw else {}
+
+            def do_GET(self):
+                if self.path.rstrip("/") == "/stats":
+                    self._send_json(200, server.stats())
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                start = time.perf_counter()
+                body = self._read_body()
+
+                if self.path.rstrip("/") == "/reset":
+                    server.reset()
+                    self._send_json(200, {"ok": True})
+                    return
+
+                if self.path.endswith("/embeddings"):
+                    route = "embeddings"
+                elif self.path.endswith("/chat/completions"):
+                    route, reply = server._chat_content(body)
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+
+                delay_ms, throttled = server._draw()
+                if delay_ms:
+                    time.sleep(delay_ms / 1000)
+
+                if throttled:
+                    self._send_json(
+                        429,
+                        {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error", "code": 429}},
+                        headers={"Retry-After": str(server.retry_after)},
+                    )
+                    server._record(route, (time.perf_counter() - start) * 1000, 429)
+                    return
+
+                if route == "embeddings":
+                    inputs = body.get("input", "")
+                    inputs = inputs if isinstance(inputs, list) else [inputs]
+                    prompt_tokens = sum(_estimate_tokens(text) for text in inputs)
+                    payload = {
+                        "object": "list",
+                        "data": [
+                            {
+                                "object": "embedding",
+                                "index": i,
+                                "embedding": hash_embedding(text, server.embedding_dims),
+                            }
+                            for i, text in enumerate(inputs)
+                        ],
+                        "model": body.get("model", "mock-embedding"),
+                        "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+                    }
+                    completion_tokens = 0
+                else:
+                    prompt_tokens = _estimate_tokens(json.dumps(body.get("messages", []), ensure_ascii=False))
+                    completion_tokens = _estimate_tokens(reply)
+                    payload = {
+                        "id": f"chatcmpl-mock-{_stable_int(reply) % 10 ** 8}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": body.get("model", "mock-chat"),
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": reply},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                        "usage": {
+                            "prompt_tokens": prompt_tokens,
+                            "completion_tokens": completion_tokens,
+                            "total_tokens": prompt_tokens + completion_tokens,
+                        },
+                    }
+
+                self._send_json(200, payload)
+                server._record(route, (time.perf_counter() - start) * 1000, 200,
+                               prompt_tokens, completion_tokens)
+
+        return Handler
+
+
+def main():
+    """命令行入口：单独启动模拟服务"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="本地OpenAI兼容模拟服务")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="平均注入延迟（毫秒）")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="延迟标准差（毫秒）")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="返回429的概率")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429的Retry-After秒数")
+    parser.add_argument("--dims", type=int, default=1024, help="嵌入向量维度")
+
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(
+        host=args.host, port=args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        rate_429=args.rate_429, retry_after=args.retry_after, embedding_dims=args.dims,
+    ).start()
+    print(f"模拟OpenAI服务已启动: {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
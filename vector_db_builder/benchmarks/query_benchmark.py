@@ -0,0 +1,434 @@
+"""
+查询侧负载测试：回放查询日志（或由经历摘要合成的查询集），对比 kNN / 关键词 / 混合 / 过滤 四种检索模式
+
+每条查询的耗时拆分为：
+    embed      生成查询向量
+    took       ES返回的服务端耗时
+    network    往返耗时减去took（网络传输 + 序列化/反序列化）
+    parse      客户端从命中结果中提取字段
+    queue      开环模式下实际发出时间相对计划时间的排队延迟
+总延迟从计划发出时间开始计算，开环模式下不会因为服务变慢而少发请求。
+
+用法:
+    python benchmarks/query_benchmark.py --mock --num-queries 500 --concurrency 8
+    python benchmarks/query_benchmark.py --query-log queries.jsonl --qps 20 --modes knn hybrid
+    python benchmarks/query_benchmark.py --target example --modes knn keyword --concurrency 1
+"""
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, List, Callable
+
+import numpy as np
+
+BENCHMARK_DIR = Path(__file__).parent
+sys.path.insert(0, str(BENCHMARK_DIR))
+sys.path.insert(0, str(BENCHMARK_DIR.parent))
+
+from build_benchmark import percentiles
+
+
+QUERY_MODES = ("knn", "keyword", "hybrid", "filtered")
+
+BREAKDOWN_FIELDS = ("total", "embed", "took", "network", "parse", "queue")
+
+DEFAULT_EXPERIENCES_FILE = BENCHMARK_DIR.parent / "cache" / "experiences_with_tags.json"
+
+
+def load_query_log(path: Path) -> List[Dict[str, Any]]:
+    """
+    加载查询日志：每行一条纯文本查询，或JSON对象 {"query": ..., "tags": [...]}
+
+    Args:
+        path: 查询日志路径
+
+    Returns:
+        查询列表
+    """
+    queries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                item = json.loads(line)
+                queries.append({"query": item["query"], "tags": item.get("tags") or []})
+            else:
+                queries.append({"query": line, "tags": []})
+    return queries
+
+
+def synthesize_queries(experiences: List[Dict[str, Any]], num_queries: int,
+                       seed: int = 42) -> List[Dict[str, Any]]:
+    """
+    由经历摘要合成查询集：取事件摘要的第一句作为查询文本，随机取1个标签用于过滤模式
+
+    Args:
+        experiences: 经历列表
+        num_queries: 查询数量（不足时循环抽样）
+        seed: 随机种子
+
+    Returns:
+        查询列表
+    """
+    rng = random.Random(seed)
+    pool = [exp for exp in experiences if exp.get("event_summary")]
+    if not pool:
+        raise ValueError("经历中没有可用的event_summary")
+
+    queries = []
+    for _ in range(num_queries):
+        exp = rng.choice(pool)
+        summary = exp["event_summary"]
+        for sep in ("。", ". ", "；"):
+            if sep in summary:
+                summary = summary.split(sep, 1)[0]
+                break
+        tags = exp.get("tags") or []
+        queries.append({"query": summary, "tags": [rng.choice(tags)] if tags else []})
+    return queries
+
+
+def keyword_query(query_text: str, keyword_fields: List[str]) -> Dict[str, Any]:
+    """与vector_search_example.keyword_search相同的multi_match查询"""
+    return {
+        "query": {
+            "multi_match": {
+                "query": query_text,
+                "fields": keyword_fields,
+                "type": "best_fields"
+            }
+        }
+    }
+
+
+def parse_hits(result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """模拟客户端对结果的处理：提取展示所需字段"""
+    rows = []
+    for hit in result["hits"]["hits"]:
+        source = hit.get("_source", {})
+        rows.append({
+            "score": hit.get("_score"),
+            "celebrity_name_en": source.get("celebrity_name_en", ""),
+            "event_summary": source.get("event_summary", ""),
+            "tags": source.get("tags", []),
+        })
+    return rows
+
+
+class ClientTarget:
+    """直接复用 TextProcessor 和 ElasticsearchSetup，逐段计时"""
+
+    def __init__(self, index_name: str, size: int, hedge: bool = False):
+        from text_processing import TextProcessor
+        from elasticsearch_setup import ElasticsearchSetup
+        from query_planner import QueryPlanner
+
+        self.index_name = index_name
+        self.size = size
+        self.text_processor = TextProcessor(model=os.getenv("EMBEDDING_MODEL", "Qwen/Qwen3-Embedding-8B"),
+                                            hedge=hedge, budget_stage="query")
+        self.es_setup = ElasticsearchSetup()
+        self.keyword_fields = self.es_setup.keyword_fields
+        self.planner = QueryPlanner(self.es_setup, index_name)
+
+    def run(self, mode: str, query: Dict[str, Any]) -> Dict[str, float]:
+        """
+        执行一条查询
+
+        Args:
+            mode: 检索模式
+            query: {"query": 文本, "tags": 标签列表}
+
+        Returns:
+            各段耗时（毫秒）和命中数
+        """
+        sample = {"embed": 0.0}
+        embedding = None
+        if mode != "keyword":
+            start = time.perf_counter()
+            embedding = self.text_processor.get_embedding(query["query"])
+            sample["embed"] = (time.perf_counter() - start) * 1000
+            if not embedding:
+                raise RuntimeError("生成查询向量失败")
+
+        filter_query = None
+        if mode == "filtered" and query["tags"]:
+            filter_query = {"terms": {"tags": query["tags"]}}
+
+        start = time.perf_counter()
+        if mode == "keyword":
+            result = self.es_setup.search(self.index_name, keyword_query(query["query"], self.keyword_fields),
+                                          size=self.size)
+        elif mode == "hybrid":
+            result = self.planner.hybrid_search(query["query"], embedding, size=self.size)
+        else:
+            result = self.es_setup.vector_search(self.index_name, embedding, size=self.size,
+                                                 filter_query=filter_query)
+        roundtrip = (time.perf_counter() - start) * 1000
+        if result is None:
+            raise RuntimeError(f"{mode} 搜索失败")
+
+        start = time.perf_counter()
+        rows = parse_hits(result)
+        sample["parse"] = (time.perf_counter() - start) * 1000
+
+        sample["took"] = float(result.get("took", 0))
+        sample["network"] = max(roundtrip - sample["took"], 0.0)
+        sample["hits"] = len(rows)
+        return sample
+
+
+class ExampleTarget:
+    """调用 vector_search_example 中的示例函数（客户端由clients注册表复用）"""
+
+    def __init__(self, index_name: str, size: int, hedge: bool = False):
+        # 示例函数本身总是启用对冲
+        os.environ["ELASTICSEARCH_INDEX"] = index_name
+        import vector_search_example
+
+        self.example = vector_search_example
+        self.size = size
+
+    def run(self, mode: str, query: Dict[str, Any]) -> Dict[str, float]:
+        """执行一条查询，只能拆分出ES的took，其余计入network"""
+        tags = query["tags"] if mode == "filtered" else None
+        start = time.perf_counter()
+        if mode == "keyword":
+            result = self.example.keyword_search(query["query"], self.size)
+        elif mode == "hybrid":
+            result = self.example.hybrid_search(query["query"], self.size)
+        else:
+            result = self.example.search_experiences(query["query"], self.size, tags)
+        elapsed = (time.perf_counter() - start) * 1000
+        if result is None:
+            raise RuntimeError(f"{mode} 搜索失败")
+        took = float(result.get("took", 0))
+        return {"embed": 0.0, "took": took, "network": max(elapsed - took, 0.0),
+                "parse": 0.0, "hits": len(result["hits"]["hits"])}
+
+
+def run_load(run_query: Callable[[Dict[str, Any]], Dict[str, float]], queries: List[Dict[str, Any]],
+             concurrency: int = 1, qps: float = None) -> Dict[str, Any]:
+    """
+    以闭环（固定并发）或开环（固定QPS）方式回放查询
+
+    Args:
+        run_query: 执行单条查询的函数
+        queries: 查询列表
+        concurrency: 并发数（开环模式下为最大在途请求数）
+        qps: 目标QPS，None表示闭环模式
+
+    Returns:
+        样本列表、失败数和实际QPS
+    """
+    samples = []
+    errors = []
+    lock = threading.Lock()
+
+    def task(query, scheduled):
+        started = time.perf_counter()
+        try:
+            sample = run_query(query)
+        except Exception as e:
+            with lock:
+                errors.append(f"{type(e).__name__}: {e}")
+            return
+        finished = time.perf_counter()
+        # 开环模式从计划发出时间算起，排队时间计入总延迟
+        origin = scheduled if scheduled is not None else started
+        sample["queue"] = (started - origin) * 1000
+        sample["total"] = (finished - origin) * 1000
+        with lock:
+            samples.append(sample)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        if qps:
+            for i, query in enumerate(queries):
+                scheduled = start + i / qps
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(task, query, scheduled)
+        else:
+            for query in queries:
+                executor.submit(task, query, None)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "samples": samples,
+        "errors": errors,
+        "seconds": elapsed,
+        "achieved_qps": len(samples) / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def summarize(mode: str, load: Dict[str, Any]) -> Dict[str, Any]:
+    """汇总一种模式的各段耗时分位数"""
+    samples = load["samples"]
+    summary = {
+        "mode": mode,
+        "queries": len(samples),
+        "errors": len(load["errors"]),
+        "seconds": load["seconds"],
+        "achieved_qps": load["achieved_qps"],
+        "avg_hits": float(np.mean([s["hits"] for s in samples])) if samples else 0.0,
+    }
+    for field in BREAKDOWN_FIELDS:
+        summary[field] = percentiles([s[field] for s in samples])
+    if load["errors"]:
+        summary["first_error"] = load["errors"][0]
+    return summary
+
+
+def print_report(summaries: List[Dict[str, Any]]):
+    """并排打印各模式的延迟拆分"""
+    header = (f"{'模式':<9} | {'查询':>6} | {'失败':>4} | {'QPS':>7} | {'命中':>5} | "
+              + " | ".join(f"{field + ' p50/p95/p99(ms)':>28}" for field in BREAKDOWN_FIELDS))
+    print("\n" + header)
+    print("-" * len(header))
+    for summary in summaries:
+        cells = " | ".join(
+            f"{summary[field]['p50']:>8.1f}/{summary[field]['p95']:>8.1f}/{summary[field]['p99']:>8.1f}"
+            .rjust(28)
+            for field in BREAKDOWN_FIELDS
+        )
+        print(f"{summary['mode']:<9} | {summary['queries']:>6} | {summary['errors']:>4} | "
+              f"{summary['achieved_qps']:>7.1f} | {summary['avg_hits']:>5.1f} | {cells}")
+    for summary in summaries:
+        if "first_error" in summary:
+            print(f"{summary['mode']} 首个错误: {summary['first_error']}")
+
+
+def index_experiences(experiences: List[Dict[str, Any]], index_name: str, num_threads: int = 8):
+    """
+    将经历写入索引（--mock模式使用，每个经历一个chunk）
+
+    Args:
+        experiences: 经历列表
+        index_name: 索引名称
+        num_threads: 生成向量的并发数
+    """
+    from text_processing import TextProcessor
+    from elasticsearch_setup import ElasticsearchSetup
+    from records import ChunkRecord, assign_experience_ids
+
+    text_processor = TextProcessor(model=os.getenv("EMBEDDING_MODEL"))
+    es_setup = ElasticsearchSetup()
+    assign_experience_ids(experiences)
+
+    texts = [TextProcessor.build_experience_text(exp) for exp in experiences]
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        embeddings = list(executor.map(text_processor.get_embedding, texts))
+
+    chunks = [
+        ChunkRecord(f"{exp['experience_id']}_0", exp["experience_id"], text, embedding)
+        for exp, text, embedding in zip(experiences, texts, embeddings)
+    ]
+    es_setup.create_index(index_name, delete_existing=True, dims=text_processor.dims)
+    es_setup.index_chunks(index_name, experiences, chunks)
+
+
+def main():
+    """命令行入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="查询侧负载测试（对比kNN/关键词/混合/过滤检索）")
+    parser.add_argument("--query-log", type=str,
+                        help="查询日志（每行一条文本，或JSON {\"query\": ..., \"tags\": [...]}）")
+    parser.add_argument("--experiences-file", type=str, default=str(DEFAULT_EXPERIENCES_FILE),
+                        help="未提供查询日志时用于合成查询的经历文件")
+    parser.add_argument("--num-queries", type=int, default=200, help="每种模式回放的查询数量")
+    parser.add_argument("--modes", type=str, nargs="+", choices=QUERY_MODES, default=list(QUERY_MODES),
+                        help="要对比的检索模式")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发数（开环模式下为最大在途请求数）")
+    parser.add_argument("--qps", type=float, help="目标QPS（开环模式），不设置则为闭环固定并发")
+    parser.add_argument("--size", type=int, default=10, help="每次检索返回的结果数量")
+    parser.add_argument("--warmup", type=int, default=10, help="每种模式正式计时前的预热查询数")
+    parser.add_argument("--target", choices=["client", "example"], default="client",
+                        help="client: 复用客户端并拆分各段耗时; example: 调用vector_search_example中的函数")
+    parser.add_argument("--index", type=str, help="索引名称（默认ELASTICSEARCH_INDEX）")
+    parser.add_argument("--mock", action="store_true",
+                        help="启动本地OpenAI模拟服务和ES替身，并写入经历文件中的经历")
+    parser.add_argument("--hedge", action="store_true", help="client目标下为查询嵌入启用对冲请求")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="--mock模式下模拟嵌入API平均延迟")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="--mock模式下模拟嵌入API延迟标准差")
+    parser.add_argument("--dims", type=int, default=1024, help="--mock模式下模拟嵌入向量维度")
+    parser.add_argument("--output", type=str, help="将结果写入JSON文件")
+
+    args = parser.parse_args()
+
+    with open(args.experiences_file, 'r', encoding='utf-8') as f:
+        experiences = json.load(f)
+
+    if args.query_log:
+        queries = load_query_log(Path(args.query_log))
+    else:
+        queries = synthesize_queries(experiences, args.num_queries)
+    # 查询日志不足num_queries时循环回放
+    queries = [queries[i % len(queries)] for i in range(args.num_queries)]
+
+    servers = []
+    try:
+        if args.mock:
+            from mock_openai_server import MockOpenAIServer
+            from mock_elasticsearch import MockElasticsearch
+
+            openai_server = MockOpenAIServer(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                             embedding_dims=args.dims).start()
+            es_server = MockElasticsearch().start()
+            servers = [openai_server, es_server]
+            os.environ.update({
+                "EMBEDDING_API_KEY": "benchmark",
+                "EMBEDDING_API_BASE_URL": openai_server.url,
+                "EMBEDDING_MODEL": "mock-embedding",
+                "EMBEDDING_DIMS": str(args.dims),
+                "ELASTICSEARCH_HOST": es_server.url,
+            })
+            index_name = args.index or "benchmark_queries"
+            print(f"写入 {len(experiences)} 条经历到ES替身...")
+            index_experiences(experiences, index_name)
+        else:
+            index_name = args.index or os.getenv("ELASTICSEARCH_INDEX", "celebrity_experiences")
+
+        target_cls = ClientTarget if args.target == "client" else ExampleTarget
+        target = target_cls(index_name, args.size, hedge=args.hedge)
+
+        summaries = []
+        for mode in args.modes:
+            def run_query(query, mode=mode):
+                return target.run(mode, query)
+
+            print(f"模式 {mode}: 回放 {len(queries)} 条查询"
+                  + (f"，目标QPS {args.qps}" if args.qps else f"，并发 {args.concurrency}"))
+            # 示例函数会打印全部结果；stdout是进程级的，只能在整轮回放外层统一丢弃
+            quiet = (contextlib.redirect_stdout(io.StringIO()) if args.target == "example"
+                     else contextlib.nullcontext())
+            with quiet:
+                if args.warmup:
+                    run_load(run_query, queries[:args.warmup], concurrency=args.concurrency)
+                load = run_load(run_query, queries, concurrency=args.concurrency, qps=args.qps)
+            summaries.append(summarize(mode, load))
+    finally:
+        for server in servers:
+            server.stop()
+
+    print_report(summaries)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summaries, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
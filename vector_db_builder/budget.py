@@ -0,0 +1,307 @@
+"""
+Token预算模块：按阶段统计prompt/completion/embedding token和费用，并执行单次运行和单阶段预算
+
+token数优先取API响应中的usage字段，缺失时用tiktoken估算。
+预算按美元计，达到软限额（默认90%）时各阶段降级（例如标签匹配改为仅关键词匹配），
+达到硬限额时抛出 BudgetExceeded 或停止发起新的请求。
+"""
+import json
+import os
+import threading
+from typing import Dict, Any
+
+try:
+    from .metrics import get_metrics
+except ImportError:
+    from metrics import get_metrics
+
+
+# 每百万token的价格（美元）：(输入, 输出)；可通过环境变量MODEL_PRICES（JSON）覆盖或补充
+# 只收录有公开定价的模型；Qwen3-Embedding等通常自行部署或按服务商定价，需要时通过MODEL_PRICES配置
+MODEL_PRICES = {
+    "perplexity/sonar-pro-search": (3.0, 15.0),
+    "openai/gpt-4o-mini": (0.15, 0.60),
+    "openai/text-embedding-3-small": (0.02, 0.0),
+    "openai/text-embedding-3-large": (0.13, 0.0),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+}
+
+
+class BudgetExceeded(RuntimeError):
+    """预算已用完且该阶段无法降级"""
+
+
+def load_model_prices() -> Dict[str, tuple]:
+    """
+    读取模型价格表（内置价格 + 环境变量MODEL_PRICES覆盖）
+
+    Returns:
+        {模型名: (输入价格, 输出价格)}，单位为美元/百万token
+    """
+    prices = dict(MODEL_PRICES)
+    override = os.getenv("MODEL_PRICES")
+    if override:
+        for model, price in json.loads(override).items():
+            prices[model] = tuple(price) if isinstance(price, (list, tuple)) else (float(price), 0.0)
+    return prices
+
+
+def parse_stage_budgets(value: str) -> Dict[str, float]:
+    """
+    解析单阶段预算，例如 "tags=2,search=5.5"
+
+    Args:
+        value: 逗号分隔的 阶段=美元 列表
+
+    Returns:
+        {阶段: 预算}
+    """
+    budgets = {}
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        stage, _, amount = item.partition("=")
+        budgets[stage.strip()] = float(amount)
+    return budgets
+
+
+_encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    用tiktoken估算token数（usage字段缺失时使用）
+
+    Args:
+        text: 文本
+
+    Returns:
+        估算的token数
+    """
+    global _encoding
+    if not text:
+        return 0
+    if _encoding is None:
+        import tiktoken
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+class TokenBudget:
+    """按阶段统计token和费用，并判断是否需要降级或停止"""
+
+    def __init__(self, run_budget: float = None, stage_budgets: Dict[str, float] = None,
+                 soft_limit: float = None, prices: Dict[str, tuple] = None):
+        """
+        初始化预算
+
+        Args:
+            run_budget: 单次运行预算（美元），默认读取BUDGET_RUN_USD，未设置表示不限
+            stage_budgets: 单阶段预算，默认读取BUDGET_STAGE_USD（如 "tags=2,search=5"）
+            soft_limit: 触发降级的已用比例，默认读取BUDGET_SOFT_LIMIT（0.9）
+            prices: 模型价格表，默认使用 load_model_prices()
+        """
+        if run_budget is None and os.getenv("BUDGET_RUN_USD"):
+            run_budget = float(os.getenv("BUDGET_RUN_USD"))
+        if stage_budgets is None:
+            stage_budgets = parse_stage_budgets(os.getenv("BUDGET_STAGE_USD", ""))
+        if soft_limit is None:
+            soft_limit = float(os.getenv("BUDGET_SOFT_LIMIT", "0.9"))
+
+        self.run_budget = run_budget
+        self.stage_budgets = stage_budgets
+        self.soft_limit = soft_limit
+        self.prices = prices if prices is not None else load_model_prices()
+        self.metrics = get_metrics()
+        self._stages = {}
+        self._degraded = set()
+        self._warned_models = set()
+        self._lock = threading.Lock()
+
+    def _price(self, model: str) -> tuple:
+        price = self.prices.get(model)
+        if price is None:
+            # 未知模型按0计费，但只提示一次
+            with self._lock:
+                warn = model not in self._warned_models
+                self._warned_models.add(model)
+            if warn:
+                print(f"警告: 模型 {model} 没有价格配置，费用按0计算（可通过MODEL_PRICES设置）")
+            return (0.0, 0.0)
+        return price
+
+    def record(self, stage: str, model: str, prompt_tokens: int, completion_tokens: int = 0,
+               estimated: bool = False) -> float:
+        """
+        记录一次调用的token用量
+
+        Args:
+            stage: 阶段名称（search/extract/tags/embed/tag_lists/warmup/query/rerank）
+            model: 模型名称
+            prompt_tokens: 输入token数
+            completion_tokens: 输出token数
+            estimated: token数是否为估算值
+
+        Returns:
+            本次调用的费用（美元）
+        """
+        input_price, output_price = self._price(model)
+        cost = (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+        with self._lock:
+            entry = self._stages.setdefault(stage, {
+                "calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "estimated_calls": 0, "cost_usd": 0.0,
+            })
+            entry["calls"] += 1
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["estimated_calls"] += int(estimated)
+            entry["cost_usd"] += cost
+        self.metrics.counter("api_cost_usd_total", "模型API估算费用（美元）").inc(cost, stage=stage, model=model)
+        return cost
+
+    def record_usage(self, stage: str, model: str, usage, prompt_text: str = "",
+                     completion_text: str = "") -> float:
+        """
+        按响应的usage记录用量，usage缺失时用tiktoken估算
+
+        Args:
+            stage: 阶段名称
+            model: 模型名称
+            usage: 响应中的usage对象（或dict），可以为None
+            prompt_text: 请求文本（用于估算）
+            completion_text: 响应文本（用于估算）
+
+        Returns:
+            本次调用的费用（美元）
+        """
+        prompt_tokens = completion_tokens = None
+        if usage is not None:
+            get = usage.get if isinstance(usage, dict) else lambda name: getattr(usage, name, None)
+            prompt_tokens = get("prompt_tokens")
+            completion_tokens = get("completion_tokens")
+        estimated = prompt_tokens is None
+        if estimated:
+            prompt_tokens = estimate_tokens(prompt_text)
+            completion_tokens = estimate_tokens(completion_text)
+        return self.record(stage, model, prompt_tokens or 0, completion_tokens or 0, estimated=estimated)
+
+    def spent(self, stage: str = None) -> float:
+        """已用费用（美元），stage为None时返回整次运行的合计"""
+        with self._lock:
+            if stage is not None:
+                return self._stages.get(stage, {}).get("cost_usd", 0.0)
+            return sum(entry["cost_usd"] for entry in self._stages.values())
+
+    def _usage_ratio(self, stage: str) -> float:
+        """阶段预算和运行预算中较紧的一个的已用比例"""
+        ratios = [0.0]
+        if self.run_budget is not None:
+            ratios.append(self.spent() / self.run_budget if self.run_budget > 0 else float("inf"))
+        stage_budget = self.stage_budgets.get(stage)
+        if stage_budget is not None:
+            ratios.append(self.spent(stage) / stage_budget if stage_budget > 0 else float("inf"))
+        return max(ratios)
+
+    def should_degrade(self, stage: str) -> bool:
+        """
+        是否应该降级（已用比例达到软限额）
+
+        首次触发时打印提示并计入 budget_degradations_total。
+        """
+        ratio = self._usage_ratio(stage)
+        if ratio < self.soft_limit:
+            return False
+        # 多个worker线程可能同时越过软限额，只由第一个记录和提示
+        with self._lock:
+            first = stage not in self._degraded
+            self._degraded.add(stage)
+        if first:
+            self.metrics.counter("budget_degradations_total", "因预算不足而降级的阶段").inc(stage=stage)
+            print(f"警告: {stage} 阶段已用预算 {ratio:.0%}，开始降级")
+        return True
+
+    def exhausted(self, stage: str) -> bool:
+        """预算是否已用完（达到硬限额）"""
+        return self._usage_ratio(stage) >= 1.0
+
+    def check(self, stage: str):
+        """
+        预算已用完时抛出BudgetExceeded（用于无法降级的阶段）
+
+        Args:
+            stage: 阶段名称
+        """
+        if self.exhausted(stage):
+            raise BudgetExceeded(
+                f"{stage} 阶段预算已用完: 已用 ${self.spent(stage):.4f}，整次运行已用 ${self.spent():.4f}"
+            )
+
+    def summary(self, num_experiences: int = None) -> Dict[str, Any]:
+        """
+        汇总各阶段用量和费用
+
+        Args:
+            num_experiences: 经历数量，提供时计算每1000条经历的费用
+
+        Returns:
+            汇总字典
+        """
+        with self._lock:
+            stages = {stage: dict(entry) for stage, entry in self._stages.items()}
+            degraded = sorted(self._degraded)
+        total = sum(entry["cost_usd"] for entry in stages.values())
+        summary = {
+            "stages": stages,
+            "total_cost_usd": total,
+            "run_budget_usd": self.run_budget,
+            "stage_budgets_usd": dict(self.stage_budgets),
+            "degraded_stages": degraded,
+        }
+        if num_experiences:
+            for entry in stages.values():
+                entry["cost_per_1k_experiences"] = entry["cost_usd"] * 1000 / num_experiences
+            summary["cost_per_1k_experiences"] = total * 1000 / num_experiences
+        return summary
+
+    def print_report(self, num_experiences: int = None):
+        """打印各阶段token用量和费用"""
+        summary = self.summary(num_experiences)
+        print(f"\n{'阶段':<8} | {'调用':>6} | {'输入token':>11} | {'输出token':>10} | {'费用($)':>9} | {'$/千条经历':>10}")
+        print("-" * 70)
+        for stage, entry in summary["stages"].items():
+            per_1k = entry.get("cost_per_1k_experiences")
+            print(f"{stage:<8} | {entry['calls']:>6} | {entry['prompt_tokens']:>11} | "
+                  f"{entry['completion_tokens']:>10} | {entry['cost_usd']:>9.4f} | "
+                  f"{(f'{per_1k:.4f}' if per_1k is not None else '-'):>10}")
+        line = f"合计费用: ${summary['total_cost_usd']:.4f}"
+        if "cost_per_1k_experiences" in summary:
+            line += f"，每1000条经历 ${summary['cost_per_1k_experiences']:.4f}"
+        if summary["degraded_stages"]:
+            line += f"，降级阶段: {', '.join(summary['degraded_stages'])}"
+        print(line)
+
+
+_budget = None
+
+
+def configure_budget(run_budget: float = None, stage_budgets: Dict[str, float] = None,
+                     soft_limit: float = None) -> TokenBudget:
+    """
+    初始化全局预算（参数为None时读取环境变量）
+
+    Returns:
+        全局预算对象
+    """
+    global _budget
+    _budget = TokenBudget(run_budget=run_budget, stage_budgets=stage_budgets, soft_limit=soft_limit)
+    return _budget
+
+
+def get_budget() -> TokenBudget:
+    """获取全局预算（首次调用时按环境变量初始化）"""
+    if _budget is None:
+        return configure_budget()
+    return _budget
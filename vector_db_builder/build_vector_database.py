@@ -4,94 +4,67 @@
 import os
 import json
 import sys
-import re
 from pathlib import Path
 
-# 尝试加载python-dotenv，如果不存在则使用自定义加载函数
-try:
-    from dotenv import load_dotenv
-    HAS_DOTENV = True
-except ImportError:
-    HAS_DOTENV = False
-
-def load_env_file(env_path: Path):
-    """
-    加载.env文件，支持两种格式：
-    1. KEY=value (标准格式)
-    2. export KEY=value (shell格式)
-    """
-    if not env_path.exists():
-        return False
-    
-    with open(env_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            # 跳过空行和注释
-            if not line or line.startswith('#'):
-                continue
-            
-            # 移除export关键字（如果存在）
-            line = re.sub(r'^export\s+', '', line)
-            
-            # 解析KEY=value
-            if '=' in line:
-                key, value = line.split('=', 1)
-                key = key.strip()
-                value = value.strip()
-                
-                # 移除引号（如果存在）
-                if (value.startswith('"') and value.endswith('"')) or \
-                   (value.startswith("'") and value.endswith("'")):
-                    value = value[1:-1]
-                
-                # 设置环境变量
-                os.environ[key] = value
-    
-    return True
+# 添加当前目录到路径
+sys.path.insert(0, str(Path(__file__).parent))
 
 # 加载环境变量（必须在导入其他模块之前）
-# 首先尝试从项目根目录的env/.env加载
-env_path = Path(__file__).parent.parent / "env" / ".env"
-if env_path.exists():
-    if HAS_DOTENV:
-        load_dotenv(env_path)
-    else:
-        load_env_file(env_path)
-else:
-    # 如果不存在，尝试从项目根目录的.env加载
-    root_env = Path(__file__).parent.parent / ".env"
-    if root_env.exists():
-        if HAS_DOTENV:
-            load_dotenv(root_env)
-        else:
-            load_env_file(root_env)
-    else:
-        # 最后尝试默认位置（如果使用dotenv）
-        if HAS_DOTENV:
-            load_dotenv()
-
-# 添加父目录到路径
-sys.path.insert(0, str(Path(__file__).parent))
+from config import load_env
+load_env()
 
 from search_celebrity_experiences import CelebrityExperienceSearcher
 from extract_structured_data import StructuredDataExtractor
 from tag_matching import TagMatcher
 from text_processing import TextProcessor
 from elasticsearch_setup import ElasticsearchSetup
+from records import save_chunk_cache, load_chunk_cache
+from jsonl_cache import (
+    cache_path, iter_jsonl, write_jsonl, batched, experience_record, iter_experience_chunks
+)
+from centroids import index_centroids, group_chunks
+from tag_lists import build_tag_lists, TAG_LISTS_FILE
+from index_warmup import load_warmup_queries, warm_up
+from metrics import get_metrics, configure_metrics
+from budget import get_budget, configure_budget, parse_stage_budgets
 
 
 class VectorDatabaseBuilder:
     def __init__(self):
         """初始化构建器"""
         # 环境变量已在文件开头加载，这里直接初始化各个模块
+        self.metrics = get_metrics()
+        self.budget = get_budget()
+        # 本次构建的经历数量（用于计算每1000条经历的费用）
+        self.num_experiences = None
         self.searcher = CelebrityExperienceSearcher()
         self.extractor = StructuredDataExtractor()
         self.tag_matcher = TagMatcher()
         self.text_processor = TextProcessor()
         self.es_setup = ElasticsearchSetup()
         
+        # dot_product相似度要求单位长度向量，强制在嵌入时归一化
+        if self.es_setup.requires_normalized_vectors:
+            self.text_processor.normalize = True
+        
         # 获取索引名称
         self.index_name = os.getenv("ELASTICSEARCH_INDEX", "celebrity_experiences")
+        
+        # 索引完成后重建名人质心索引（<index>_celebrities），用于两阶段名人检索
+        self.build_centroids = os.getenv("BUILD_CENTROIDS", "true").lower() in ("1", "true", "yes")
+        self.centroids_by_challenge_type = (
+            os.getenv("CENTROID_BY_CHALLENGE_TYPE", "true").lower() in ("1", "true", "yes")
+        )
+        # 索引完成后重新生成按标签/类别浏览用的榜单文件（缓存目录下的tag_lists.json）
+        self.build_tag_lists = os.getenv("BUILD_TAG_LISTS", "true").lower() in ("1", "true", "yes")
+        # 索引完成后强制合并、可选启用向量预加载并执行预热查询，使首批查询的延迟接近稳定状态
+        self.finalize = os.getenv("FINALIZE_INDEX", "true").lower() in ("1", "true", "yes")
+        self.max_num_segments = int(os.getenv("FINALIZE_MAX_SEGMENTS", "1"))
+        self.preload_vectors = os.getenv("FINALIZE_PRELOAD", "false").lower() in ("1", "true", "yes")
+        self.warmup_queries = os.getenv("WARMUP_QUERIES", "tags")
+        # 构建完成后为索引创建快照（见index_snapshots.py），版本号缺省为当前时间
+        self.snapshot_after_build = os.getenv("SNAPSHOT_AFTER_BUILD", "false").lower() in ("1", "true", "yes")
+        self.snapshot_version = os.getenv("SNAPSHOT_VERSION") or None
     
     def build(self, skip_search: bool = False, skip_extract: bool = False, 
               skip_tags: bool = False, skip_processing: bool = False,
@@ -118,7 +91,10 @@ class VectorDatabaseBuilder:
             print("=" * 60)
             print("步骤 1/5: 搜索名人经历")
             print("=" * 60)
-            search_results = self.searcher.search_all_celebrities()
+            search_results = self._run_stage(
+                "search", self.searcher.search_all_celebrities,
+                count=lambda results: sum(len(v) for v in results.values())
+            )
             
             # 保存搜索结果
             cache_file = cache_dir / "search_results.json"
@@ -128,6 +104,7 @@ class VectorDatabaseBuilder:
         else:
             # 加载缓存的搜索结果
             cache_file = cache_dir / "search_results.json"
+            self.metrics.cache_lookup("search_results", cache_file.exists())
             if cache_file.exists():
                 with open(cache_file, 'r', encoding='utf-8') as f:
                     search_results = json.load(f)
@@ -141,7 +118,7 @@ class VectorDatabaseBuilder:
             print("\n" + "=" * 60)
             print("步骤 2/5: 提取结构化数据")
             print("=" * 60)
-            experiences = self.extractor.extract_all(search_results)
+            experiences = self._run_stage("extract", lambda: self.extractor.extract_all(search_results))
             
             # 保存提取结果
             cache_file = cache_dir / "experiences.json"
@@ -152,6 +129,7 @@ class VectorDatabaseBuilder:
         else:
             # 加载缓存的提取结果
             cache_file = cache_dir / "experiences.json"
+            self.metrics.cache_lookup("experiences", cache_file.exists())
             if cache_file.exists():
                 with open(cache_file, 'r', encoding='utf-8') as f:
                     experiences = json.load(f)
@@ -160,12 +138,16 @@ class VectorDatabaseBuilder:
             else:
                 raise FileNotFoundError(f"缓存文件不存在: {cache_file}")
         
+        self.num_experiences = len(experiences) if experiences is not None else None
+        
         # 3. 标签匹配
         if not skip_tags:
             print("\n" + "=" * 60)
             print("步骤 3/5: 标签匹配")
             print("=" * 60)
-            experiences = self.tag_matcher.match_all_experiences(experiences, use_llm=True)
+            experiences = self._run_stage(
+                "tags", lambda: self.tag_matcher.match_all_experiences(experiences, use_llm=True)
+            )
             
             # 保存标签匹配结果
             cache_file = cache_dir / "experiences_with_tags.json"
@@ -175,6 +157,7 @@ class VectorDatabaseBuilder:
         else:
             # 加载缓存的标签匹配结果
             cache_file = cache_dir / "experiences_with_tags.json"
+            self.metrics.cache_lookup("experiences_with_tags", cache_file.exists())
             if cache_file.exists():
                 with open(cache_file, 'r', encoding='utf-8') as f:
                     experiences = json.load(f)
@@ -193,21 +176,26 @@ class VectorDatabaseBuilder:
             print("\n" + "=" * 60)
             print("步骤 4/5: 文本切块和向量嵌入")
             print("=" * 60)
-            chunks = self.text_processor.process_all_experiences(experiences, max_tokens=500)
+            chunks = self._run_stage(
+                "embed", lambda: self.text_processor.process_all_experiences(experiences, max_tokens=500)
+            )
             
-            # 保存处理结果
+            # 保存处理结果（经历只保存一份，chunk通过experience_id引用）
             cache_file = cache_dir / "chunks_with_embeddings.json"
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump(chunks, f, ensure_ascii=False, indent=2)
+            save_chunk_cache(cache_file, experiences, chunks)
             print(f"处理结果已保存到: {cache_file}")
             print(f"共生成 {len(chunks)} 个chunks")
         else:
             # 加载缓存的处理结果
             cache_file = cache_dir / "chunks_with_embeddings.json"
+            self.metrics.cache_lookup("chunks_with_embeddings", cache_file.exists())
             if cache_file.exists():
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    chunks = json.load(f)
+                experiences, chunks = load_chunk_cache(cache_file)
                 print(f"从缓存加载处理结果: {cache_file}")
+                # 旧缓存可能未截断或未归一化，按当前配置处理（对已处理的向量无影响）
+                for chunk in chunks:
+                    if len(chunk.embedding):
+                        chunk.embedding = self.text_processor.postprocess_embedding(chunk.embedding)
                 print(f"共 {len(chunks)} 个chunks")
             else:
                 raise FileNotFoundError(f"缓存文件不存在: {cache_file}")
@@ -217,20 +205,313 @@ class VectorDatabaseBuilder:
         print("步骤 5/5: 存储到ElasticSearch")
         print("=" * 60)
         
-        # 创建索引
-        self.es_setup.create_index(self.index_name, delete_existing=False)
+        success_count = self.index_experiences(experiences, chunks)
+        if self.build_tag_lists:
+            self.materialize_tag_lists(group_chunks(experiences, chunks), cache_dir / TAG_LISTS_FILE)
+        if self.finalize:
+            self.finalize_index()
+        if self.snapshot_after_build:
+            self.snapshot_index()
+        
+        print(f"\n向量数据库构建完成！")
+        print(f"成功索引 {success_count} 个文档到索引: {self.index_name}")
+        
+        if self.metrics.enabled:
+            print("\n构建指标:")
+            for name, value in self.metrics.summary()["derived"].items():
+                print(f"  {name}: {value:.2f}")
+    
+    def build_streaming(self, skip_search: bool = False, skip_extract: bool = False,
+                        skip_tags: bool = False, skip_processing: bool = False,
+                        cache_dir: str = None, batch_size: int = 256, compress: bool = False):
+        """
+        内存受限的构建模式：各阶段逐批读写JSONL缓存，经历和chunk不会整体放在内存中
+        
+        缓存文件为 search_results.jsonl、experiences.jsonl、experiences_with_tags.jsonl
+        和 chunks_with_embeddings.jsonl（compress时为 .jsonl.zst），与build()的JSON缓存互不影响。
+        
+        峰值内存由batch_size和ES批量请求大小决定，与经历数量无关；名人质心索引仍为每位名人
+        （及 名人+挑战类型）保留一个向量和，这部分随名人数量增长（BUILD_CENTROIDS=false可关闭）。
+        
+        Args:
+            skip_search: 是否跳过搜索步骤（使用缓存）
+            skip_extract: 是否跳过提取步骤（使用缓存）
+            skip_tags: 是否跳过标签匹配步骤（使用缓存）
+            skip_processing: 是否跳过文本处理步骤（使用缓存）
+            cache_dir: 缓存目录路径
+            batch_size: 每批处理的名人/经历数量
+            compress: 是否用zstd压缩缓存
+        """
+        cache_dir = Path(cache_dir) if cache_dir else Path(__file__).parent / "cache"
+        cache_dir.mkdir(exist_ok=True)
+        files = {
+            name: cache_path(cache_dir, name, compress)
+            for name in ("search_results", "experiences", "experiences_with_tags", "chunks_with_embeddings")
+        }
+        
+        def run_or_load(step: str, stage: str, name: str, skip: bool, records_fn):
+            print("\n" + "=" * 60)
+            print(f"步骤 {step}: {stage}（流式，每批 {batch_size} 条）")
+            print("=" * 60)
+            cache_file = files[name]
+            if skip:
+                self.metrics.cache_lookup(name, cache_file.exists())
+                if not cache_file.exists():
+                    raise FileNotFoundError(f"缓存文件不存在: {cache_file}")
+                print(f"使用缓存: {cache_file}")
+                return
+            count = self._run_stage(stage, lambda: write_jsonl(cache_file, records_fn()), count=lambda n: n)
+            print(f"已写入 {count} 条记录到: {cache_file}")
+        
+        run_or_load("1/5", "search", "search_results", skip_search,
+                    lambda: self._stream_search(batch_size))
+        run_or_load("2/5", "extract", "experiences", skip_extract,
+                    lambda: self._stream_extract(files["search_results"], batch_size))
+        self.num_experiences = sum(1 for _ in iter_jsonl(files["experiences"]))
+        run_or_load("3/5", "tags", "experiences_with_tags", skip_tags,
+                    lambda: self._stream_tags(files["experiences"], batch_size))
+        run_or_load("4/5", "embed", "chunks_with_embeddings", skip_processing,
+                    lambda: self._stream_embed(files["experiences_with_tags"], batch_size))
+        
+        print("\n" + "=" * 60)
+        print("步骤 5/5: 存储到ElasticSearch（流式）")
+        print("=" * 60)
+        embedded_file = files["chunks_with_embeddings"]
+        success_count = self._run_stage(
+            "index", lambda: self._index_stream(embedded_file), count=lambda count: count
+        )
+        if self.build_centroids:
+            self.index_centroids(iter_experience_chunks(embedded_file))
+        if self.build_tag_lists:
+            self.materialize_tag_lists(iter_experience_chunks(embedded_file), cache_dir / TAG_LISTS_FILE)
+        if self.finalize:
+            self.finalize_index()
+        if self.snapshot_after_build:
+            self.snapshot_index()
+        
+        print(f"\n向量数据库构建完成！")
+        print(f"成功索引 {success_count} 个文档到索引: {self.index_name}")
+        
+        if self.metrics.enabled:
+            print("\n构建指标:")
+            for name, value in self.metrics.summary()["derived"].items():
+                print(f"  {name}: {value:.2f}")
+    
+    def _stream_search(self, batch_size: int):
+        """逐批搜索名人，每位名人产出一条记录"""
+        celebrities = self.searcher.load_celebrities()
+        flat = [
+            (profession, en_name, cn_name)
+            for profession, celeb_list in celebrities.items()
+            for en_name, cn_name in celeb_list
+        ]
+        for batch in batched(flat, batch_size):
+            group = {}
+            for profession, en_name, cn_name in batch:
+                group.setdefault(profession, []).append((en_name, cn_name))
+            results = self.searcher.search_all_celebrities(celebrities=group)
+            for profession, items in results.items():
+                for en_name, data in items.items():
+                    yield {"profession": profession, "celebrity_name_en": en_name, **data}
+    
+    def _stream_extract(self, search_file: Path, batch_size: int):
+        """逐批提取结构化经历"""
+        for batch in batched(iter_jsonl(search_file), batch_size):
+            search_results = {}
+            for record in batch:
+                search_results.setdefault(record["profession"], {})[record["celebrity_name_en"]] = {
+                    "chinese_name": record.get("chinese_name", ""),
+                    "search_result": record.get("search_result", ""),
+                }
+            yield from self.extractor.extract_all(search_results)
+    
+    def _stream_tags(self, experience_file: Path, batch_size: int):
+        """逐批匹配标签"""
+        for batch in batched(iter_jsonl(experience_file), batch_size):
+            yield from self.tag_matcher.match_all_experiences(batch, use_llm=True)
+    
+    def _stream_embed(self, experience_file: Path, batch_size: int):
+        """逐批切块和嵌入，每条经历连同其chunk产出一条记录"""
+        for batch in batched(iter_jsonl(experience_file), batch_size):
+            chunks_by_experience = {}
+            for chunk in self.text_processor.process_all_experiences(batch, max_tokens=500):
+                chunks_by_experience.setdefault(chunk.experience_id, []).append(chunk)
+            for experience in batch:
+                yield experience_record(experience, chunks_by_experience.get(experience["experience_id"], []))
+    
+    def _index_stream(self, embedded_file: Path) -> int:
+        """
+        流式创建索引并写入（与_index_chunks的重建逻辑相同）
+        
+        Args:
+            embedded_file: 嵌入阶段的JSONL缓存
         
-        # 批量索引
-        success_count = self.es_setup.bulk_index(self.index_name, chunks)
+        Returns:
+            成功索引的文档数量
+        """
+        # 维度取自第一个有向量的chunk
+        dims = next(
+            (len(chunk.embedding) for _, chunks in iter_experience_chunks(embedded_file)
+             for chunk in chunks if len(chunk.embedding)),
+            None
+        ) or self.text_processor.dims
+        self.es_setup.create_index(self.index_name, delete_existing=False, dims=dims)
+        success_count = self.es_setup.index_experience_stream(
+            self.index_name, iter_experience_chunks(embedded_file)
+        )
+        
+        if success_count == 0 and self.num_experiences:
+            print("\n检测到索引失败，尝试删除并重建索引（可能是映射不匹配）...")
+            self.es_setup.create_index(self.index_name, delete_existing=True, dims=dims)
+            success_count = self.es_setup.index_experience_stream(
+                self.index_name, iter_experience_chunks(embedded_file)
+            )
+        
+        return success_count
+    
+    def index_experiences(self, experiences: list, chunks: list) -> int:
+        """
+        执行索引阶段：创建索引并批量写入chunks，然后重建质心索引（分布式构建的合并步骤也调用此方法）
+        
+        Args:
+            experiences: 经历列表
+            chunks: chunk记录列表
+        
+        Returns:
+            成功索引的文档数量
+        """
+        success_count = self._run_stage(
+            "index", lambda: self._index_chunks(experiences, chunks), count=lambda count: count
+        )
+        if self.build_centroids:
+            self.index_centroids(group_chunks(experiences, chunks))
+        return success_count
+    
+    def index_centroids(self, records) -> int:
+        """
+        计算并重建名人质心索引
+        
+        Args:
+            records: (经历, 该经历的chunk记录列表) 的可迭代对象
+        
+        Returns:
+            写入的质心数量
+        """
+        return self._run_stage(
+            "centroids",
+            lambda: index_centroids(self.es_setup, self.index_name, records,
+                                    by_challenge_type=self.centroids_by_challenge_type),
+            count=lambda count: count
+        )
+    
+    def materialize_tag_lists(self, records, output_path: Path) -> int:
+        """
+        重新生成标签榜单文件
+        
+        Args:
+            records: (经历, 该经历的chunk记录列表) 的可迭代对象
+            output_path: 输出文件路径
+        
+        Returns:
+            写入的榜单数量
+        """
+        k = int(os.getenv("TAG_LISTS_K", "20"))
+        per_celebrity = int(os.getenv("TAG_LISTS_PER_CELEBRITY", "2"))
+        return self._run_stage(
+            "tag_lists",
+            lambda: build_tag_lists(records, self.text_processor, output_path, k=k, per_celebrity=per_celebrity),
+            count=lambda count: count
+        )
+    
+    def finalize_index(self):
+        """
+        构建完成后的收尾：强制合并索引（及配套索引）、可选启用向量预加载、执行预热查询
+
+        启用预加载时会关闭并重新打开刚写入的主索引（preload是静态设置），期间该索引不可查询。
+        """
+        print("\n" + "=" * 60)
+        print("收尾: 强制合并与预热")
+        print("=" * 60)
+        indices = self.es_setup.index_family(self.index_name)
+        self._run_stage(
+            "forcemerge",
+            lambda: [name for name in indices if self.es_setup.force_merge(name, self.max_num_segments)]
+        )
+        if self.preload_vectors:
+            self._run_stage(
+                "preload",
+                lambda: self.es_setup.preload_vectors(self.index_name),
+                count=lambda ok: int(ok)
+            )
+        # 预热只影响首批查询的延迟：失败时记录并继续，不影响之后的快照等步骤
+        try:
+            queries = load_warmup_queries(self.warmup_queries)
+            if queries:
+                self._run_stage(
+                    "warmup",
+                    lambda: warm_up(self.es_setup, self.text_processor, self.index_name, queries),
+                    count=lambda stats: len(queries) * len(stats)
+                )
+        except Exception as e:
+            self.metrics.counter("build_stage_errors_total", "构建阶段失败次数").inc(stage="warmup")
+            print(f"警告: 预热失败，跳过: {type(e).__name__}: {e}")
+    
+    def snapshot_index(self):
+        """
+        为构建好的索引（及其配套索引）创建快照
+        
+        Returns:
+            快照名称，失败时返回None
+        """
+        return self._run_stage(
+            "snapshot",
+            lambda: self.es_setup.snapshot_index(self.index_name, version=self.snapshot_version),
+            count=lambda name: int(name is not None)
+        )
+    
+    def _index_chunks(self, experiences: list, chunks: list) -> int:
+        """
+        创建索引并批量写入chunks
+        
+        Args:
+            experiences: 经历列表
+            chunks: chunk记录列表
+        
+        Returns:
+            成功索引的文档数量
+        """
+        # 创建索引（维度取自实际生成的向量，没有向量时按嵌入模型推断）
+        dims = next((len(chunk.embedding) for chunk in chunks if len(chunk.embedding)), None)
+        dims = dims or self.text_processor.dims
+        self.es_setup.create_index(self.index_name, delete_existing=False, dims=dims)
+        
+        # 批量索引（按ELASTICSEARCH_INDEX_LAYOUT组装文档）
+        success_count = self.es_setup.index_chunks(self.index_name, experiences, chunks)
         
         # 如果索引失败，尝试删除并重建索引（可能是映射不匹配）
         if success_count == 0 and len(chunks) > 0:
             print("\n检测到索引失败，尝试删除并重建索引（可能是映射不匹配）...")
-            self.es_setup.create_index(self.index_name, delete_existing=True)
-            success_count = self.es_setup.bulk_index(self.index_name, chunks)
+            self.es_setup.create_index(self.index_name, delete_existing=True, dims=dims)
+            success_count = self.es_setup.index_chunks(self.index_name, experiences, chunks)
         
-        print(f"\n向量数据库构建完成！")
-        print(f"成功索引 {success_count} 个文档到索引: {self.index_name}")
+        return success_count
+    
+    def _run_stage(self, stage: str, fn, count=len):
+        """
+        执行一个构建阶段，记录耗时和处理的条目数
+        
+        Args:
+            stage: 阶段名称
+            fn: 阶段函数（无参数）
+            count: 根据阶段结果计算条目数的函数
+        
+        Returns:
+            阶段函数的返回值
+        """
+        with self.metrics.span("build_stage", stage=stage):
+            result = fn()
+        self.metrics.counter("build_stage_items_total", "各构建阶段处理的条目数").inc(count(result), stage=stage)
+        return result
     
     def search_experiences(self, query_text: str, size: int = 10, 
                           filter_tags: list = None):
@@ -246,7 +527,7 @@ class VectorDatabaseBuilder:
             搜索结果
         """
         # 生成查询向量
-        embedding = self.text_processor.get_embedding(query_text)
+        embedding = self.text_processor.get_embedding(query_text, stage="query")
         if not embedding:
             return None
         
@@ -260,12 +541,13 @@ class VectorDatabaseBuilder:
             }
         
         # 向量搜索
-        results = self.es_setup.vector_search(
-            self.index_name, 
-            embedding, 
-            size=size,
-            filter_query=filter_query
-        )
+        with self.metrics.span("search_request", mode="filtered" if filter_query else "knn"):
+            results = self.es_setup.vector_search(
+                self.index_name, 
+                embedding, 
+                size=size,
+                filter_query=filter_query
+            )
         
         return results
 
@@ -280,17 +562,83 @@ def main():
     parser.add_argument("--skip-tags", action="store_true", help="跳过标签匹配步骤")
     parser.add_argument("--skip-processing", action="store_true", help="跳过文本处理步骤")
     parser.add_argument("--cache-dir", type=str, help="缓存目录路径")
+    parser.add_argument("--memory-bounded", action="store_true",
+                        help="内存受限模式：各阶段逐批读写JSONL缓存，峰值内存不随语料规模增长")
+    parser.add_argument("--batch-size", type=int, default=256, help="内存受限模式下每批处理的名人/经历数量")
+    parser.add_argument("--compress", action="store_true", help="内存受限模式下用zstd压缩缓存（需要zstandard）")
+    parser.add_argument("--skip-centroids", action="store_true",
+                        help="不重建名人质心索引（默认读取BUILD_CENTROIDS，缺省重建）")
+    parser.add_argument("--skip-tag-lists", action="store_true",
+                        help="不重新生成标签榜单（默认读取BUILD_TAG_LISTS，缺省生成）")
+    parser.add_argument("--skip-finalize", action="store_true",
+                        help="不做强制合并和预热（默认读取FINALIZE_INDEX，缺省执行）")
+    parser.add_argument("--preload", action="store_true",
+                        help="收尾时启用index.store.preload预加载向量文件（默认读取FINALIZE_PRELOAD）；"
+                             "需要关闭并重新打开主索引，期间正在服务的查询会失败")
+    parser.add_argument("--warmup-queries", type=str,
+                        help="预热查询：tags、查询日志路径或none（默认读取WARMUP_QUERIES，缺省tags）")
+    parser.add_argument("--snapshot", nargs="?", const="", metavar="VERSION",
+                        help="构建完成后为索引创建快照，可指定版本号（默认读取SNAPSHOT_AFTER_BUILD，缺省不创建）")
+    parser.add_argument("--budget-usd", type=float, help="单次运行预算（美元），默认读取BUDGET_RUN_USD")
+    parser.add_argument("--stage-budget", type=str,
+                        help="单阶段预算，如 tags=2,search=5（美元），默认读取BUDGET_STAGE_USD")
+    parser.add_argument("--metrics-output", type=str,
+                        help="启用指标并在构建结束时导出（.prom/.txt为Prometheus文本格式，其他为JSON摘要），默认读取METRICS_EXPORT")
     
     args = parser.parse_args()
     
-    builder = VectorDatabaseBuilder()
-    builder.build(
-        skip_search=args.skip_search,
-        skip_extract=args.skip_extract,
-        skip_tags=args.skip_tags,
-        skip_processing=args.skip_processing,
-        cache_dir=args.cache_dir
+    metrics_output = args.metrics_output or os.getenv("METRICS_EXPORT")
+    if metrics_output:
+        configure_metrics(enabled=True)
+    configure_budget(
+        run_budget=args.budget_usd,
+        stage_budgets=parse_stage_budgets(args.stage_budget) if args.stage_budget else None
     )
+    
+    # 预热查询文件在启动时检查，不要等到构建完成后才发现路径写错
+    warmup_source = args.warmup_queries or os.getenv("WARMUP_QUERIES", "tags")
+    finalize = not args.skip_finalize and os.getenv("FINALIZE_INDEX", "true").lower() in ("1", "true", "yes")
+    if finalize and warmup_source not in ("tags", "none") and not Path(warmup_source).exists():
+        parser.error(f"预热查询文件不存在: {warmup_source}")
+    
+    builder = VectorDatabaseBuilder()
+    if args.skip_centroids:
+        builder.build_centroids = False
+    if args.skip_tag_lists:
+        builder.build_tag_lists = False
+    if args.skip_finalize:
+        builder.finalize = False
+    if args.preload:
+        builder.preload_vectors = True
+    if args.warmup_queries:
+        builder.warmup_queries = args.warmup_queries
+    if args.snapshot is not None:
+        builder.snapshot_after_build = True
+        builder.snapshot_version = args.snapshot or builder.snapshot_version
+    try:
+        if args.memory_bounded:
+            builder.build_streaming(
+                skip_search=args.skip_search,
+                skip_extract=args.skip_extract,
+                skip_tags=args.skip_tags,
+                skip_processing=args.skip_processing,
+                cache_dir=args.cache_dir,
+                batch_size=args.batch_size,
+                compress=args.compress
+            )
+        else:
+            builder.build(
+                skip_search=args.skip_search,
+                skip_extract=args.skip_extract,
+                skip_tags=args.skip_tags,
+                skip_processing=args.skip_processing,
+                cache_dir=args.cache_dir
+            )
+    finally:
+        builder.budget.print_report(builder.num_experiences)
+        if metrics_output:
+            path = get_metrics().export(metrics_output)
+            print(f"\n指标已导出到: {path}")
 
 
 if __name__ == "__main__":
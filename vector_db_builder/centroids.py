@@ -0,0 +1,317 @@
+"""
+名人质心索引：先找名人、再找经历的两阶段检索
+
+构建时为每位名人计算一个质心向量（可选再为每个 名人+挑战类型 计算一个），写入很小的
+<index>_celebrities 索引。"哪位名人和我最像"这类查询先在质心索引上做kNN选出名人，
+再只在这些名人的chunk上做带过滤的kNN取支撑经历，不需要在chunk级别超量召回后再按名人分组。
+
+质心的计算方式：每条经历先取其chunk向量的均值并归一化，名人质心是其经历向量的均值再归一化，
+chunk较多的长经历不会主导质心。
+"""
+import os
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+try:
+    from .records import ChunkRecord, unpack_vector
+    from .elasticsearch_setup import ElasticsearchSetup, centroid_index_name
+    from .profile_matching import aggregate_matches
+except ImportError:
+    from records import ChunkRecord, unpack_vector
+    from elasticsearch_setup import ElasticsearchSetup, centroid_index_name
+    from profile_matching import aggregate_matches
+
+
+# 质心层级
+CELEBRITY_LEVEL = "celebrity"
+CHALLENGE_TYPE_LEVEL = "challenge_type"
+
+
+def experience_vector(chunks: List[ChunkRecord]) -> Optional[np.ndarray]:
+    """
+    经历向量：chunk向量的均值，归一化
+
+    Args:
+        chunks: 该经历的chunk记录
+
+    Returns:
+        float64单位向量，没有可用向量时返回None
+    """
+    vectors = [chunk.embedding for chunk in chunks if len(chunk.embedding)]
+    if not vectors:
+        return None
+    vector = np.asarray(vectors, dtype=np.float64).mean(axis=0)
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return None
+    return vector / norm
+
+
+class CentroidBuilder:
+    def __init__(self, by_challenge_type: bool = True):
+        """
+        初始化质心累加器（只保存每个质心的向量和，内存与名人数量成正比：
+        每个质心dims个float64，1024维约8KB，按挑战类型细分时每位名人有多个质心）
+
+        Args:
+            by_challenge_type: 是否额外计算 名人+挑战类型 的质心
+        """
+        self.by_challenge_type = by_challenge_type
+        self._sums: Dict[Tuple[str, str], np.ndarray] = {}
+        self._counts: Dict[Tuple[str, str], int] = {}
+        self._meta: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def add(self, experience: Dict[str, Any], chunks: List[ChunkRecord]):
+        """
+        累加一条经历
+
+        Args:
+            experience: 经历
+            chunks: 该经历的chunk记录
+        """
+        celebrity = experience.get("celebrity_name_en")
+        vector = experience_vector(chunks)
+        if vector is None or not celebrity:
+            return
+
+        keys = [(CELEBRITY_LEVEL, celebrity)]
+        challenge_type = experience.get("challenge_type")
+        if self.by_challenge_type and challenge_type:
+            keys.append((CHALLENGE_TYPE_LEVEL, f"{celebrity}::{challenge_type}"))
+        for key in keys:
+            if key in self._sums:
+                self._sums[key] += vector
+                self._counts[key] += 1
+                continue
+            self._sums[key] = vector.copy()
+            self._counts[key] = 1
+            self._meta[key] = {
+                "celebrity_name_en": celebrity,
+                "celebrity_name_cn": experience.get("celebrity_name_cn", ""),
+                "profession": experience.get("profession", ""),
+                "challenge_type": challenge_type if key[0] == CHALLENGE_TYPE_LEVEL else None,
+            }
+
+    @property
+    def dims(self) -> int:
+        """质心维度（还没有累加任何向量时为0）"""
+        return len(next(iter(self._sums.values()))) if self._sums else 0
+
+    def documents(self) -> Iterator[Dict[str, Any]]:
+        """
+        生成质心文档
+
+        Yields:
+            ES文档（embedding为归一化后的质心）
+        """
+        for key, total in self._sums.items():
+            level, centroid_id = key
+            norm = np.linalg.norm(total)
+            if norm == 0:
+                continue
+            yield {
+                "centroid_id": centroid_id,
+                "level": level,
+                **self._meta[key],
+                "num_experiences": self._counts[key],
+                "embedding": unpack_vector((total / norm).astype(np.float32)),
+            }
+
+    def __len__(self) -> int:
+        return len(self._sums)
+
+
+def index_centroids(es_setup: ElasticsearchSetup, index_name: str,
+                    records: Iterable[Tuple[Dict[str, Any], List[ChunkRecord]]],
+                    by_challenge_type: bool = True) -> int:
+    """
+    计算并重建质心索引
+
+    Args:
+        es_setup: ElasticSearch设置
+        index_name: chunk索引名称（质心写入 <index_name>_celebrities）
+        records: (经历, 该经历的chunk记录列表) 的可迭代对象
+        by_challenge_type: 是否额外计算 名人+挑战类型 的质心
+
+    Returns:
+        写入的质心数量
+    """
+    builder = CentroidBuilder(by_challenge_type=by_challenge_type)
+    for experience, chunks in records:
+        builder.add(experience, chunks)
+    if not len(builder):
+        print("没有可用的向量，跳过质心索引")
+        return 0
+
+    target = centroid_index_name(index_name)
+    if not es_setup.create_centroid_index(target, builder.dims):
+        return 0
+    count = es_setup.bulk_index(target, builder.documents(), id_field="centroid_id")
+    print(f"已写入 {count} 个质心到索引: {target}")
+    return count
+
+
+def group_chunks(experiences: List[Dict[str, Any]],
+                 chunks: Iterable[ChunkRecord]) -> Iterator[Tuple[Dict[str, Any], List[ChunkRecord]]]:
+    """
+    把chunk列表按经历分组
+
+    Args:
+        experiences: 经历列表（需包含experience_id）
+        chunks: chunk记录
+
+    Yields:
+        (经历, 该经历的chunk记录列表)
+    """
+    chunks_by_experience: Dict[str, List[ChunkRecord]] = {}
+    for chunk in chunks:
+        chunks_by_experience.setdefault(chunk.experience_id, []).append(chunk)
+    for experience in experiences:
+        yield experience, chunks_by_experience.get(experience["experience_id"], [])
+
+
+class CelebrityMatcher:
+    def __init__(self, text_processor=None, es_setup: ElasticsearchSetup = None, index_name: str = None):
+        """
+        初始化两阶段名人检索
+
+        Args:
+            text_processor: 文本处理器，默认创建启用对冲请求的TextProcessor（只在按文本查询时需要）
+            es_setup: ElasticSearch设置，默认使用环境变量中的地址和布局
+            index_name: chunk索引名称，默认从环境变量ELASTICSEARCH_INDEX读取
+        """
+        self._text_processor = text_processor
+        self.es_setup = es_setup or ElasticsearchSetup()
+        self.index_name = index_name or os.getenv("ELASTICSEARCH_INDEX", "celebrity_experiences")
+
+    @property
+    def text_processor(self):
+        """文本处理器（只做match_embedding时不需要API密钥）"""
+        if self._text_processor is None:
+            try:
+                from .text_processing import TextProcessor
+            except ImportError:
+                from text_processing import TextProcessor
+            self._text_processor = TextProcessor(hedge=True, budget_stage="query")
+        return self._text_processor
+
+    def match(self, query_text: str, size: int = 5, **kwargs) -> List[Dict[str, Any]]:
+        """
+        按文本查询最相似的名人
+
+        Args:
+            query_text: 查询文本
+            size: 返回的名人数量
+            **kwargs: 透传给match_embedding
+
+        Returns:
+            名人列表，见match_embedding
+        """
+        embedding = self.text_processor.get_embedding(query_text)
+        if not embedding:
+            print("生成向量失败")
+            return []
+        return self.match_embedding(embedding, size=size, **kwargs)
+
+    def match_embedding(self, embedding: list, size: int = 5, experiences_per_celebrity: int = 3,
+                        candidates: int = 50, challenge_type: str = None) -> List[Dict[str, Any]]:
+        """
+        两阶段名人检索：质心kNN选出名人，再在这些名人的chunk中检索支撑经历
+
+        Args:
+            embedding: 查询向量
+            size: 返回的名人数量
+            experiences_per_celebrity: 每个名人附带的支撑经历数量
+            candidates: 第二阶段检索的候选数量（flat/compact布局为chunk数）
+            challenge_type: 只按该挑战类型的质心匹配，支撑经历也限定为该挑战类型
+
+        Returns:
+            名人列表（按质心相似度降序），每项包含centroid_score和支撑经历
+        """
+        if challenge_type:
+            centroid_filter = {"bool": {"filter": [
+                {"term": {"level": CHALLENGE_TYPE_LEVEL}},
+                {"term": {"challenge_type": challenge_type}},
+            ]}}
+        else:
+            centroid_filter = {"term": {"level": CELEBRITY_LEVEL}}
+        with self.es_setup.metrics.span("search_request", mode="centroid"):
+            centroids = self.es_setup.centroid_search(
+                centroid_index_name(self.index_name), embedding, size=size, filter_query=centroid_filter
+            )
+        if not centroids or not centroids["hits"]["hits"]:
+            return []
+
+        centroid_scores = {
+            hit["_source"]["celebrity_name_en"]: hit["_score"] for hit in centroids["hits"]["hits"]
+        }
+        chunk_filter = [{"terms": {"celebrity_name_en": list(centroid_scores)}}]
+        if challenge_type:
+            chunk_filter.append({"term": {"challenge_type": challenge_type}})
+        with self.es_setup.metrics.span("search_request", mode="centroid_drilldown"):
+            result = self.es_setup.vector_search(
+                self.index_name, embedding, size=candidates, filter_query={"bool": {"filter": chunk_filter}}
+            )
+
+        supporting = {
+            match["celebrity_name_en"]: match
+            for match in aggregate_matches([result], np.ones(1, dtype=np.float32), size=len(centroid_scores),
+                                           experiences_per_celebrity=experiences_per_celebrity)
+        }
+        matches = []
+        for hit in centroids["hits"]["hits"]:
+            source = hit["_source"]
+            detail = supporting.get(source["celebrity_name_en"], {})
+            matches.append({
+                "celebrity_name_en": source["celebrity_name_en"],
+                "celebrity_name_cn": source.get("celebrity_name_cn", ""),
+                "profession": source.get("profession", ""),
+                "centroid_score": hit["_score"],
+                "score": detail.get("score", 0.0),
+                "experiences": detail.get("experiences", []),
+            })
+        return matches
+
+
+def print_celebrity_matches(matches: List[Dict[str, Any]]):
+    """打印两阶段名人检索结果"""
+    print(f"\n匹配到 {len(matches)} 位名人\n")
+    for i, match in enumerate(matches, 1):
+        print(f"{'='*60}")
+        print(f"{i}. {match['celebrity_name_cn']} ({match['celebrity_name_en']}) "
+              f"质心相似度: {match['centroid_score']:.4f}")
+        print(f"{'='*60}")
+        print(f"职业: {match['profession']}")
+        for experience in match["experiences"]:
+            print(f"  - ({experience['score']:.4f}) {experience['source'].get('event_summary', '')}")
+        print()
+
+
+def main():
+    """命令行入口"""
+    import argparse
+
+    try:
+        from .config import load_env
+    except ImportError:
+        from config import load_env
+    load_env()
+
+    parser = argparse.ArgumentParser(description="两阶段名人检索（质心索引 + 经历kNN）")
+    parser.add_argument("query", type=str, help="查询文本")
+    parser.add_argument("--size", type=int, default=5, help="返回的名人数量")
+    parser.add_argument("--experiences", type=int, default=3, help="每个名人附带的支撑经历数量")
+    parser.add_argument("--candidates", type=int, default=50, help="第二阶段检索的候选数量")
+    parser.add_argument("--challenge-type", type=str, help="只按该挑战类型匹配")
+    args = parser.parse_args()
+
+    matches = CelebrityMatcher().match(
+        args.query, size=args.size, experiences_per_celebrity=args.experiences,
+        candidates=args.candidates, challenge_type=args.challenge_type,
+    )
+    print_celebrity_matches(matches)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+客户端注册表：进程内按端点共享 OpenAI 和 Elasticsearch 客户端
+
+同一端点的所有组件复用一个客户端（及其keep-alive连接池），重复调用不再重新握手或ping；
+进程退出时统一关闭。两种客户端都是线程安全的，可以在线程池中共用。
+
+配置（环境变量）:
+    HTTP_MAX_CONNECTIONS                 每个OpenAI客户端的最大连接数（默认64）
+    HTTP_MAX_KEEPALIVE_CONNECTIONS       保持空闲的keep-alive连接数（默认32）
+    HTTP_KEEPALIVE_EXPIRY                空闲连接保留秒数（默认60）
+    ELASTICSEARCH_CONNECTIONS_PER_NODE   每个ES节点的连接池大小（默认16）
+    ELASTICSEARCH_SKIP_PING              创建ES客户端时跳过连通性检查（默认false）
+"""
+import atexit
+import os
+import threading
+from typing import Dict, Tuple
+
+try:
+    from .metrics import get_metrics
+except ImportError:
+    from metrics import get_metrics
+
+
+_openai_clients: Dict[Tuple[str, str], object] = {}
+_es_clients: Dict[str, object] = {}
+_lock = threading.Lock()
+
+
+def _http_limits():
+    """按环境变量生成httpx连接池限制（默认值按本项目的线程池大小设置，SDK默认只保留5秒空闲连接）"""
+    from openai import DEFAULT_CONNECTION_LIMITS
+
+    # 使用SDK所依赖的httpx中的Limits类型
+    return type(DEFAULT_CONNECTION_LIMITS)(
+        max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "64")),
+        max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "32")),
+        keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60")),
+    )
+
+
+def get_openai_client(base_url: str, api_key: str):
+    """
+    获取 端点 + API密钥 对应的共享OpenAI客户端
+
+    重试由共享限流器负责，客户端设置 max_retries=0。
+
+    Args:
+        base_url: API基础URL
+        api_key: API密钥
+
+    Returns:
+        OpenAI客户端
+    """
+    key = (base_url.rstrip("/"), api_key)
+    client = _openai_clients.get(key)
+    if client is None:
+        with _lock:
+            client = _openai_clients.get(key)
+            if client is None:
+                from openai import OpenAI
+                client = _openai_clients[key] = OpenAI(
+                    base_url=base_url,
+                    api_key=api_key,
+                    max_retries=0,
+                    http_client=get_metrics().http_client(limits=_http_limits()),
+                )
+    return client
+
+
+def _check_es_version():
+    """ElasticSearch 8.x服务器只接受version 7或8的兼容头"""
+    try:
+        import elasticsearch as es_module
+        major_version = int(es_module.__version__.split('.')[0])
+    except (ImportError, AttributeError, ValueError):
+        return  # 版本检查失败不影响连接尝试
+    if major_version >= 9:
+        raise ValueError(
+            f"Elasticsearch客户端版本不兼容！\n"
+            f"当前版本: {es_module.__version__} (需要 < 9.0.0)\n"
+            f"ElasticSearch服务器版本: 8.13.4\n"
+            f"解决方案: pip install 'elasticsearch>=8.0.0,<9.0.0'"
+        )
+
+
+def _ping(es, es_url: str):
+    """测试连接，失败时抛出带排查提示的ConnectionError"""
+    print("正在测试连接...")
+    try:
+        # 尝试ping，如果失败则尝试info()
+        if not es.ping():
+            info = es.info()
+            print(f"警告: ping()返回False，但info()成功，集群: {info.get('cluster_name')}")
+    except Exception as e:
+        error_msg = str(e)
+        error_type = type(e).__name__
+
+        # 生成错误提示
+        help_msg = (
+            f"无法连接到ElasticSearch ({es_url})。\n"
+            f"错误类型: {error_type}\n"
+            f"错误信息: {error_msg}\n\n"
+            f"请检查：\n"
+            f"  1) ElasticSearch容器是否运行: docker-compose ps\n"
+            f"  2) 测试连接: curl {es_url}\n"
+            f"  3) 如果容器未运行，启动: docker-compose up -d"
+        )
+
+        # 如果是版本兼容性问题，提供额外提示
+        if "media_type_header_exception" in error_msg or "compatible-with" in error_msg:
+            help_msg += (
+                f"\n\n注意: 这可能是版本兼容性问题。\n"
+                f"请确保使用: pip install 'elasticsearch>=8.0.0,<9.0.0'"
+            )
+
+        raise ConnectionError(help_msg) from e
+
+
+def get_elasticsearch(es_url: str, ping: bool = None):
+    """
+    获取ES地址对应的共享Elasticsearch客户端
+
+    只在首次创建客户端时测试连接，之后的调用直接复用。
+
+    Args:
+        es_url: 完整的ES地址（http://host:port）
+        ping: 创建时是否测试连接，默认读取ELASTICSEARCH_SKIP_PING（缺省测试）
+
+    Returns:
+        Elasticsearch客户端
+    """
+    key = es_url.rstrip("/")
+    client = _es_clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _es_clients.get(key)
+        if client is not None:
+            return client
+
+        from elasticsearch import Elasticsearch
+
+        if ping is None:
+            ping = os.getenv("ELASTICSEARCH_SKIP_PING", "false").lower() not in ("1", "true", "yes")
+
+        print(f"正在连接到ElasticSearch: {es_url}")
+        _check_es_version()
+        client = Elasticsearch(
+            hosts=[key],
+            request_timeout=30,
+            max_retries=3,
+            retry_on_timeout=True,
+            connections_per_node=int(os.getenv("ELASTICSEARCH_CONNECTIONS_PER_NODE", "16")),
+        )
+        if ping:
+            try:
+                _ping(client, key)
+            except ConnectionError:
+                # 连接失败时不缓存，下次调用重新尝试
+                client.close()
+                raise
+            print(f"✓ 成功连接到ElasticSearch: {es_url}")
+        _es_clients[key] = client
+    return client
+
+
+def close_all():
+    """关闭注册表中的所有客户端（进程退出时自动调用）"""
+    with _lock:
+        clients = list(_openai_clients.values()) + list(_es_clients.values())
+        _openai_clients.clear()
+        _es_clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+
+atexit.register(close_all)
@@ -0,0 +1,83 @@
+"""
+配置模块：各脚本共用的启动逻辑（加载.env环境变量）
+
+查找顺序：项目根目录的 env/.env → 项目根目录的 .env → python-dotenv的默认查找。
+必须在读取环境变量的模块初始化之前调用 load_env()，重复调用不会重复加载。
+"""
+import os
+import re
+from pathlib import Path
+from typing import Optional
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+_loaded = False
+
+
+def load_env_file(env_path: Path):
+    """
+    加载.env文件，支持两种格式：
+    1. KEY=value (标准格式)
+    2. export KEY=value (shell格式)
+    """
+    if not env_path.exists():
+        return False
+
+    with open(env_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            # 跳过空行和注释
+            if not line or line.startswith('#'):
+                continue
+
+            # 移除export关键字（如果存在）
+            line = re.sub(r'^export\s+', '', line)
+
+            # 解析KEY=value
+            if '=' in line:
+                key, value = line.split('=', 1)
+                key = key.strip()
+                value = value.strip()
+
+                # 移除引号（如果存在）
+                if (value.startswith('"') and value.endswith('"')) or \
+                   (value.startswith("'") and value.endswith("'")):
+                    value = value[1:-1]
+
+                # 设置环境变量
+                os.environ[key] = value
+
+    return True
+
+
+def load_env() -> Optional[Path]:
+    """
+    加载环境变量（优先使用python-dotenv，不存在时使用 load_env_file）
+
+    Returns:
+        加载的.env文件路径；未找到项目内的.env时返回None
+    """
+    global _loaded
+    if _loaded:
+        return None
+    _loaded = True
+
+    # 尝试加载python-dotenv，如果不存在则使用自定义加载函数
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        load_dotenv = None
+
+    # 首先尝试从项目根目录的env/.env加载，其次是项目根目录的.env
+    for env_path in (PROJECT_ROOT / "env" / ".env", PROJECT_ROOT / ".env"):
+        if env_path.exists():
+            if load_dotenv is not None:
+                load_dotenv(env_path)
+            else:
+                load_env_file(env_path)
+            return env_path
+
+    # 最后尝试默认位置（如果使用dotenv）
+    if load_dotenv is not None:
+        load_dotenv()
+    return None
@@ -0,0 +1,599 @@
+"""
+分布式构建：把名人列表切分成分片放入本地工作队列，由多个worker进程并行执行
+搜索→提取→标签→嵌入，最后合并各分片的结果并批量写入ElasticSearch
+
+工作目录结构:
+    queue.db                      SQLite工作队列（分片、状态、租约）
+    shards/shard-00001.json       各分片的chunk缓存（与chunks_with_embeddings.json格式相同）
+    chunks_with_embeddings.json   合并后的chunk缓存
+
+worker通过租约认领分片并定期续约；worker崩溃或被杀掉后租约过期，分片会被其他worker重新认领。
+多台机器可以共享同一个工作目录（各自启动worker），但SQLite在网络文件系统上依赖文件锁，
+需要确认NFS等共享存储支持POSIX锁，且各机器时钟基本同步。
+
+用法:
+    python distributed_build.py init --shard-size 20
+    python distributed_build.py worker --workers 8        # 每台机器各自启动
+    python distributed_build.py status
+    python distributed_build.py merge
+    python distributed_build.py run --workers 8           # 单机：init + worker + merge
+"""
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Dict, List, Tuple, Any, Optional
+
+# 添加当前目录到路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+# 加载环境变量（必须在导入其他模块之前）
+from config import load_env
+load_env()
+
+from records import save_chunk_cache, load_chunk_cache
+from budget import get_budget
+
+
+QUEUE_FILE = "queue.db"
+SHARD_DIR = "shards"
+MERGED_CACHE_FILE = "chunks_with_embeddings.json"
+
+DEFAULT_WORK_DIR = Path(__file__).parent / "cache" / "distributed"
+
+# 分片内没有产出经历的名人（搜索/提取失败或预算跳过）或缺少向量的chunk超过该比例时，本次尝试按失败处理
+SHARD_MAX_ERROR_RATE = float(os.getenv("SHARD_MAX_ERROR_RATE", "0.2"))
+
+
+class ShardQualityError(RuntimeError):
+    """分片结果中失败或为空的比例过高（各阶段吞掉的错误），不能按完成处理"""
+
+
+class ShardQueue:
+    """基于SQLite的持久化分片队列（每次操作单独连接，可在多线程和多进程中使用）"""
+
+    def __init__(self, path: Path):
+        """
+        初始化队列
+
+        Args:
+            path: SQLite数据库文件路径
+        """
+        self.path = Path(path)
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None：由BEGIN IMMEDIATE显式控制事务，认领分片时先拿写锁
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self, shards: List[Dict[str, Any]], reset: bool = False):
+        """
+        创建队列并写入分片
+
+        Args:
+            shards: 分片内容列表
+            reset: 队列已存在时是否清空重建
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if reset:
+                conn.execute("DROP TABLE IF EXISTS shards")
+            conn.execute("""
+                CREATE TABLE shards (
+                    id INTEGER PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    worker TEXT,
+                    lease_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    output TEXT,
+                    error TEXT,
+                    updated_at REAL
+                )
+            """)
+            now = time.time()
+            conn.executemany(
+                "INSERT INTO shards (id, payload, updated_at) VALUES (?, ?, ?)",
+                [(i, json.dumps(shard, ensure_ascii=False), now) for i, shard in enumerate(shards, 1)],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def claim(self, worker: str, lease_seconds: float, max_attempts: int) -> Optional[Dict[str, Any]]:
+        """
+        认领一个待处理或租约已过期的分片
+
+        Args:
+            worker: worker标识
+            lease_seconds: 租约时长（秒）
+            max_attempts: 最大尝试次数，达到后标记为failed不再认领
+
+        Returns:
+            {"id", "payload", "attempts"}；没有可认领的分片时返回None
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            while True:
+                row = conn.execute(
+                    "SELECT id, payload, attempts, status FROM shards "
+                    "WHERE status = 'pending' OR (status = 'running' AND lease_until < ?) "
+                    "ORDER BY id LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                if row["attempts"] >= max_attempts:
+                    # 租约过期的分片已用完尝试次数（例如每次都导致worker崩溃）
+                    conn.execute(
+                        "UPDATE shards SET status = 'failed', error = COALESCE(error, ?), updated_at = ? WHERE id = ?",
+                        ("租约过期且已达到最大尝试次数", now, row["id"]),
+                    )
+                    continue
+                conn.execute(
+                    "UPDATE shards SET status = 'running', worker = ?, lease_until = ?, "
+                    "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (worker, now + lease_seconds, now, row["id"]),
+                )
+                conn.execute("COMMIT")
+                if row["status"] == "running":
+                    print(f"[{worker}] 接管租约已过期的分片 {row['id']}")
+                return {"id": row["id"], "payload": json.loads(row["payload"]), "attempts": row["attempts"] + 1}
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _update_owned(self, shard_id: int, worker: str, sql: str, params: tuple) -> bool:
+        """只在分片仍由该worker持有时更新，返回是否更新成功"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                f"UPDATE shards SET {sql}, updated_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                params + (time.time(), shard_id, worker),
+            )
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def renew(self, shard_id: int, worker: str, lease_seconds: float) -> bool:
+        """续约，返回False表示租约已被其他worker接管"""
+        return self._update_owned(shard_id, worker, "lease_until = ?", (time.time() + lease_seconds,))
+
+    def complete(self, shard_id: int, worker: str, output: str) -> bool:
+        """标记分片完成"""
+        return self._update_owned(
+            shard_id, worker, "status = 'done', output = ?, lease_until = NULL, error = NULL", (output,)
+        )
+
+    def fail(self, shard_id: int, worker: str, error: str, max_attempts: int) -> bool:
+        """记录失败：未达到最大尝试次数时放回队列，否则标记为failed"""
+        return self._update_owned(
+            shard_id, worker,
+            "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, lease_until = NULL, error = ?",
+            (max_attempts, error),
+        )
+
+    def counts(self) -> Dict[str, int]:
+        """各状态的分片数量"""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT status, COUNT(*) FROM shards GROUP BY status").fetchall()
+        finally:
+            conn.close()
+        counts = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """所有分片的状态（不含分片内容）"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT id, status, worker, lease_until, attempts, output, error FROM shards ORDER BY id"
+            ).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+
+class LeaseKeeper:
+    """处理分片期间在后台线程中定期续约"""
+
+    def __init__(self, queue: ShardQueue, shard_id: int, worker: str, lease_seconds: float):
+        self.queue = queue
+        self.shard_id = shard_id
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            if not self.queue.renew(self.shard_id, self.worker, self.lease_seconds):
+                print(f"[{self.worker}] 警告: 分片 {self.shard_id} 的租约已被其他worker接管")
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def partition_celebrities(celebrities: Dict[str, List[Tuple[str, str]]],
+                          shard_size: int) -> List[Dict[str, Any]]:
+    """
+    把名人列表按固定人数切分成分片（顺序稳定，同样的输入总是得到同样的分片）
+
+    Args:
+        celebrities: load_celebrities的返回值
+        shard_size: 每个分片的名人数量
+
+    Returns:
+        分片列表，每个分片为 {"celebrities": {职业: [[英文名, 中文名], ...]}}
+    """
+    flat = [
+        (profession, en_name, cn_name)
+        for profession, celeb_list in celebrities.items()
+        for en_name, cn_name in celeb_list
+    ]
+    shards = []
+    for start in range(0, len(flat), shard_size):
+        group = {}
+        for profession, en_name, cn_name in flat[start:start + shard_size]:
+            group.setdefault(profession, []).append([en_name, cn_name])
+        shards.append({"celebrities": group})
+    return shards
+
+
+class ShardWorker:
+    """在一个进程内处理分片：搜索→提取→标签→嵌入，结果写入分片缓存"""
+
+    def __init__(self, work_dir: Path):
+        from search_celebrity_experiences import CelebrityExperienceSearcher
+        from extract_structured_data import StructuredDataExtractor
+        from tag_matching import TagMatcher
+        from text_processing import TextProcessor
+        from elasticsearch_setup import build_vector_options
+
+        self.shard_dir = Path(work_dir) / SHARD_DIR
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        self.searcher = CelebrityExperienceSearcher()
+        self.extractor = StructuredDataExtractor()
+        self.tag_matcher = TagMatcher()
+        self.text_processor = TextProcessor()
+        # worker不连接ES，按索引配置判断是否需要归一化（与VectorDatabaseBuilder一致）
+        if build_vector_options().get("similarity") == "dot_product":
+            self.text_processor.normalize = True
+
+    @staticmethod
+    def check_quality(shard_id: int, celebrities: Dict[str, List[Tuple[str, str]]],
+                      experiences: list, chunks: list):
+        """
+        检查分片结果：各阶段失败时只打印错误并返回空结果，不检查的话分片会带着缺失的名人被标记为完成
+
+        Args:
+            shard_id: 分片编号
+            celebrities: 分片内的名人
+            experiences: 提取出的经历
+            chunks: 生成的chunk记录
+        """
+        names = {en_name for pairs in celebrities.values() for en_name, _ in pairs}
+        produced = {exp.get("celebrity_name_en") for exp in experiences}
+        empty = len(names - produced)
+        missing_vectors = sum(1 for chunk in chunks if not len(chunk.embedding))
+        problems = []
+        if names and empty / len(names) > SHARD_MAX_ERROR_RATE:
+            problems.append(f"{empty}/{len(names)} 位名人没有产出经历")
+        if chunks and missing_vectors / len(chunks) > SHARD_MAX_ERROR_RATE:
+            problems.append(f"{missing_vectors}/{len(chunks)} 个chunk缺少向量")
+        if problems:
+            raise ShardQualityError(
+                f"分片 {shard_id} 结果不完整: {'，'.join(problems)}（阈值 {SHARD_MAX_ERROR_RATE:.0%}）"
+            )
+        if empty or missing_vectors:
+            print(f"警告: 分片 {shard_id} 有 {empty} 位名人没有产出经历，{missing_vectors} 个chunk缺少向量")
+
+    def process(self, shard_id: int, payload: Dict[str, Any], worker: str) -> Path:
+        """
+        处理一个分片
+
+        Args:
+            shard_id: 分片编号
+            payload: 分片内容
+            worker: worker标识（用于临时文件名）
+
+        Returns:
+            分片缓存文件路径
+
+        Raises:
+            ShardQualityError: 失败或为空的比例超过SHARD_MAX_ERROR_RATE
+        """
+        celebrities = {
+            profession: [tuple(pair) for pair in pairs]
+            for profession, pairs in payload["celebrities"].items()
+        }
+        search_results = self.searcher.search_all_celebrities(celebrities=celebrities)
+        experiences = self.extractor.extract_all(search_results)
+        experiences = self.tag_matcher.match_all_experiences(experiences, use_llm=True)
+        chunks = self.text_processor.process_all_experiences(experiences, max_tokens=500)
+        self.check_quality(shard_id, celebrities, experiences, chunks)
+
+        # 先写临时文件再改名，合并步骤不会读到写了一半的文件
+        output = self.shard_dir / f"shard-{shard_id:05d}.json"
+        tmp = output.with_name(f".{output.name}.{worker}.tmp")
+        save_chunk_cache(tmp, experiences, chunks)
+        os.replace(tmp, output)
+        return output
+
+
+def run_worker(work_dir: Path, lease_seconds: float = 600, max_attempts: int = 3,
+               poll_interval: float = 5.0) -> int:
+    """
+    worker主循环：认领分片并处理，直到队列中没有待处理和处理中的分片
+
+    Args:
+        work_dir: 工作目录
+        lease_seconds: 租约时长（秒）
+        max_attempts: 每个分片的最大尝试次数
+        poll_interval: 其他worker仍在处理时的轮询间隔（秒）
+
+    Returns:
+        本worker完成的分片数
+    """
+    work_dir = Path(work_dir)
+    queue = ShardQueue(work_dir / QUEUE_FILE)
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    shard_worker = ShardWorker(work_dir)
+    completed = 0
+
+    try:
+        while True:
+            shard = queue.claim(worker, lease_seconds, max_attempts)
+            if shard is None:
+                counts = queue.counts()
+                if counts["pending"] == 0 and counts["running"] == 0:
+                    break
+                # 其他worker仍在处理：等待完成，或在其租约过期后接管
+                time.sleep(poll_interval)
+                continue
+
+            shard_id = shard["id"]
+            print(f"[{worker}] 开始处理分片 {shard_id}（第 {shard['attempts']} 次尝试）")
+            start = time.perf_counter()
+            try:
+                with LeaseKeeper(queue, shard_id, worker, lease_seconds):
+                    output = shard_worker.process(shard_id, shard["payload"], worker)
+            except Exception as e:
+                traceback.print_exc()
+                queue.fail(shard_id, worker, f"{type(e).__name__}: {e}", max_attempts)
+                print(f"[{worker}] 分片 {shard_id} 处理失败: {e}")
+                continue
+
+            # 记录相对于工作目录的路径：多台机器可以把共享目录挂载在不同位置
+            if queue.complete(shard_id, worker, str(output.relative_to(work_dir))):
+                completed += 1
+                print(f"[{worker}] 分片 {shard_id} 完成，耗时 {time.perf_counter() - start:.1f}s")
+            else:
+                # 租约已被接管，另一个worker会写出相同内容的分片文件
+                print(f"[{worker}] 警告: 分片 {shard_id} 已由其他worker接管，本次结果不计入")
+    finally:
+        get_budget().print_report()
+    return completed
+
+
+def _worker_main(work_dir: str, lease_seconds: float, max_attempts: int, poll_interval: float):
+    run_worker(Path(work_dir), lease_seconds, max_attempts, poll_interval)
+
+
+def run_workers(work_dir: Path, num_workers: int, lease_seconds: float = 600,
+                max_attempts: int = 3, poll_interval: float = 5.0) -> List[int]:
+    """
+    启动多个worker进程并等待全部退出
+
+    每个进程有独立的限流器和预算，RATE_LIMIT_RPM/TPM 和 BUDGET_* 按单个进程计算。
+
+    Args:
+        work_dir: 工作目录
+        num_workers: worker进程数
+        lease_seconds: 租约时长（秒）
+        max_attempts: 每个分片的最大尝试次数
+        poll_interval: 轮询间隔（秒）
+
+    Returns:
+        各进程的退出码
+    """
+    if num_workers <= 1:
+        run_worker(work_dir, lease_seconds, max_attempts, poll_interval)
+        return [0]
+
+    import multiprocessing
+
+    # spawn：子进程不继承父进程中的客户端、线程池和锁
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(target=_worker_main, args=(str(work_dir), lease_seconds, max_attempts, poll_interval))
+        for _ in range(num_workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return [process.exitcode for process in processes]
+
+
+def init_queue(work_dir: Path, shard_size: int = 20, data_dir: str = None, reset: bool = False) -> int:
+    """
+    加载名人列表、切分分片并创建工作队列
+
+    Args:
+        work_dir: 工作目录
+        shard_size: 每个分片的名人数量
+        data_dir: 名人列表目录
+        reset: 队列已存在时是否重建
+
+    Returns:
+        分片数量
+    """
+    from search_celebrity_experiences import CelebrityExperienceSearcher
+
+    queue_path = Path(work_dir) / QUEUE_FILE
+    if queue_path.exists() and not reset:
+        raise FileExistsError(f"工作队列已存在: {queue_path}（使用 --reset 重建）")
+
+    celebrities = CelebrityExperienceSearcher().load_celebrities(data_dir)
+    shards = partition_celebrities(celebrities, shard_size)
+    ShardQueue(queue_path).create(shards, reset=reset)
+    total = sum(len(v) for v in celebrities.values())
+    print(f"已创建工作队列: {queue_path}，{total} 位名人，{len(shards)} 个分片")
+    return len(shards)
+
+
+def merge_shards(work_dir: Path, allow_partial: bool = False) -> Tuple[list, list]:
+    """
+    合并已完成分片的结果，写出合并后的chunk缓存
+
+    Args:
+        work_dir: 工作目录
+        allow_partial: 还有未完成的分片时是否仍然合并
+
+    Returns:
+        (经历列表, chunk记录列表)
+    """
+    work_dir = Path(work_dir)
+    queue = ShardQueue(work_dir / QUEUE_FILE)
+    counts = queue.counts()
+    unfinished = counts["pending"] + counts["running"] + counts["failed"]
+    if unfinished and not allow_partial:
+        raise RuntimeError(
+            f"还有未完成的分片: 待处理 {counts['pending']}，处理中 {counts['running']}，"
+            f"失败 {counts['failed']}（使用 --allow-partial 只合并已完成的分片）"
+        )
+
+    experiences, chunks = [], []
+    seen_experiences, seen_chunks = set(), set()
+    for row in queue.rows():
+        if row["status"] != "done":
+            continue
+        # 相对路径按本机的工作目录解析（旧队列中的绝对路径保持不变）
+        shard_experiences, shard_chunks = load_chunk_cache(work_dir / row["output"])
+        for experience in shard_experiences:
+            if experience["experience_id"] not in seen_experiences:
+                seen_experiences.add(experience["experience_id"])
+                experiences.append(experience)
+        for chunk in shard_chunks:
+            if chunk.chunk_id not in seen_chunks:
+                seen_chunks.add(chunk.chunk_id)
+                chunks.append(chunk)
+
+    cache_file = work_dir / MERGED_CACHE_FILE
+    save_chunk_cache(cache_file, experiences, chunks)
+    print(f"已合并 {counts['done']} 个分片: {len(experiences)} 条经历，{len(chunks)} 个chunks -> {cache_file}")
+    return experiences, chunks
+
+
+def index_merged(experiences: list, chunks: list) -> int:
+    """
+    把合并后的结果批量写入ElasticSearch（与单进程构建的索引阶段相同）
+
+    Returns:
+        成功索引的文档数量
+    """
+    from build_vector_database import VectorDatabaseBuilder
+
+    builder = VectorDatabaseBuilder()
+    success_count = builder.index_experiences(experiences, chunks)
+    print(f"成功索引 {success_count} 个文档到索引: {builder.index_name}")
+    return success_count
+
+
+def print_status(work_dir: Path):
+    """打印各分片的状态"""
+    queue = ShardQueue(Path(work_dir) / QUEUE_FILE)
+    now = time.time()
+    print(f"{'分片':>6} | {'状态':<8} | {'尝试':>4} | {'租约剩余(s)':>11} | worker / 错误")
+    print("-" * 70)
+    for row in queue.rows():
+        lease = f"{row['lease_until'] - now:.0f}" if row["status"] == "running" and row["lease_until"] else "-"
+        detail = row["error"] if row["status"] in ("failed", "pending") and row["error"] else (row["worker"] or "")
+        print(f"{row['id']:>6} | {row['status']:<8} | {row['attempts']:>4} | {lease:>11} | {detail}")
+    counts = queue.counts()
+    print(f"\n待处理 {counts['pending']}，处理中 {counts['running']}，完成 {counts['done']}，失败 {counts['failed']}")
+
+
+def main():
+    """命令行入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="分布式构建名人经历向量数据库")
+    parser.add_argument("--work-dir", type=str, default=str(DEFAULT_WORK_DIR),
+                        help="工作目录（多台机器共享时指向同一目录）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_init_args(sub):
+        sub.add_argument("--shard-size", type=int, default=20, help="每个分片的名人数量")
+        sub.add_argument("--data-dir", type=str, help="名人列表目录")
+        sub.add_argument("--reset", action="store_true", help="队列已存在时清空重建")
+
+    def add_worker_args(sub):
+        sub.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="本机worker进程数")
+        sub.add_argument("--lease", type=float, default=600, help="分片租约时长（秒）")
+        sub.add_argument("--max-attempts", type=int, default=3, help="每个分片的最大尝试次数")
+        sub.add_argument("--poll-interval", type=float, default=5.0, help="等待其他worker时的轮询间隔（秒）")
+
+    def add_merge_args(sub):
+        sub.add_argument("--allow-partial", action="store_true", help="只合并已完成的分片")
+        sub.add_argument("--no-index", action="store_true", help="只写合并后的缓存，不写入ElasticSearch")
+
+    add_init_args(subparsers.add_parser("init", help="切分名人列表并创建工作队列"))
+    add_worker_args(subparsers.add_parser("worker", help="启动worker进程处理分片"))
+    subparsers.add_parser("status", help="查看分片状态")
+    add_merge_args(subparsers.add_parser("merge", help="合并分片结果并写入ElasticSearch"))
+    run_parser = subparsers.add_parser("run", help="单机执行 init + worker + merge")
+    add_init_args(run_parser)
+    add_worker_args(run_parser)
+    add_merge_args(run_parser)
+
+    args = parser.parse_args()
+    work_dir = Path(args.work_dir)
+
+    if args.command in ("init", "run"):
+        if args.command == "run" and (work_dir / QUEUE_FILE).exists() and not args.reset:
+            print(f"继续使用已有的工作队列: {work_dir / QUEUE_FILE}")
+        else:
+            init_queue(work_dir, args.shard_size, args.data_dir, reset=args.reset)
+    if args.command in ("worker", "run"):
+        start = time.perf_counter()
+        exit_codes = run_workers(work_dir, args.workers, args.lease, args.max_attempts, args.poll_interval)
+        print(f"\n{args.workers} 个worker已退出，耗时 {time.perf_counter() - start:.1f}s")
+        if any(exit_codes):
+            print(f"警告: 部分worker异常退出，退出码: {exit_codes}")
+        print_status(work_dir)
+    if args.command == "status":
+        print_status(work_dir)
+    if args.command in ("merge", "run"):
+        experiences, chunks = merge_shards(work_dir, allow_partial=args.allow_partial)
+        if not args.no_index:
+            index_merged(experiences, chunks)
+
+
+if __name__ == "__main__":
+    main()
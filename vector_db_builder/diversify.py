@@ -0,0 +1,162 @@
+"""
+检索结果多样化：MMR重排与按名人折叠
+
+kNN的前几条结果经常被同一位名人的多个chunk/经历占满。这里只取一次候选，然后：
+    - 服务端折叠（可选）：ES collapse 按 celebrity_name_en 每位名人只返回得分最高的一条
+    - 同一经历的多个chunk只保留得分最高的一个
+    - MMR（最大边际相关）：每一步选择 lambda * 与查询的相似度 - (1 - lambda) * 与已选结果的最大相似度
+      最大的候选，候选之间的相似度矩阵一次算好，每一步只做一次向量化更新
+    - 每位名人最多per_celebrity条
+"""
+from typing import List, Optional
+
+import numpy as np
+
+try:
+    from .elasticsearch_setup import ElasticsearchSetup
+except ImportError:
+    from elasticsearch_setup import ElasticsearchSetup
+
+
+COLLAPSE_FIELD = "celebrity_name_en"
+
+
+def _unit_rows(matrix: np.ndarray) -> np.ndarray:
+    """按行L2归一化（零向量保持为零）"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def mmr_select(relevance: np.ndarray, vectors: np.ndarray, k: int, mmr_lambda: float = 0.7,
+               groups: np.ndarray = None, per_group: int = None) -> List[int]:
+    """
+    最大边际相关选择
+
+    Args:
+        relevance: 候选与查询的相关度 (n,)
+        vectors: 候选向量 (n, dims)，需已归一化；零向量不参与多样性惩罚
+        k: 选择数量
+        mmr_lambda: 相关度权重（1为纯按相关度排序，越小越强调多样性）
+        groups: 候选所属分组的整数编号 (n,)，如名人
+        per_group: 每个分组最多选择的数量
+
+    Returns:
+        被选中的候选下标，按选择顺序
+    """
+    similarity = vectors @ vectors.T
+    # 与已选结果的最大相似度，第一步没有已选结果，不做惩罚
+    max_similarity = None
+    available = np.ones(len(relevance), dtype=bool)
+    group_counts = np.zeros(int(groups.max()) + 1, dtype=np.int64) if groups is not None and len(groups) else None
+    selected = []
+
+    while len(selected) < k and available.any():
+        penalty = max_similarity if max_similarity is not None else 0.0
+        scores = np.where(available, mmr_lambda * relevance - (1.0 - mmr_lambda) * penalty, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        if max_similarity is None:
+            max_similarity = similarity[best].copy()
+        else:
+            np.maximum(max_similarity, similarity[best], out=max_similarity)
+        if group_counts is not None and per_group:
+            group = groups[best]
+            group_counts[group] += 1
+            if group_counts[group] >= per_group:
+                available &= groups != group
+    return selected
+
+
+def diversify_hits(result: dict, query_vector: list, size: int, mmr_lambda: float = 0.7,
+                   per_celebrity: Optional[int] = 2, keep_vectors: bool = False) -> dict:
+    """
+    对一次检索的候选做多样化重排（原地修改并返回result）
+
+    候选缺少向量时（例如旧版本nested检索没有inner_hits）退化为按ES得分排序，只做按名人的数量限制。
+
+    Args:
+        result: 搜索结果（_source中带embedding）
+        query_vector: 查询向量
+        size: 返回结果数量
+        mmr_lambda: MMR相关度权重
+        per_celebrity: 每位名人最多返回的数量，None表示不限制
+        keep_vectors: 是否在返回的_source中保留embedding
+
+    Returns:
+        多样化后的搜索结果
+    """
+    if not result or "hits" not in result:
+        return result
+
+    # 同一经历的多个chunk只保留得分最高的一个（命中已按得分降序）
+    hits, seen = [], set()
+    for hit in result["hits"]["hits"]:
+        experience_id = hit.get("_source", {}).get("experience_id") or hit["_id"]
+        if experience_id not in seen:
+            seen.add(experience_id)
+            hits.append(hit)
+    if not hits:
+        return result
+
+    raw_vectors = [hit["_source"].get("embedding") for hit in hits]
+    dims = next((len(vector) for vector in raw_vectors if vector), 0)
+    if dims and len(query_vector) == dims:
+        vectors = _unit_rows(np.asarray(
+            [vector if vector else np.zeros(dims) for vector in raw_vectors], dtype=np.float32
+        ))
+        query = np.asarray(query_vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        relevance = vectors @ query
+        # 没有向量的候选用ES得分近似相关度
+        missing = np.array([not vector for vector in raw_vectors])
+        if missing.any():
+            relevance[missing] = [hit["_score"] or 0.0 for hit, lacks in zip(hits, missing) if lacks]
+    else:
+        vectors = np.zeros((len(hits), 1), dtype=np.float32)
+        relevance = np.asarray([hit["_score"] or 0.0 for hit in hits], dtype=np.float32)
+        mmr_lambda = 1.0
+
+    _, groups = np.unique(
+        np.asarray([hit["_source"].get(COLLAPSE_FIELD, "") for hit in hits], dtype=object), return_inverse=True
+    )
+    order = mmr_select(relevance, vectors, size, mmr_lambda=mmr_lambda, groups=groups, per_group=per_celebrity)
+
+    diversified = []
+    for index in order:
+        hit = hits[index]
+        hit["_mmr_relevance"] = float(relevance[index])
+        if not keep_vectors:
+            hit["_source"].pop("embedding", None)
+        diversified.append(hit)
+    result["hits"]["hits"] = diversified
+    return result
+
+
+def diverse_search(es_setup: ElasticsearchSetup, index_name: str, embedding: list, size: int = 10,
+                   filter_query: dict = None, mmr_lambda: float = 0.7, per_celebrity: Optional[int] = 2,
+                   collapse: bool = False, candidates: int = None) -> dict:
+    """
+    一次取候选的多样化向量检索
+
+    Args:
+        es_setup: ElasticSearch设置
+        index_name: 索引名称
+        embedding: 查询向量
+        size: 返回结果数量
+        filter_query: 过滤条件
+        mmr_lambda: MMR相关度权重（1为不做多样性重排）
+        per_celebrity: 每位名人最多返回的数量，None表示不限制
+        collapse: 是否在服务端按名人折叠（每位名人只取一条候选，per_celebrity随之为1）
+        candidates: 候选数量，默认为 max(size * 5, 50)
+
+    Returns:
+        搜索结果
+    """
+    candidates = candidates or max(size * 5, 50)
+    result = es_setup.vector_search(
+        index_name, embedding, size=candidates, filter_query=filter_query,
+        collapse_field=COLLAPSE_FIELD if collapse else None, include_vectors=mmr_lambda < 1.0,
+    )
+    return diversify_hits(result, embedding, size, mmr_lambda=mmr_lambda, per_celebrity=per_celebrity)
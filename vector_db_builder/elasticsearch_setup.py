@@ -1,23 +1,163 @@
 """
 ElasticSearch配置模块：创建索引和映射
 """
-from elasticsearch import Elasticsearch
+import copy
 import os
 import re
-from typing import Optional
+import time
+from typing import Optional, List, Dict, Any, Iterable, Iterator, Tuple
+
+try:
+    from .records import ChunkRecord, flat_documents, compact_chunk_documents, nested_documents
+except ImportError:
+    from records import ChunkRecord, flat_documents, compact_chunk_documents, nested_documents
+
+try:
+    from .metrics import get_metrics, MILLISECOND_BUCKETS
+except ImportError:
+    from metrics import get_metrics, MILLISECOND_BUCKETS
+
+try:
+    from .clients import get_elasticsearch
+except ImportError:
+    from clients import get_elasticsearch
+
+
+# 索引布局：
+#   flat    - 每个chunk一个文档，复制父经历的全部字段（默认，兼容旧索引）
+#   compact - chunk文档只带过滤字段，经历字段只在 <index>_experiences 中存一份
+#   nested  - 每个经历一个文档，chunk作为nested对象携带各自的向量
+INDEX_LAYOUTS = ("flat", "compact", "nested")
+
+
+# 向量索引配置档：HNSW参数、量化方式和相似度
+#   dot_product 要求向量为单位长度，TextProcessor 在嵌入时统一做一次归一化
+#   int8_hnsw 把向量量化为int8（内存约为float的1/4），需要ES 8.12+
+INDEX_PROFILES = {
+    # ES默认参数（m=16, ef_construction=100），与旧索引一致
+    "default": {
+        "similarity": "cosine",
+    },
+    # 构建和查询更快，召回略低
+    "fast": {
+        "similarity": "dot_product",
+        "index_options": {"type": "hnsw", "m": 12, "ef_construction": 64},
+    },
+    # int8量化，在小堆内存下容纳更多向量
+    "compact": {
+        "similarity": "dot_product",
+        "index_options": {"type": "int8_hnsw", "m": 16, "ef_construction": 100},
+    },
+    # 更高召回，构建更慢、图更大
+    "accurate": {
+        "similarity": "dot_product",
+        "index_options": {"type": "hnsw", "m": 32, "ef_construction": 200},
+    },
+}
+
+VECTOR_QUANTIZATIONS = {
+    "none": "hnsw",
+    "int8": "int8_hnsw",
+}
+
+
+def build_vector_options(profile: str = None, m: int = None, ef_construction: int = None,
+                         quantization: str = None, similarity: str = None) -> dict:
+    """
+    解析dense_vector的相似度和HNSW参数
+
+    显式参数优先，其次是环境变量（ELASTICSEARCH_INDEX_PROFILE、ELASTICSEARCH_HNSW_M、
+    ELASTICSEARCH_HNSW_EF_CONSTRUCTION、ELASTICSEARCH_VECTOR_QUANTIZATION、
+    ELASTICSEARCH_VECTOR_SIMILARITY），最后是配置档中的值。
+
+    Args:
+        profile: 配置档名称（见INDEX_PROFILES）
+        m: HNSW每个节点的邻居数
+        ef_construction: HNSW构建时的候选数
+        quantization: 量化方式（none/int8）
+        similarity: 相似度（cosine/dot_product/l2_norm/max_inner_product）
+
+    Returns:
+        包含similarity和可选index_options的字典
+    """
+    profile = profile or os.getenv("ELASTICSEARCH_INDEX_PROFILE", "default")
+    if profile not in INDEX_PROFILES:
+        raise ValueError(f"不支持的索引配置档: {profile}，可选: {', '.join(INDEX_PROFILES)}")
+    options = copy.deepcopy(INDEX_PROFILES[profile])
+
+    m = m or (int(os.getenv("ELASTICSEARCH_HNSW_M")) if os.getenv("ELASTICSEARCH_HNSW_M") else None)
+    ef_construction = ef_construction or (
+        int(os.getenv("ELASTICSEARCH_HNSW_EF_CONSTRUCTION"))
+        if os.getenv("ELASTICSEARCH_HNSW_EF_CONSTRUCTION") else None
+    )
+    quantization = quantization or os.getenv("ELASTICSEARCH_VECTOR_QUANTIZATION")
+    similarity = similarity or os.getenv("ELASTICSEARCH_VECTOR_SIMILARITY")
+
+    if m or ef_construction or quantization:
+        index_options = options.setdefault("index_options", {"type": "hnsw"})
+        if m:
+            index_options["m"] = m
+        if ef_construction:
+            index_options["ef_construction"] = ef_construction
+        if quantization:
+            if quantization not in VECTOR_QUANTIZATIONS:
+                raise ValueError(
+                    f"不支持的量化方式: {quantization}，可选: {', '.join(VECTOR_QUANTIZATIONS)}"
+                )
+            index_options["type"] = VECTOR_QUANTIZATIONS[quantization]
+    if similarity:
+        options["similarity"] = similarity
+
+    return options
+
+
+# 关键词检索（multi_match）使用的字段
+KEYWORD_FIELDS = ["event_summary", "coping_strategy", "final_result", "full_text"]
+
+# 各索引布局下可做关键词检索的字段：compact的chunk文档只有full_text（由经历字段拼接而成），
+# nested的chunk文本在nested对象中，顶层只有经历字段
+LAYOUT_KEYWORD_FIELDS = {
+    "flat": KEYWORD_FIELDS,
+    "compact": ["full_text"],
+    "nested": ["event_summary", "coping_strategy", "final_result"],
+}
+
+
+def experience_index_name(index_name: str) -> str:
+    """compact布局下存放经历字段的父索引名称"""
+    return f"{index_name}_experiences"
+
+
+def centroid_index_name(index_name: str) -> str:
+    """存放名人质心向量的索引名称"""
+    return f"{index_name}_celebrities"
+
+
+def snapshot_name(index_name: str, version: str) -> str:
+    """索引某个版本的快照名称（ES要求快照名小写）"""
+    return f"{index_name}-{version}".lower()
 
 
 class ElasticsearchSetup:
-    def __init__(self, host: str = None, port: int = None):
+    def __init__(self, host: str = None, port: int = None, layout: str = None,
+                 profile: str = None, ping: bool = None):
         """
         初始化ElasticSearch连接
         
         Args:
             host: ElasticSearch主机地址
             port: ElasticSearch端口
+            layout: 索引布局（flat/compact/nested），默认从环境变量ELASTICSEARCH_INDEX_LAYOUT读取
+            profile: 向量索引配置档，默认从环境变量ELASTICSEARCH_INDEX_PROFILE读取
+            ping: 首次连接该地址时是否测试连接，默认从环境变量ELASTICSEARCH_SKIP_PING读取（缺省测试）
         """
         self.host = host or os.getenv("ELASTICSEARCH_HOST", "localhost")
         self.port = port or int(os.getenv("ELASTICSEARCH_PORT", "9200"))
+        self.layout = layout or os.getenv("ELASTICSEARCH_INDEX_LAYOUT", "flat")
+        if self.layout not in INDEX_LAYOUTS:
+            raise ValueError(f"不支持的索引布局: {self.layout}，可选: {', '.join(INDEX_LAYOUTS)}")
+        self.vector_options = build_vector_options(profile)
+        self.metrics = get_metrics()
         
         # 构建完整的URL（必须包含scheme）
         # Elasticsearch客户端需要完整的URL格式：http://host:port
@@ -35,77 +175,402 @@ class ElasticsearchSetup:
             # host不包含协议，添加http://和端口
             es_url = f"http://{self.host}:{self.port}"
         
-        print(f"正在连接到ElasticSearch: {es_url}")
+        self.es_url = es_url
+        # 同一地址共享一个客户端和连接池，只在首次创建时测试连接
+        self.es = get_elasticsearch(es_url, ping=ping)
+    
+    @property
+    def keyword_fields(self) -> List[str]:
+        """当前索引布局下关键词检索使用的字段"""
+        return LAYOUT_KEYWORD_FIELDS[self.layout]
+    
+    @property
+    def requires_normalized_vectors(self) -> bool:
+        """当前向量配置是否要求单位长度向量（dot_product）"""
+        return self.vector_options.get("similarity") == "dot_product"
+    
+    def create_index(self, index_name: str = None, delete_existing: bool = False,
+                     layout: str = None, dims: int = None, profile: str = None,
+                     vector_options: dict = None) -> bool:
+        """
+        创建索引
         
-        # 检查客户端版本兼容性（ElasticSearch 8.x服务器只接受version 7或8的兼容头）
-        try:
-            import elasticsearch as es_module
-            major_version = int(es_module.__version__.split('.')[0])
-            if major_version >= 9:
-                raise ValueError(
-                    f"Elasticsearch客户端版本不兼容！\n"
-                    f"当前版本: {es_module.__version__} (需要 < 9.0.0)\n"
-                    f"ElasticSearch服务器版本: 8.11.0\n"
-                    f"解决方案: pip install 'elasticsearch>=8.0.0,<9.0.0'"
-                )
-        except (ImportError, AttributeError):
-            pass  # 版本检查失败不影响连接尝试
-        
-        # 创建Elasticsearch客户端
-        self.es = Elasticsearch(
-            hosts=[es_url],
-            request_timeout=30,
-            max_retries=3,
-            retry_on_timeout=True,
+        Args:
+            index_name: 索引名称
+            delete_existing: 如果索引已存在是否删除
+            layout: 索引布局，默认使用初始化时的布局
+            dims: 向量维度，默认按TextProcessor使用的嵌入模型推断
+            profile: 向量索引配置档，默认使用初始化时的配置
+            vector_options: build_vector_options返回的向量参数，优先于profile（ann_tuning扫描参数时使用）
+        
+        Returns:
+            是否创建成功
+        """
+        if index_name is None:
+            index_name = os.getenv("ELASTICSEARCH_INDEX", "celebrity_experiences")
+        layout = layout or self.layout
+        if dims is None:
+            # 与TextProcessor按同样的规则确定模型（未设置EMBEDDING_MODEL时按端点选择默认模型）
+            try:
+                from .text_processing import resolve_embedding_dims, resolve_embedding_model
+            except ImportError:
+                from text_processing import resolve_embedding_dims, resolve_embedding_model
+            dims = resolve_embedding_dims(resolve_embedding_model())
+        if vector_options is None:
+            vector_options = build_vector_options(profile) if profile else self.vector_options
+        vector_mapping = self._dense_vector_mapping(dims, vector_options)
+        
+        if layout == "compact":
+            # chunk索引 + 存放经历字段的父索引
+            parent_created = self._create_index_with_mapping(
+                experience_index_name(index_name),
+                self._build_experience_mapping(),
+                delete_existing,
+            )
+            return parent_created and self._create_index_with_mapping(
+                index_name, self._build_mapping(layout, vector_mapping), delete_existing
+            )
+        
+        return self._create_index_with_mapping(
+            index_name, self._build_mapping(layout, vector_mapping), delete_existing
         )
+    
+    def create_centroid_index(self, index_name: str, dims: int, delete_existing: bool = True) -> bool:
+        """
+        创建名人质心索引（每位名人一个质心，可选每个 名人+挑战类型 一个质心）
+        
+        质心由全部经历重新计算，默认删除旧索引后重建。
+        
+        Args:
+            index_name: 质心索引名称
+            dims: 向量维度
+            delete_existing: 如果索引已存在是否删除
+        
+        Returns:
+            是否创建成功
+        """
+        # 质心总是归一化的，数据量很小，不需要量化
+        vector_options = {"similarity": self.vector_options.get("similarity", "cosine")}
+        mapping = {
+            "mappings": {
+                "properties": {
+                    "centroid_id": {"type": "keyword"},
+                    "level": {"type": "keyword"},
+                    "celebrity_name_en": {"type": "keyword"},
+                    "celebrity_name_cn": {"type": "keyword"},
+                    "profession": {"type": "keyword"},
+                    "challenge_type": {"type": "keyword"},
+                    "num_experiences": {"type": "integer"},
+                    "embedding": self._dense_vector_mapping(dims, vector_options),
+                }
+            },
+            "settings": self._index_settings()
+        }
+        return self._create_index_with_mapping(index_name, mapping, delete_existing)
+    
+    def delete_index(self, index_name: str) -> bool:
+        """
+        删除索引（不存在时视为成功）
         
-        # 测试连接
-        print("正在测试连接...")
+        Args:
+            index_name: 索引名称
+        
+        Returns:
+            是否删除成功
+        """
         try:
-            # 尝试ping，如果失败则尝试info()
-            if not self.es.ping():
-                info = self.es.info()
-                print(f"警告: ping()返回False，但info()成功，集群: {info.get('cluster_name')}")
+            if self.es.indices.exists(index=index_name):
+                self.es.indices.delete(index=index_name)
+            return True
         except Exception as e:
-            error_msg = str(e)
-            error_type = type(e).__name__
-            
-            # 生成错误提示
-            help_msg = (
-                f"无法连接到ElasticSearch ({es_url})。\n"
-                f"错误类型: {error_type}\n"
-                f"错误信息: {error_msg}\n\n"
-                f"请检查：\n"
-                f"  1) ElasticSearch容器是否运行: docker-compose ps\n"
-                f"  2) 测试连接: curl {es_url}\n"
-                f"  3) 如果容器未运行，启动: docker-compose up -d"
+            print(f"删除索引失败: {str(e)}")
+            return False
+    
+    def refresh_index(self, index_name: str):
+        """刷新索引，使刚写入的文档可以被检索"""
+        self.es.indices.refresh(index=index_name)
+
+    def segment_count(self, index_name: str) -> Optional[int]:
+        """索引主分片的段数，获取失败时返回None"""
+        try:
+            stats = self.es.indices.stats(index=index_name, metric="segments")
+            return stats["_all"]["primaries"]["segments"]["count"]
+        except Exception:
+            return None
+
+    def force_merge(self, index_name: str, max_num_segments: int = 1) -> bool:
+        """
+        刷新并强制合并索引（批量写入后有大量小段，每个段都有自己的HNSW图，合并后kNN只需搜索少数几张图）
+
+        合并期间会占用额外磁盘和IO，只应在构建完成后、对外提供查询之前执行。
+
+        Args:
+            index_name: 索引名称
+            max_num_segments: 每个分片合并后的目标段数
+
+        Returns:
+            是否合并成功
+        """
+        timeout = float(os.getenv("ELASTICSEARCH_FORCEMERGE_TIMEOUT", "1800"))
+        before = self.segment_count(index_name)
+        try:
+            self.refresh_index(index_name)
+            with self.metrics.span("es_maintenance", operation="forcemerge"):
+                # 合并是同步的，大索引上可能持续数分钟，单独放宽请求超时
+                self.es.options(request_timeout=timeout).indices.forcemerge(
+                    index=index_name, max_num_segments=max_num_segments
+                )
+        except Exception as e:
+            print(f"强制合并失败: {str(e)}")
+            return False
+        after = self.segment_count(index_name)
+        if before is not None and after is not None:
+            print(f"已强制合并 {index_name}: {before} -> {after} 个段")
+        else:
+            print(f"已强制合并 {index_name}（目标 {max_num_segments} 个段/分片）")
+        return True
+
+    def preload_vectors(self, index_name: str, extensions: List[str] = None) -> bool:
+        """
+        设置index.store.preload，节点打开索引时把向量文件预先读入页缓存
+
+        preload是静态设置，需要先关闭索引、修改后重新打开（期间索引不可查询）。
+        默认预加载HNSW图（vex）以及检索时读取的向量：int8量化时为vex+veq，否则为vex+vec。
+        预加载的文件要能放进文件系统缓存，否则会挤掉其他索引的缓存。
+
+        Args:
+            index_name: 索引名称
+            extensions: 预加载的文件扩展名，默认读取环境变量ELASTICSEARCH_PRELOAD_EXTENSIONS
+
+        Returns:
+            是否设置成功
+        """
+        if extensions is None:
+            configured = os.getenv("ELASTICSEARCH_PRELOAD_EXTENSIONS")
+            if configured:
+                extensions = [ext.strip() for ext in configured.split(",") if ext.strip()]
+            else:
+                quantized = self.vector_options.get("index_options", {}).get("type") == "int8_hnsw"
+                extensions = ["vex", "veq"] if quantized else ["vex", "vec"]
+        try:
+            self.es.indices.close(index=index_name)
+            try:
+                self.es.indices.put_settings(index=index_name, settings={"index.store.preload": extensions})
+            finally:
+                # 设置失败也要重新打开，避免索引停留在关闭状态
+                self.es.indices.open(index=index_name)
+                self.es.cluster.health(index=index_name, wait_for_status="yellow", timeout="60s")
+        except Exception as e:
+            print(f"设置向量预加载失败: {str(e)}")
+            return False
+        print(f"已为 {index_name} 启用预加载: {', '.join(extensions)}")
+        return True
+
+    def index_family(self, index_name: str) -> List[str]:
+        """
+        索引及其存在的配套索引（compact布局的经历父索引、名人质心索引）
+
+        Args:
+            index_name: 主索引名称
+
+        Returns:
+            存在的索引名称列表，主索引在前
+        """
+        candidates = [index_name, experience_index_name(index_name), centroid_index_name(index_name)]
+        return [name for name in candidates if self.es.indices.exists(index=name)]
+
+    @staticmethod
+    def _snapshot_repository(repository: str = None) -> str:
+        """快照仓库名称，默认从环境变量ELASTICSEARCH_SNAPSHOT_REPOSITORY读取"""
+        return repository or os.getenv("ELASTICSEARCH_SNAPSHOT_REPOSITORY", "inspirematch_snapshots")
+
+    def ensure_snapshot_repository(self, repository: str = None, location: str = None) -> bool:
+        """
+        注册（或更新）文件系统快照仓库
+
+        location必须位于ES节点的path.repo之下（docker-compose.yml中挂载在数据卷旁边）。
+
+        Args:
+            repository: 仓库名称，默认从环境变量ELASTICSEARCH_SNAPSHOT_REPOSITORY读取
+            location: 仓库在ES节点上的路径，默认从环境变量ELASTICSEARCH_SNAPSHOT_LOCATION读取
+
+        Returns:
+            是否注册成功
+        """
+        repository = self._snapshot_repository(repository)
+        location = location or os.getenv("ELASTICSEARCH_SNAPSHOT_LOCATION", "/usr/share/elasticsearch/snapshots")
+        try:
+            self.es.snapshot.create_repository(
+                name=repository, body={"type": "fs", "settings": {"location": location, "compress": True}}
             )
-            
-            # 如果是版本兼容性问题，提供额外提示
-            if "media_type_header_exception" in error_msg or "compatible-with" in error_msg:
-                help_msg += (
-                    f"\n\n注意: 这可能是版本兼容性问题。\n"
-                    f"请确保使用: pip install 'elasticsearch>=8.0.0,<9.0.0'"
+            return True
+        except Exception as e:
+            print(f"注册快照仓库失败（ES需要配置path.repo包含 {location}）: {str(e)}")
+            return False
+
+    def snapshot_index(self, index_name: str, version: str = None, repository: str = None) -> Optional[str]:
+        """
+        为索引及其配套索引创建快照（等待完成）
+
+        Args:
+            index_name: 主索引名称
+            version: 版本号，默认使用当前时间（如 20240101-120000）
+            repository: 仓库名称，默认从环境变量ELASTICSEARCH_SNAPSHOT_REPOSITORY读取
+
+        Returns:
+            快照名称，失败时返回None
+        """
+        repository = self._snapshot_repository(repository)
+        if not self.ensure_snapshot_repository(repository):
+            return None
+        indices = self.index_family(index_name)
+        if index_name not in indices:
+            print(f"索引 {index_name} 不存在，无法创建快照")
+            return None
+
+        version = version or time.strftime("%Y%m%d-%H%M%S")
+        name = snapshot_name(index_name, version)
+        try:
+            with self.metrics.span("es_snapshot", operation="create"):
+                result = self.es.snapshot.create(
+                    repository=repository, snapshot=name, indices=",".join(indices),
+                    include_global_state=False, wait_for_completion=True,
+                    metadata={"index": index_name, "version": version, "layout": self.layout},
                 )
-            
-            raise ConnectionError(help_msg) from e
-        
-        print(f"✓ 成功连接到ElasticSearch: {es_url}")
+        except Exception as e:
+            print(f"创建快照失败: {str(e)}")
+            return None
+
+        info = result.get("snapshot", {})
+        if info.get("state") not in (None, "SUCCESS"):
+            print(f"快照 {name} 未完全成功: {info.get('state')}")
+            return None
+        print(f"已创建快照: {repository}/{name}（{', '.join(indices)}）")
+        return name
+
+    def list_snapshots(self, index_name: str = None, repository: str = None) -> List[Dict[str, Any]]:
+        """
+        列出仓库中的快照（按开始时间从旧到新）
+
+        Args:
+            index_name: 只返回由snapshot_index为该索引创建的快照，默认全部
+            repository: 仓库名称，默认从环境变量ELASTICSEARCH_SNAPSHOT_REPOSITORY读取
+
+        Returns:
+            快照信息列表（snapshot、indices、state、start_time_in_millis、metadata等）
+        """
+        repository = self._snapshot_repository(repository)
+        try:
+            snapshots = self.es.snapshot.get(repository=repository, snapshot="_all")["snapshots"]
+        except Exception as e:
+            print(f"获取快照列表失败: {str(e)}")
+            return []
+        if index_name:
+            snapshots = [s for s in snapshots if (s.get("metadata") or {}).get("index") == index_name]
+        return sorted(snapshots, key=lambda s: s.get("start_time_in_millis", 0))
+
+    def restore_snapshot(self, index_name: str, snapshot: str = None, version: str = None,
+                         repository: str = None) -> Optional[str]:
+        """
+        从快照恢复索引及其配套索引（已存在的同名索引先关闭再由快照覆盖，不会先删除）
+
+        Args:
+            index_name: 主索引名称
+            snapshot: 快照名称
+            version: 版本号（snapshot_index创建时的version），与snapshot二选一
+            repository: 仓库名称，默认从环境变量ELASTICSEARCH_SNAPSHOT_REPOSITORY读取
+
+        Returns:
+            恢复的快照名称，失败时返回None（两者都未指定时恢复该索引最新的成功快照）
+        """
+        repository = self._snapshot_repository(repository)
+        # 新节点上仓库还未注册，注册后即可看到已有快照
+        if not self.ensure_snapshot_repository(repository):
+            return None
+
+        snapshots = self.list_snapshots(repository=repository)
+        if snapshot is None and version is not None:
+            snapshot = snapshot_name(index_name, version)
+        if snapshot is None:
+            ours = [s for s in snapshots
+                    if (s.get("metadata") or {}).get("index") == index_name and s.get("state") == "SUCCESS"]
+            if not ours:
+                print(f"仓库 {repository} 中没有索引 {index_name} 的快照")
+                return None
+            info = ours[-1]
+        else:
+            info = next((s for s in snapshots if s["snapshot"] == snapshot), None)
+            if info is None:
+                print(f"快照不存在: {repository}/{snapshot}")
+                return None
+
+        snapshot = info["snapshot"]
+        indices = info.get("indices") or [index_name]
+        # 恢复不能覆盖打开的索引：关闭当前版本，由快照原地覆盖；
+        # 不先删除，恢复请求被拒绝时重新打开即可继续使用当前版本
+        existing = [name for name in indices if self.es.indices.exists(index=name)]
+        try:
+            if existing:
+                self.es.indices.close(index=",".join(existing))
+        except Exception as e:
+            print(f"关闭索引失败，未恢复快照: {str(e)}")
+            return None
+        try:
+            with self.metrics.span("es_snapshot", operation="restore"):
+                result = self.es.snapshot.restore(
+                    repository=repository, snapshot=snapshot, indices=",".join(indices),
+                    include_global_state=False, wait_for_completion=True,
+                )
+        except Exception as e:
+            print(f"恢复快照失败: {str(e)}")
+            if existing:
+                try:
+                    self.es.indices.open(index=",".join(existing))
+                    print(f"已重新打开当前版本: {', '.join(existing)}")
+                except Exception as reopen_error:
+                    print(f"重新打开索引失败: {str(reopen_error)}")
+            return None
+
+        shards = result.get("snapshot", {}).get("shards", {})
+        if shards.get("failed"):
+            print(f"快照 {snapshot} 有 {shards['failed']} 个分片恢复失败（失败的分片需要重新恢复或重建索引）")
+            return None
+        print(f"已从快照 {repository}/{snapshot} 恢复: {', '.join(indices)}")
+        return snapshot
+
+    def delete_snapshot(self, snapshot: str, repository: str = None) -> bool:
+        """
+        删除快照（只删除其他快照不再引用的段文件）
+
+        Args:
+            snapshot: 快照名称
+            repository: 仓库名称，默认从环境变量ELASTICSEARCH_SNAPSHOT_REPOSITORY读取
+
+        Returns:
+            是否删除成功
+        """
+        repository = self._snapshot_repository(repository)
+        try:
+            self.es.snapshot.delete(repository=repository, snapshot=snapshot)
+            print(f"已删除快照: {repository}/{snapshot}")
+            return True
+        except Exception as e:
+            print(f"删除快照失败: {str(e)}")
+            return False
     
-    def create_index(self, index_name: str = None, delete_existing: bool = False) -> bool:
+    def _create_index_with_mapping(self, index_name: str, mapping: dict,
+                                   delete_existing: bool) -> bool:
         """
-        创建索引
+        使用给定映射创建单个索引
         
         Args:
             index_name: 索引名称
+            mapping: 包含mappings和settings的字典
             delete_existing: 如果索引已存在是否删除
         
         Returns:
             是否创建成功
         """
-        if index_name is None:
-            index_name = os.getenv("ELASTICSEARCH_INDEX", "celebrity_experiences")
-        
         # 检查索引是否存在
         if self.es.indices.exists(index=index_name):
             if delete_existing:
@@ -115,10 +580,149 @@ class ElasticsearchSetup:
                 print(f"索引 {index_name} 已存在")
                 return True
         
-        # 定义索引映射
+        try:
+            # 创建索引（兼容新旧版本API）
+            try:
+                # 新版本API
+                self.es.indices.create(
+                    index=index_name,
+                    mappings=mapping["mappings"],
+                    settings=mapping["settings"]
+                )
+            except TypeError:
+                # 旧版本API使用body参数
+                self.es.indices.create(index=index_name, body=mapping)
+            print(f"成功创建索引: {index_name}")
+            return True
+        except Exception as e:
+            print(f"创建索引失败: {str(e)}")
+            return False
+    
+    @staticmethod
+    def _index_settings() -> dict:
+        """索引通用settings"""
+        return {
+            "number_of_shards": 1,
+            "number_of_replicas": 0,
+            "analysis": {
+                "analyzer": {
+                    "default": {
+                        "type": "standard"
+                    }
+                }
+            }
+        }
+    
+    @staticmethod
+    def _dense_vector_mapping(dims: int, vector_options: dict) -> dict:
+        """
+        构建dense_vector字段映射
+        
+        Args:
+            dims: 向量维度
+            vector_options: build_vector_options返回的相似度和HNSW参数
+        
+        Returns:
+            dense_vector字段映射
+        """
         mapping = {
+            "type": "dense_vector",
+            "dims": dims,
+            "index": True,
+            "similarity": vector_options["similarity"]
+        }
+        if vector_options.get("index_options"):
+            mapping["index_options"] = dict(vector_options["index_options"])
+        return mapping
+    
+    def _build_mapping(self, layout: str, vector_mapping: dict) -> dict:
+        """
+        构建chunk索引的映射
+        
+        Args:
+            layout: 索引布局
+            vector_mapping: dense_vector字段映射
+        
+        Returns:
+            包含mappings和settings的字典
+        """
+        if layout == "nested":
+            return self._build_nested_mapping(vector_mapping)
+        
+        properties = {
+            "celebrity_name_en": {
+                "type": "keyword"
+            },
+            "profession": {
+                "type": "keyword"
+            },
+            "challenge_type": {
+                "type": "keyword"
+            },
+            "tags": {
+                "type": "keyword"
+            },
+            "embedding": vector_mapping,
+            "experience_id": {
+                "type": "keyword"
+            },
+            "chunk_id": {
+                "type": "keyword"
+            },
+            "full_text": {
+                "type": "text"
+            },
+        }
+        
+        if layout == "flat":
+            # flat布局在每个chunk上保存完整的经历字段
+            properties.update(self._build_experience_mapping()["mappings"]["properties"])
+        
+        return {
+            "mappings": {
+                "properties": properties
+            },
+            "settings": self._index_settings()
+        }
+    
+    def _build_nested_mapping(self, vector_mapping: dict) -> dict:
+        """
+        构建nested布局的映射：每个经历一个文档，chunks为nested对象
+        
+        Args:
+            vector_mapping: dense_vector字段映射
+        
+        Returns:
+            包含mappings和settings的字典
+        """
+        mapping = self._build_experience_mapping()
+        mapping["mappings"]["properties"]["chunks"] = {
+            "type": "nested",
+            "properties": {
+                "chunk_id": {
+                    "type": "keyword"
+                },
+                "full_text": {
+                    "type": "text"
+                },
+                "embedding": vector_mapping,
+            }
+        }
+        return mapping
+    
+    def _build_experience_mapping(self) -> dict:
+        """
+        构建经历字段的映射（compact布局的父索引，以及flat布局的chunk索引）
+        
+        Returns:
+            包含mappings和settings的字典
+        """
+        return {
             "mappings": {
                 "properties": {
+                    "experience_id": {
+                        "type": "keyword"
+                    },
                     "celebrity_name_en": {
                         "type": "keyword"
                     },
@@ -154,50 +758,10 @@ class ElasticsearchSetup:
                     "tags": {
                         "type": "keyword"
                     },
-                    "embedding": {
-                        "type": "dense_vector",
-                        "dims": 1024,  # text-embedding-3-small的维度（实际使用1024维）
-                        "index": True,
-                        "similarity": "cosine"
-                    },
-                    "chunk_id": {
-                        "type": "keyword"
-                    },
-                    "full_text": {
-                        "type": "text"
-                    },
                 }
             },
-            "settings": {
-                "number_of_shards": 1,
-                "number_of_replicas": 0,
-                "analysis": {
-                    "analyzer": {
-                        "default": {
-                            "type": "standard"
-                        }
-                    }
-                }
-            }
+            "settings": self._index_settings()
         }
-        
-        try:
-            # 创建索引（兼容新旧版本API）
-            try:
-                # 新版本API
-                self.es.indices.create(
-                    index=index_name,
-                    mappings=mapping["mappings"],
-                    settings=mapping["settings"]
-                )
-            except TypeError:
-                # 旧版本API使用body参数
-                self.es.indices.create(index=index_name, body=mapping)
-            print(f"成功创建索引: {index_name}")
-            return True
-        except Exception as e:
-            print(f"创建索引失败: {str(e)}")
-            return False
     
     def index_document(self, index_name: str, document: dict, doc_id: Optional[str] = None) -> bool:
         """
@@ -221,58 +785,228 @@ class ElasticsearchSetup:
             print(f"索引文档失败: {str(e)}")
             return False
     
-    def bulk_index(self, index_name: str, documents: list) -> int:
+    def index_chunks(self, index_name: str, experiences: List[Dict[str, Any]],
+                     chunks: List[ChunkRecord], layout: str = None) -> int:
+        """
+        按索引布局写入经历和chunk
+        
+        Args:
+            index_name: 索引名称
+            experiences: 经历列表（需包含experience_id）
+            chunks: chunk记录列表
+            layout: 索引布局，默认使用初始化时的布局
+        
+        Returns:
+            成功索引的文档数量（nested布局为经历文档数量）
+        """
+        layout = layout or self.layout
+        
+        if layout == "nested":
+            return self.bulk_index(
+                index_name, nested_documents(experiences, chunks), id_field="experience_id"
+            )
+        
+        if layout == "compact":
+            parent_index = experience_index_name(index_name)
+            written = self.bulk_index(parent_index, experiences, id_field="experience_id")
+            self._report_parent_failures(parent_index, written, len(experiences))
+            return self.bulk_index(
+                index_name, compact_chunk_documents(experiences, chunks), id_field="chunk_id"
+            )
+        
+        return self.bulk_index(index_name, flat_documents(experiences, chunks), id_field="chunk_id")
+    
+    def hydrate_hits(self, index_name: str, result: dict) -> dict:
+        """
+        为compact布局的命中结果补全父经历字段（一次mget）
+        
+        Args:
+            index_name: chunk索引名称
+            result: 搜索结果
+        
+        Returns:
+            补全后的搜索结果（原地修改）
+        """
+        if not result or "hits" not in result:
+            return result
+        
+        hits = result["hits"]["hits"]
+        experience_ids = list({
+            hit["_source"]["experience_id"]
+            for hit in hits
+            if "experience_id" in hit.get("_source", {}) and "event_summary" not in hit["_source"]
+        })
+        if not experience_ids:
+            return result
+        
+        try:
+            with self.metrics.span("es_mget", index=experience_index_name(index_name)):
+                response = self.es.mget(index=experience_index_name(index_name), ids=experience_ids)
+        except Exception as e:
+            print(f"补全经历字段失败: {str(e)}")
+            return result
+        
+        parents = {doc["_id"]: doc["_source"] for doc in response["docs"] if doc.get("found")}
+        for hit in hits:
+            source = hit.get("_source", {})
+            parent = parents.get(source.get("experience_id"))
+            if parent:
+                for field, value in parent.items():
+                    source.setdefault(field, value)
+        
+        return result
+    
+    def bulk_index(self, index_name: str, documents, id_field: str = None) -> int:
         """
         批量索引文档
         
         Args:
             index_name: 索引名称
-            documents: 文档列表
+            documents: 文档列表或可迭代对象（生成器会被逐批消费，不会整体物化）
+            id_field: 用作文档_id的字段名，为None时自动生成ID
         
         Returns:
             成功索引的文档数量
         """
-        from elasticsearch.helpers import bulk
+        def actions():
+            for doc in documents:
+                action = {
+                    "_index": index_name,
+                    "_source": doc
+                }
+                if id_field and doc.get(id_field):
+                    action["_id"] = doc[id_field]
+                yield action
         
-        actions = [
-            {
-                "_index": index_name,
-                "_source": doc
-            }
-            for doc in documents
-        ]
+        return sum(self.bulk_actions(actions(), index_label=index_name).values())
+    
+    def bulk_actions(self, actions: Iterable[Dict[str, Any]], index_label: str) -> Dict[str, int]:
+        """
+        流式批量写入（helpers.streaming_bulk按chunk_size分批发送，内存占用与文档总数无关）
+        
+        Args:
+            actions: bulk动作的可迭代对象（每个动作带_index）
+            index_label: 指标和日志中使用的索引名称
+        
+        Returns:
+            各索引成功写入的文档数量
+        """
+        from elasticsearch.helpers import streaming_bulk
         
+        chunk_size = int(os.getenv("ELASTICSEARCH_BULK_CHUNK_SIZE", "500"))
+        # 单个请求体上限（ES建议5~15MB）；1024维向量的文档约20KB，默认约500个文档一批
+        max_chunk_bytes = int(os.getenv("ELASTICSEARCH_BULK_MAX_BYTES", str(10 * 1024 * 1024)))
+        success_by_index = {}
+        success = 0
+        failed = 0
+        # 只保留前10个错误用于打印
+        errors = []
         try:
-            success, failed = bulk(self.es, actions, raise_on_error=False)
-            print(f"批量索引完成: 成功 {success}, 失败 {len(failed)}")
-            
-            # 打印详细的错误信息
-            if failed:
-                print(f"\n错误详情 (显示前10个):")
-                for i, error_item in enumerate(failed[:10]):
-                    error_info = error_item.get('index', {})
-                    error_type = error_info.get('error', {}).get('type', 'unknown')
-                    error_reason = error_info.get('error', {}).get('reason', 'unknown')
-                    error_cause = error_info.get('error', {}).get('caused_by', {})
-                    cause_type = error_cause.get('type', '') if error_cause else ''
-                    cause_reason = error_cause.get('reason', '') if error_cause else ''
-                    
-                    print(f"\n错误 #{i+1}:")
-                    print(f"  类型: {error_type}")
-                    print(f"  原因: {error_reason}")
-                    if cause_type:
-                        print(f"  根因类型: {cause_type}")
-                        print(f"  根因: {cause_reason}")
-                
-                if len(failed) > 10:
-                    print(f"\n... 还有 {len(failed) - 10} 个错误未显示")
-            
-            return success
+            with self.metrics.span("es_bulk", index=index_label):
+                for ok, item in streaming_bulk(self.es, actions, chunk_size=chunk_size,
+                                               max_chunk_bytes=max_chunk_bytes,
+                                               raise_on_error=False, raise_on_exception=False):
+                    if ok:
+                        success += 1
+                        written = next(iter(item.values()), {}).get("_index", index_label)
+                        success_by_index[written] = success_by_index.get(written, 0) + 1
+                    else:
+                        failed += 1
+                        if len(errors) < 10:
+                            errors.append(item)
         except Exception as e:
             print(f"批量索引失败: {str(e)}")
             import traceback
             traceback.print_exc()
-            return 0
+            return success_by_index
+        
+        bulk_docs = self.metrics.counter("es_bulk_docs_total", "批量索引的文档数")
+        bulk_docs.inc(success, index=index_label, result="ok")
+        bulk_docs.inc(failed, index=index_label, result="failed")
+        print(f"批量索引完成: 成功 {success}, 失败 {failed}")
+        
+        # 打印详细的错误信息
+        if errors:
+            print(f"\n错误详情 (显示前10个):")
+            for i, error_item in enumerate(errors):
+                error_info = next(iter(error_item.values()), {}) if error_item else {}
+                error = error_info.get('error', {})
+                if not isinstance(error, dict):
+                    error = {'type': 'exception', 'reason': str(error)}
+                error_type = error.get('type', 'unknown')
+                error_reason = error.get('reason', 'unknown')
+                error_cause = error.get('caused_by', {})
+                cause_type = error_cause.get('type', '') if error_cause else ''
+                cause_reason = error_cause.get('reason', '') if error_cause else ''
+                
+                print(f"\n错误 #{i+1}:")
+                print(f"  类型: {error_type}")
+                print(f"  原因: {error_reason}")
+                if cause_type:
+                    print(f"  根因类型: {cause_type}")
+                    print(f"  根因: {cause_reason}")
+            
+            if failed > 10:
+                print(f"\n... 还有 {failed - 10} 个错误未显示")
+        
+        return success_by_index
+    
+    def index_experience_stream(self, index_name: str,
+                                records: Iterable[Tuple[Dict[str, Any], List[ChunkRecord]]],
+                                layout: str = None) -> int:
+        """
+        按索引布局流式写入（经历, chunks）序列，用于内存受限的构建模式
+        
+        与index_chunks写出的文档相同，但每次只处理一条经历，不需要把全部chunk放在内存中。
+        
+        Args:
+            index_name: 索引名称
+            records: (经历, 该经历的chunk记录列表) 的可迭代对象
+            layout: 索引布局，默认使用初始化时的布局
+        
+        Returns:
+            成功索引的文档数量（nested布局为经历文档数量，compact布局不含父索引中的经历文档）
+        """
+        layout = layout or self.layout
+        parent_index = experience_index_name(index_name)
+        num_parents = 0
+        
+        def actions():
+            nonlocal num_parents
+            for experience, chunks in records:
+                if layout == "nested":
+                    docs, id_field = nested_documents([experience], chunks), "experience_id"
+                elif layout == "compact":
+                    num_parents += 1
+                    yield {"_index": parent_index, "_id": experience["experience_id"], "_source": experience}
+                    docs, id_field = compact_chunk_documents([experience], chunks), "chunk_id"
+                else:
+                    docs, id_field = flat_documents([experience], chunks), "chunk_id"
+                for doc in docs:
+                    yield {"_index": index_name, "_id": doc[id_field], "_source": doc}
+        
+        # compact布局的父文档和chunk文档在同一批请求中写入
+        written = self.bulk_actions(actions(), index_label=index_name)
+        if layout == "compact":
+            self._report_parent_failures(parent_index, written.get(parent_index, 0), num_parents)
+        return written.get(index_name, 0)
+    
+    def _report_parent_failures(self, parent_index: str, written: int, total: int):
+        """
+        记录并打印compact布局父索引中写入失败的经历（这些经历的chunk检索后无法补全经历字段）
+        
+        Args:
+            parent_index: 父索引名称
+            written: 成功写入的经历数量
+            total: 应写入的经历数量
+        """
+        failed = total - written
+        if failed <= 0:
+            return
+        self.metrics.counter("es_parent_failures_total", "compact布局父索引写入失败的经历数").inc(
+            failed, index=parent_index
+        )
+        print(f"警告: {parent_index} 中有 {failed}/{total} 条经历写入失败，对应chunk的检索结果将缺少经历字段")
     
     def search(self, index_name: str, query: dict, size: int = 10):
         """
@@ -280,45 +1014,171 @@ class ElasticsearchSetup:
         
         Args:
             index_name: 索引名称
-            query: 查询字典（包含query字段）
+            query: 查询字典（包含query字段，也可包含_source、sort等其他请求体字段）
             size: 返回结果数量
         
         Returns:
             搜索结果
         """
+        # 除query外的请求体字段透传给客户端（_source对应客户端参数source）
+        extra = {
+            ("source" if key == "_source" else key): value
+            for key, value in query.items()
+            if key not in ("query", "size")
+        }
         try:
             # 新版本API（8.x）
-            result = self.es.search(index=index_name, query=query.get("query", {}), size=size)
-            return result
+            result = self._timed_search("search", index=index_name, query=query.get("query", {}), size=size, **extra)
+            return self._postprocess_hits(index_name, result)
         except TypeError:
             # 旧版本API（7.x）使用body参数
-            result = self.es.search(index=index_name, body=query, size=size)
-            return result
+            result = self._timed_search("search", index=index_name, body=query, size=size)
+            return self._postprocess_hits(index_name, result)
         except Exception as e:
             print(f"搜索失败: {str(e)}")
             return None
     
-    def vector_search(self, index_name: str, embedding: list, size: int = 10, 
-                     filter_query: dict = None) -> dict:
+    def open_point_in_time(self, index_name: str, keep_alive: str = "1m") -> str:
         """
-        向量相似度搜索
+        打开索引的point-in-time（分页期间看到的是打开时刻的一致快照）
         
         Args:
             index_name: 索引名称
+            keep_alive: 两次请求之间PIT的保活时间
+        
+        Returns:
+            PIT ID
+        """
+        return self.es.open_point_in_time(index=index_name, keep_alive=keep_alive)["id"]
+    
+    def close_point_in_time(self, pit_id: str):
+        """关闭point-in-time，释放其占用的段（关闭失败只打印警告，PIT到期后会自动释放）"""
+        try:
+            self.es.close_point_in_time(id=pit_id)
+        except Exception as e:
+            print(f"关闭PIT失败: {str(e)}")
+    
+    def scan(self, index_name: str, query: dict = None, page_size: int = 1000, keep_alive: str = "1m",
+             source=True, pit_id: str = None, slice_id: int = None,
+             max_slices: int = None) -> Iterator[Dict[str, Any]]:
+        """
+        用 point-in-time + search_after 逐页遍历索引中的全部匹配文档
+        
+        不受max_result_window限制，内存中只保留一页命中。返回索引中的原始文档
+        （compact布局的chunk索引不补全经历字段，需要时单独遍历 <索引名>_experiences）。
+        
+        Args:
+            index_name: 索引名称
+            query: 查询条件，默认match_all
+            page_size: 每页文档数
+            keep_alive: 两次请求之间PIT的保活时间
+            source: _source过滤（True、False或 {"excludes": [...]}）
+            pit_id: 已打开的PIT（切片并行遍历时共享同一个PIT，由调用方关闭），默认打开并在结束时关闭新的PIT
+            slice_id: 切片编号（与max_slices一起使用）
+            max_slices: 切片总数
+        
+        Yields:
+            命中（包含_id和_source）
+        """
+        owns_pit = pit_id is None
+        if owns_pit:
+            pit_id = self.open_point_in_time(index_name, keep_alive)
+        search_after = None
+        try:
+            while True:
+                kwargs = {
+                    "pit": {"id": pit_id, "keep_alive": keep_alive},
+                    "query": query or {"match_all": {}},
+                    "size": page_size,
+                    # _shard_doc是PIT下最高效的全局唯一排序
+                    "sort": [{"_shard_doc": "asc"}],
+                    "source": source,
+                    "track_total_hits": False,
+                }
+                if search_after is not None:
+                    kwargs["search_after"] = search_after
+                if max_slices and max_slices > 1:
+                    kwargs["slice"] = {"id": slice_id, "max": max_slices}
+                result = self._timed_search("scan", **kwargs)
+                # 每次响应都可能返回新的PIT ID
+                pit_id = result.get("pit_id", pit_id)
+                hits = result["hits"]["hits"]
+                if not hits:
+                    break
+                yield from hits
+                if len(hits) < page_size:
+                    break
+                search_after = hits[-1]["sort"]
+        finally:
+            if owns_pit:
+                self.close_point_in_time(pit_id)
+    
+    def _timed_search(self, operation: str, **kwargs) -> dict:
+        """
+        执行es.search并记录请求耗时和ES返回的took
+        
+        Args:
+            operation: 检索类型（search/knn/hybrid），作为指标标签
+            **kwargs: 透传给es.search的参数
+        
+        Returns:
+            原始搜索结果
+        """
+        with self.metrics.span("es_search", operation=operation):
+            result = self.es.search(**kwargs)
+        self.metrics.histogram("es_took_ms", "ES返回的服务端耗时（毫秒）", MILLISECOND_BUCKETS).observe(
+            result.get("took", 0), operation=operation
+        )
+        return result
+    
+    def _postprocess_hits(self, index_name: str, result: dict) -> dict:
+        """
+        按索引布局整理命中结果，使各布局返回的_source字段一致
+        
+        - compact: 从父索引补全经历字段
+        - nested: 把最佳chunk（inner_hits）的full_text和chunk_id（以及请求了的向量）放到_source上
+        """
+        if self.layout == "compact":
+            return self.hydrate_hits(index_name, result)
+        if self.layout == "nested" and result and "hits" in result:
+            for hit in result["hits"]["hits"]:
+                inner = hit.get("inner_hits", {}).get("chunks", {}).get("hits", {}).get("hits", [])
+                if inner:
+                    best_chunk = inner[0].get("_source", {})
+                    hit["_source"]["full_text"] = best_chunk.get("full_text", "")
+                    hit["_source"]["chunk_id"] = best_chunk.get("chunk_id", "")
+                    if "embedding" in best_chunk:
+                        hit["_source"]["embedding"] = best_chunk["embedding"]
+        return result
+    
+    def _knn_body(self, embedding: list, size: int, filter_query: dict = None,
+                  collapse_field: str = None, include_vectors: bool = False,
+                  k: int = None, num_candidates: int = None) -> dict:
+        """
+        构建kNN检索的请求参数（es.search的关键字参数形式）
+        
+        Args:
             embedding: 查询向量
             size: 返回结果数量
             filter_query: 过滤条件
+            collapse_field: 按该keyword字段折叠结果（每个值只保留得分最高的一条）
+            include_vectors: nested布局下是否在inner_hits中返回最佳chunk的向量
+            k: kNN返回的近邻数，默认等于size
+            num_candidates: 每个分片的HNSW候选数，默认为 k * 10
         
         Returns:
-            搜索结果
+            请求参数字典
         """
+        k = k or size
+        nested = self.layout == "nested"
+        
         # ElasticSearch 8.x 使用 knn 查询
         search_body = {
             "knn": {
-                "field": "embedding",
+                "field": "chunks.embedding" if nested else "embedding",
                 "query_vector": embedding,
-                "k": size,
-                "num_candidates": size * 10
+                "k": k,
+                "num_candidates": max(num_candidates or k * 10, k)
             },
             "size": size
         }
@@ -327,44 +1187,299 @@ class ElasticsearchSetup:
         if filter_query:
             search_body["knn"]["filter"] = filter_query
         
+        if nested:
+            # 不返回所有chunk的文本和向量，只通过inner_hits返回最佳chunk
+            search_body["source"] = {"excludes": ["chunks"]}
+            search_body["knn"]["inner_hits"] = {
+                "size": 1,
+                "_source": True if include_vectors else {"excludes": ["chunks.embedding"]}
+            }
+        
+        if collapse_field:
+            search_body["collapse"] = {"field": collapse_field}
+        return search_body
+    
+    def vector_search(self, index_name: str, embedding: list, size: int = 10, 
+                     filter_query: dict = None, collapse_field: str = None,
+                     include_vectors: bool = False, k: int = None,
+                     num_candidates: int = None) -> dict:
+        """
+        向量相似度搜索
+        
+        nested布局下执行nested kNN，每个经历只返回一次，最佳chunk在inner_hits中。
+        
+        Args:
+            index_name: 索引名称
+            embedding: 查询向量
+            size: 返回结果数量
+            filter_query: 过滤条件
+            collapse_field: 服务端按该字段折叠结果（如celebrity_name_en，每位名人一条）；
+                            ES不支持kNN折叠时去掉折叠重试
+            include_vectors: nested布局下是否返回最佳chunk的向量（flat/compact的_source本身带向量）
+            k: kNN返回的近邻数，默认等于size
+            num_candidates: HNSW候选数，默认为 k * 10（见query_planner按过滤条件自适应选择）
+        
+        Returns:
+            搜索结果
+        """
+        nested = self.layout == "nested"
+        search_body = self._knn_body(embedding, size, filter_query, collapse_field, include_vectors,
+                                     k=k, num_candidates=num_candidates)
+        
         try:
             # 新版本API
-            result = self.es.search(index=index_name, **search_body)
-            return result
+            result = self._timed_search("knn", index=index_name, **search_body)
+            return self._postprocess_hits(index_name, result)
         except Exception as e:
+            if search_body.pop("collapse", None) is not None:
+                print(f"kNN折叠检索失败，去掉折叠重试: {str(e)}")
+                return self.vector_search(index_name, embedding, size, filter_query,
+                                          include_vectors=include_vectors, k=k,
+                                          num_candidates=num_candidates)
+
+            if nested:
+                # knn的inner_hits需要ES 8.13+，8.11/8.12上去掉inner_hits重试
+                try:
+                    search_body["knn"].pop("inner_hits", None)
+                    search_body.pop("source", None)
+                    result = self._timed_search("knn", index=index_name, **search_body)
+                    return self._postprocess_hits(index_name, result)
+                except Exception:
+                    pass
+            
             # 如果knn不支持，回退到script_score
-            try:
-                query = {
-                    "script_score": {
-                        "query": {
-                            "match_all": {}
-                        },
-                        "script": {
-                            "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
-                            "params": {
-                                "query_vector": embedding
-                            }
+            return self.exact_vector_search(index_name, embedding, size, filter_query)
+    
+    def exact_vector_search(self, index_name: str, embedding: list, size: int = 10,
+                            filter_query: dict = None) -> dict:
+        """
+        精确向量检索：用script_score对满足过滤条件的文档逐个计算相似度
+        
+        不经过HNSW，召回是精确的，耗时与过滤后的文档数成正比；用于不支持kNN的ES版本，
+        以及过滤条件很有选择性、候选子集很小的查询。
+        
+        Args:
+            index_name: 索引名称
+            embedding: 查询向量
+            size: 返回结果数量
+            filter_query: 过滤条件
+        
+        Returns:
+            搜索结果
+        """
+        nested = self.layout == "nested"
+        vector_field = "chunks.embedding" if nested else "embedding"
+        try:
+            query = {
+                "script_score": {
+                    "query": {
+                        "match_all": {}
+                    },
+                    "script": {
+                        # (相似度 + 1) / 2 与kNN的得分一致，规划器在两种检索间切换时得分可比
+                        "source": (
+                            f"(dotProduct(params.query_vector, '{vector_field}') + 1.0) / 2.0"
+                            if self.requires_normalized_vectors
+                            else f"(cosineSimilarity(params.query_vector, '{vector_field}') + 1.0) / 2.0"
+                        ),
+                        "params": {
+                            "query_vector": embedding
                         }
                     }
                 }
-                
-                if filter_query:
-                    query = {
-                        "bool": {
-                            "must": [query],
-                            "filter": filter_query
+            }
+            
+            if nested:
+                query = {
+                    "nested": {
+                        "path": "chunks",
+                        "score_mode": "max",
+                        "query": query,
+                        "inner_hits": {
+                            "size": 1,
+                            "_source": {"excludes": ["chunks.embedding"]}
                         }
                     }
-                
-                search_body_old = {
-                    "query": query,
-                    "size": size
                 }
-                
-                return self.search(index_name, search_body_old, size)
-            except Exception as e2:
-                print(f"向量搜索失败: {str(e2)}")
-                return None
+            
+            if filter_query:
+                query = {
+                    "bool": {
+                        "must": [query],
+                        "filter": filter_query
+                    }
+                }
+            
+            search_body_old = {
+                "query": query,
+                "size": size
+            }
+            if nested:
+                search_body_old["_source"] = {"excludes": ["chunks"]}
+            
+            return self.search(index_name, search_body_old, size)
+        except Exception as e2:
+            print(f"向量搜索失败: {str(e2)}")
+            return None
+    
+    def knn_ids(self, index_name: str, embedding: list, k: int,
+                num_candidates: int = None) -> Tuple[List[str], float]:
+        """
+        只返回_id的kNN检索（不拉取_source，用于召回和延迟评估）
+        
+        Args:
+            index_name: 索引名称
+            embedding: 查询向量
+            k: 近邻数
+            num_candidates: HNSW候选数，默认为 k * 10
+        
+        Returns:
+            (按得分降序的文档_id列表, ES返回的took毫秒数)
+        """
+        nested = self.layout == "nested"
+        result = self._timed_search(
+            "knn", index=index_name, size=k, source=False,
+            knn={
+                "field": "chunks.embedding" if nested else "embedding",
+                "query_vector": embedding,
+                "k": k,
+                "num_candidates": max(num_candidates or k * 10, k),
+            },
+        )
+        return [hit["_id"] for hit in result["hits"]["hits"]], float(result.get("took", 0))
+    
+    def centroid_search(self, index_name: str, embedding: list, size: int = 10,
+                        filter_query: dict = None) -> dict:
+        """
+        在质心索引上做kNN检索（质心索引很小，num_candidates取较大值以接近精确检索）
+        
+        Args:
+            index_name: 质心索引名称
+            embedding: 查询向量
+            size: 返回结果数量
+            filter_query: 过滤条件（如按level或challenge_type过滤）
+        
+        Returns:
+            搜索结果，失败时返回None
+        """
+        knn = {
+            "field": "embedding",
+            "query_vector": embedding,
+            "k": size,
+            "num_candidates": max(size * 10, 100)
+        }
+        if filter_query:
+            knn["filter"] = filter_query
+        try:
+            return self._timed_search("centroid_knn", index=index_name, knn=knn, size=size,
+                                      source={"excludes": ["embedding"]})
+        except Exception as e:
+            print(f"质心检索失败: {str(e)}")
+            return None
+    
+    def multi_vector_search(self, index_name: str, embeddings: List[list], size: int = 10,
+                            filter_query: dict = None) -> List[Optional[dict]]:
+        """
+        在一次_msearch请求中执行多个向量检索
+        
+        _msearch不可用时整体回退为逐个vector_search；单个子请求失败（例如ES 8.13以下
+        不支持knn的inner_hits）时只对该子请求回退。
+        
+        Args:
+            index_name: 索引名称
+            embeddings: 查询向量列表
+            size: 每个查询返回的结果数量
+            filter_query: 过滤条件（作用于所有查询）
+        
+        Returns:
+            与embeddings一一对应的搜索结果，失败的位置为None
+        """
+        searches = []
+        for embedding in embeddings:
+            body = self._knn_body(embedding, size, filter_query)
+            searches.append({"index": index_name})
+            # _msearch的请求体使用REST字段名
+            searches.append({("_source" if key == "source" else key): value for key, value in body.items()})
+        
+        try:
+            with self.metrics.span("es_search", operation="msearch"):
+                responses = self.es.msearch(searches=searches)["responses"]
+        except Exception as e:
+            print(f"_msearch失败，逐个执行向量检索: {str(e)}")
+            return [self.vector_search(index_name, embedding, size, filter_query) for embedding in embeddings]
+        
+        took = self.metrics.histogram("es_took_ms", "ES返回的服务端耗时（毫秒）", MILLISECOND_BUCKETS)
+        results = []
+        for embedding, response in zip(embeddings, responses):
+            if "error" in response:
+                results.append(self.vector_search(index_name, embedding, size, filter_query))
+                continue
+            took.observe(response.get("took", 0), operation="msearch")
+            if self.layout == "compact":
+                # 各子请求的命中在下面合并成一次mget补全
+                results.append(response)
+            else:
+                results.append(self._postprocess_hits(index_name, response))
+        
+        if self.layout == "compact":
+            hits = [hit for result in results if result and "hits" in result for hit in result["hits"]["hits"]]
+            self.hydrate_hits(index_name, {"hits": {"hits": hits}})
+        return results
+    
+    def hybrid_search(self, index_name: str, query_text: str, embedding: list, size: int = 10,
+                      filter_query: dict = None, vector_boost: float = 1.0,
+                      keyword_boost: float = 1.0, num_candidates: int = None) -> dict:
+        """
+        混合搜索：在同一请求中执行kNN和multi_match，ES按boost加权求和两部分得分
+        
+        kNN部分与vector_search相同（nested布局通过inner_hits返回最佳chunk），关键词字段按索引布局选择。
+        
+        Args:
+            index_name: 索引名称
+            query_text: 查询文本（用于关键词匹配）
+            embedding: 查询向量
+            size: 返回结果数量
+            filter_query: 过滤条件（同时作用于kNN和关键词部分）
+            vector_boost: kNN得分权重
+            keyword_boost: 关键词得分权重
+            num_candidates: HNSW候选数，默认为 size * 10（见QueryPlanner.hybrid_search）
+        
+        Returns:
+            搜索结果
+        """
+        search_body = self._knn_body(embedding, size, filter_query, num_candidates=num_candidates)
+        search_body["knn"]["boost"] = vector_boost
+        query = {
+            "multi_match": {
+                "query": query_text,
+                "fields": self.keyword_fields,
+                "type": "best_fields",
+                "boost": keyword_boost
+            }
+        }
+        if filter_query:
+            query = {
+                "bool": {
+                    "must": [query],
+                    "filter": filter_query
+                }
+            }
+        search_body["query"] = query
+        
+        try:
+            result = self._timed_search("hybrid", index=index_name, **search_body)
+            return self._postprocess_hits(index_name, result)
+        except Exception as e:
+            if self.layout == "nested" and search_body["knn"].pop("inner_hits", None) is not None:
+                # knn的inner_hits需要ES 8.13+，8.11/8.12上去掉inner_hits重试
+                try:
+                    search_body.pop("source", None)
+                    result = self._timed_search("hybrid", index=index_name, **search_body)
+                    return self._postprocess_hits(index_name, result)
+                except Exception:
+                    pass
+            print(f"混合搜索失败: {str(e)}")
+            return None
 
 
 if __name__ == "__main__":
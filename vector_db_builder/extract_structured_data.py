@@ -1,12 +1,32 @@
 """
 数据提取模块：从搜索结果中提取结构化JSON数据
 """
-from openai import OpenAI
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
 import re
 
+try:
+    from .metrics import get_metrics
+except ImportError:
+    from metrics import get_metrics
+
+try:
+    from .budget import get_budget
+except ImportError:
+    from budget import get_budget
+
+try:
+    from .rate_limit import get_rate_limiter
+except ImportError:
+    from rate_limit import get_rate_limiter
+
+try:
+    from .clients import get_openai_client
+except ImportError:
+    from clients import get_openai_client
+
 
 class StructuredDataExtractor:
     def __init__(self, api_key: str = None, model: str = "openai/gpt-4o-mini"):
@@ -21,11 +41,13 @@ class StructuredDataExtractor:
         if not self.api_key:
             raise ValueError("OPENROUTER_API_KEY not found in environment variables")
         
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=self.api_key
-        )
+        self.metrics = get_metrics()
+        self.budget = get_budget()
+        self.base_url = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+        # 同一端点共享客户端和连接池，重试由共享限流器负责
+        self.client = get_openai_client(self.base_url, self.api_key)
         self.model = model
+        self.limiter = get_rate_limiter(self.base_url, self.model)
     
     def extract_experiences(self, celebrity_name_en: str, celebrity_name_cn: str, 
                            search_result: str) -> List[Dict[str, Any]]:
@@ -70,23 +92,31 @@ class StructuredDataExtractor:
 
 请直接返回JSON数组，不要添加任何其他文字说明。"""
 
+        def request():
+            with self.metrics.api_call("extract", self.model) as call:
+                completion = self.client.chat.completions.create(
+                    extra_headers={
+                        "HTTP-Referer": "https://github.com/InspireMatch",
+                        "X-Title": "InspireMatch",
+                    },
+                    model=self.model,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": prompt
+                        }
+                    ],
+                    temperature=0.3
+                )
+                call.record_usage(getattr(completion, "usage", None))
+            return completion
+        
         try:
-            completion = self.client.chat.completions.create(
-                extra_headers={
-                    "HTTP-Referer": "https://github.com/InspireMatch",
-                    "X-Title": "InspireMatch",
-                },
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.3
-            )
+            completion = self.limiter.call(request, tokens=self.limiter.token_cost(prompt))
             
             response_text = completion.choices[0].message.content.strip()
+            self.budget.record_usage("extract", self.model, getattr(completion, "usage", None),
+                                     prompt_text=prompt, completion_text=response_text)
             
             # 尝试提取JSON
             json_data = self._parse_json_response(response_text)
@@ -106,6 +136,8 @@ class StructuredDataExtractor:
                         for field in required_fields:
                             if isinstance(exp[field], str):
                                 exp[field] = exp[field].strip()
+                        # 经历在该名人提取结果中的序号，参与生成experience_id
+                        exp["experience_index"] = len(experiences)
                         experiences.append(exp)
             
             return experiences
@@ -161,27 +193,41 @@ class StructuredDataExtractor:
         Returns:
             所有经历的列表
         """
-        all_experiences = []
+        tasks = [
+            (profession, en_name, data)
+            for profession, celebrities in search_results.items()
+            for en_name, data in celebrities.items()
+        ]
+        print(f"\n开始提取 {len(tasks)} 位名人的经历...")
         
-        for profession, celebrities in search_results.items():
-            print(f"\n提取 {profession} 职业的经历...")
-            for en_name, data in celebrities.items():
-                cn_name = data.get("chinese_name", "")
-                search_result = data.get("search_result", "")
-                
-                print(f"  提取: {cn_name} ({en_name})")
-                experiences = self.extract_experiences(en_name, cn_name, search_result)
-                
-                # 添加职业信息
-                for exp in experiences:
-                    exp["profession"] = profession
-                
-                all_experiences.extend(experiences)
-                print(f"    提取到 {len(experiences)} 条经历")
-                
-                # 添加延迟
-                import time
-                time.sleep(0.5)
+        def extract(task):
+            profession, en_name, data = task
+            # 预算用完后不再发起新的提取，已有结果照常返回
+            if self.budget.exhausted("extract"):
+                return None
+            cn_name = data.get("chinese_name", "")
+            experiences = self.extract_experiences(en_name, cn_name, data.get("search_result", ""))
+            
+            # 添加职业信息
+            for exp in experiences:
+                exp["profession"] = profession
+            
+            print(f"  提取: {cn_name} ({en_name})，{len(experiences)} 条经历")
+            return experiences
+        
+        # 并发度由共享限流器按429/Retry-After自适应控制；结果按输入顺序合并
+        with ThreadPoolExecutor(max_workers=self.limiter.max_concurrency) as executor:
+            results = list(executor.map(extract, tasks))
+        
+        all_experiences = []
+        skipped = 0
+        for experiences in results:
+            if experiences is None:
+                skipped += 1
+                continue
+            all_experiences.extend(experiences)
+        if skipped:
+            print(f"  提取预算已用完，跳过 {skipped} 位名人")
         
         return all_experiences
 
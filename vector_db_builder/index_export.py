@@ -0,0 +1,120 @@
+"""
+索引导出：point-in-time + search_after 切片并行导出为JSONL
+
+所有切片共享同一个PIT（导出的是打开时刻的一致快照），每个worker线程用 slice + search_after
+逐页遍历自己的切片，每页序列化后在锁内追加写入同一个输出文件（.zst后缀自动压缩）。
+内存中只有每个worker当前的一页，导出速度随切片数增加，直到集群饱和。
+
+每行一个文档：{"_id": 文档ID, ...文档字段}，默认去掉向量字段（embedding / chunks.embedding）。
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    from .elasticsearch_setup import ElasticsearchSetup
+    from .jsonl_cache import open_jsonl
+except ImportError:
+    from elasticsearch_setup import ElasticsearchSetup
+    from jsonl_cache import open_jsonl
+
+
+# 导出时默认去掉的向量字段（flat/compact的embedding，nested的chunks.embedding）
+VECTOR_FIELDS = ["embedding", "chunks.embedding"]
+
+
+def export_index(es_setup: ElasticsearchSetup, index_name: str, output_path: Path, slices: int = 4,
+                 page_size: int = 1000, include_vectors: bool = False, query: dict = None,
+                 keep_alive: str = "5m") -> int:
+    """
+    切片并行导出索引中的文档
+
+    Args:
+        es_setup: ElasticSearch设置
+        index_name: 索引名称
+        output_path: 输出的JSONL文件路径（.zst后缀时压缩）
+        slices: 切片数（并行的worker数），1表示不切片
+        page_size: 每页文档数
+        include_vectors: 是否导出向量字段
+        query: 只导出匹配的文档，默认全部
+        keep_alive: PIT的保活时间（需大于处理一页的耗时）
+
+    Returns:
+        导出的文档数
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # 写完后原子替换；临时文件保留原后缀，open_jsonl按后缀决定是否压缩
+    tmp_path = output_path.with_name(f".tmp-{output_path.name}")
+    source = True if include_vectors else {"excludes": VECTOR_FIELDS}
+    slices = max(slices, 1)
+
+    write_lock = threading.Lock()
+    counts = [0] * slices
+    start = time.perf_counter()
+
+    pit_id = es_setup.open_point_in_time(index_name, keep_alive)
+    try:
+        with open_jsonl(tmp_path, "w") as f:
+            def export_slice(slice_id: int):
+                lines = []
+                for hit in es_setup.scan(index_name, query=query, page_size=page_size, keep_alive=keep_alive,
+                                         source=source, pit_id=pit_id, slice_id=slice_id, max_slices=slices):
+                    lines.append(json.dumps({"_id": hit["_id"], **hit.get("_source", {})}, ensure_ascii=False))
+                    if len(lines) >= page_size:
+                        with write_lock:
+                            f.write("\n".join(lines) + "\n")
+                        counts[slice_id] += len(lines)
+                        lines = []
+                if lines:
+                    with write_lock:
+                        f.write("\n".join(lines) + "\n")
+                    counts[slice_id] += len(lines)
+
+            with ThreadPoolExecutor(max_workers=slices, thread_name_prefix="export") as executor:
+                # list()让worker中的异常在这里抛出
+                list(executor.map(export_slice, range(slices)))
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    finally:
+        es_setup.close_point_in_time(pit_id)
+
+    os.replace(tmp_path, output_path)
+    total = sum(counts)
+    elapsed = time.perf_counter() - start
+    print(f"已导出 {total} 个文档到 {output_path}（{slices} 个切片，{elapsed:.1f}秒，"
+          f"{total / elapsed if elapsed > 0 else 0:.0f} 文档/秒）")
+    return total
+
+
+def main():
+    """命令行入口"""
+    import argparse
+
+    try:
+        from .config import load_env
+    except ImportError:
+        from config import load_env
+    load_env()
+
+    parser = argparse.ArgumentParser(description="用point-in-time + search_after切片并行导出索引为JSONL")
+    parser.add_argument("output", type=str, help="输出文件（.jsonl，或.jsonl.zst压缩，需要zstandard）")
+    parser.add_argument("--index", type=str, help="索引名称（默认ELASTICSEARCH_INDEX）")
+    parser.add_argument("--slices", type=int, default=4, help="切片数（并行worker数）")
+    parser.add_argument("--page-size", type=int, default=1000, help="每页文档数")
+    parser.add_argument("--include-vectors", action="store_true", help="导出向量字段")
+    parser.add_argument("--tags", type=str, nargs="+", help="只导出带这些标签的文档")
+    args = parser.parse_args()
+
+    index_name = args.index or os.getenv("ELASTICSEARCH_INDEX", "celebrity_experiences")
+    query = {"terms": {"tags": args.tags}} if args.tags else None
+    export_index(ElasticsearchSetup(), index_name, Path(args.output), slices=args.slices,
+                 page_size=args.page_size, include_vectors=args.include_vectors, query=query)
+
+
+if __name__ == "__main__":
+    main()
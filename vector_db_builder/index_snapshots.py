@@ -0,0 +1,89 @@
+"""
+索引快照：把构建好的索引保存到文件系统快照仓库，在新节点上按名称或版本恢复
+
+快照包含主索引及其配套索引（compact布局的 <index>_experiences、名人质心 <index>_celebrities），
+恢复时直接还原已合并好的段和HNSW图，不需要重新走构建流程或批量索引。
+
+仓库为fs类型，路径（ELASTICSEARCH_SNAPSHOT_LOCATION）必须在ES的path.repo之下，
+docker-compose.yml中把它挂载在数据卷旁边；多个节点挂载同一目录即可共享快照。
+"""
+import os
+import time
+
+try:
+    from .elasticsearch_setup import ElasticsearchSetup
+except ImportError:
+    from elasticsearch_setup import ElasticsearchSetup
+
+
+def print_snapshots(snapshots: list):
+    """打印快照列表"""
+    if not snapshots:
+        print("没有快照")
+        return
+    print(f"{'快照':<48} {'状态':<10} {'创建时间':<20} 索引")
+    for info in snapshots:
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(info.get("start_time_in_millis", 0) / 1000))
+        print(f"{info['snapshot']:<48} {info.get('state', ''):<10} {started:<20} {', '.join(info.get('indices', []))}")
+
+
+def main():
+    """命令行入口"""
+    import argparse
+
+    try:
+        from .config import load_env
+    except ImportError:
+        from config import load_env
+    load_env()
+
+    parser = argparse.ArgumentParser(description="索引快照：创建、列出、恢复和删除")
+    parser.add_argument("--index", type=str, help="索引名称（默认ELASTICSEARCH_INDEX）")
+    parser.add_argument("--repository", type=str, help="快照仓库名称（默认ELASTICSEARCH_SNAPSHOT_REPOSITORY）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    create = subparsers.add_parser("create", help="为索引创建快照")
+    create.add_argument("--version", type=str, help="版本号（默认当前时间）")
+    subparsers.add_parser("list", help="列出索引的快照")
+    restore = subparsers.add_parser("restore", help="从快照恢复索引（默认最新的快照）")
+    target = restore.add_mutually_exclusive_group()
+    target.add_argument("--snapshot", type=str, help="快照名称")
+    target.add_argument("--version", type=str, help="版本号")
+    restore.add_argument("--warmup", action="store_true",
+                         help="恢复后执行预热查询（WARMUP_QUERIES，需要嵌入API）")
+    delete = subparsers.add_parser("delete", help="删除快照")
+    delete.add_argument("snapshot", type=str, help="快照名称")
+    args = parser.parse_args()
+
+    index_name = args.index or os.getenv("ELASTICSEARCH_INDEX", "celebrity_experiences")
+    es_setup = ElasticsearchSetup()
+    if args.command == "create":
+        ok = es_setup.snapshot_index(index_name, version=args.version, repository=args.repository) is not None
+    elif args.command == "list":
+        es_setup.ensure_snapshot_repository(args.repository)
+        print_snapshots(es_setup.list_snapshots(index_name, repository=args.repository))
+        ok = True
+    elif args.command == "restore":
+        start = time.perf_counter()
+        ok = es_setup.restore_snapshot(index_name, snapshot=args.snapshot, version=args.version,
+                                       repository=args.repository) is not None
+        if ok:
+            print(f"恢复耗时 {time.perf_counter() - start:.1f}秒")
+        if ok and args.warmup:
+            try:
+                from .index_warmup import load_warmup_queries, warm_up
+                from .text_processing import TextProcessor
+            except ImportError:
+                from index_warmup import load_warmup_queries, warm_up
+                from text_processing import TextProcessor
+            text_processor = TextProcessor()
+            if es_setup.requires_normalized_vectors:
+                text_processor.normalize = True
+            warm_up(es_setup, text_processor, index_name, load_warmup_queries())
+    else:
+        ok = es_setup.delete_snapshot(args.snapshot, repository=args.repository)
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+索引预热：重建索引后、对外提供查询之前，用一组有代表性的查询把HNSW图、向量文件和过滤缓存读热
+
+刚合并或刚恢复的索引，其段文件还不在页缓存中，前几轮查询要从磁盘读取HNSW图，尾延迟远高于稳定状态。
+预热查询来源（WARMUP_QUERIES）：
+    - tags：每个标签的标签文本（英文 + 中文），一半不带过滤、一半过滤该标签（同时预热tags字段）
+    - 文件路径：真实查询日志，每行一条纯文本查询或JSON对象 {"query": ..., "tags": [...]}
+    - none：不预热
+查询向量只嵌入一次，随后重复执行WARMUP_ROUNDS轮，打印每轮的延迟分位数，最后一轮应接近稳定状态。
+"""
+import json
+import os
+import random
+import time
+from pathlib import Path
+from typing import Dict, Any, List
+
+import numpy as np
+
+try:
+    from .elasticsearch_setup import ElasticsearchSetup
+    from .tag_matching import load_tags
+    from .tag_lists import tag_label
+except ImportError:
+    from elasticsearch_setup import ElasticsearchSetup
+    from tag_matching import load_tags
+    from tag_lists import tag_label
+
+
+def load_warmup_queries(source: str = None, max_queries: int = None, seed: int = 42) -> List[Dict[str, Any]]:
+    """
+    加载预热查询
+
+    Args:
+        source: tags、查询日志路径或none，默认读取环境变量WARMUP_QUERIES（缺省tags）
+        max_queries: 最多使用的查询数（超出时随机抽样），默认读取环境变量WARMUP_MAX_QUERIES（缺省50）
+        seed: 抽样的随机种子
+
+    Returns:
+        查询列表，每项为 {"query": 查询文本, "tags": 过滤标签列表}
+    """
+    source = source or os.getenv("WARMUP_QUERIES", "tags")
+    max_queries = max_queries or int(os.getenv("WARMUP_MAX_QUERIES", "50"))
+    if source == "none":
+        return []
+
+    queries = []
+    if source == "tags":
+        for tag_list in load_tags().values():
+            for tag in tag_list:
+                queries.append({"query": tag_label(tag), "tags": [tag["en"]]})
+        # 一半查询不带过滤，覆盖无过滤的kNN路径
+        for i, query in enumerate(queries):
+            if i % 2:
+                query["tags"] = []
+    else:
+        path = Path(source)
+        if not path.exists():
+            raise FileNotFoundError(f"预热查询文件不存在: {path}")
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if line.startswith("{"):
+                    item = json.loads(line)
+                    queries.append({"query": item["query"], "tags": item.get("tags") or []})
+                else:
+                    queries.append({"query": line, "tags": []})
+
+    if len(queries) > max_queries:
+        queries = random.Random(seed).sample(queries, max_queries)
+    return queries
+
+
+def warm_up(es_setup: ElasticsearchSetup, text_processor, index_name: str, queries: List[Dict[str, Any]],
+            rounds: int = None, size: int = 10) -> List[Dict[str, float]]:
+    """
+    执行预热查询
+
+    Args:
+        es_setup: ElasticSearch设置
+        text_processor: 文本处理器（用于生成查询向量）
+        index_name: 索引名称
+        queries: 预热查询（load_warmup_queries的结果）
+        rounds: 重复轮数，默认读取环境变量WARMUP_ROUNDS（缺省2）
+        size: 每个查询返回的结果数量
+
+    Returns:
+        每轮的延迟统计 {"round", "p50_ms", "p95_ms", "max_ms"}
+    """
+    rounds = rounds or int(os.getenv("WARMUP_ROUNDS", "2"))
+    embeddings = text_processor.get_embeddings([query["query"] for query in queries], stage="warmup")
+    prepared = [
+        (embedding, {"terms": {"tags": query["tags"]}} if query["tags"] else None)
+        for query, embedding in zip(queries, embeddings) if embedding
+    ]
+    if not prepared:
+        print("没有可用的预热查询")
+        return []
+
+    stats = []
+    for round_index in range(1, rounds + 1):
+        latencies = []
+        for embedding, filter_query in prepared:
+            start = time.perf_counter()
+            es_setup.vector_search(index_name, embedding, size=size, filter_query=filter_query)
+            latencies.append((time.perf_counter() - start) * 1000)
+        stats.append({
+            "round": round_index,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "max_ms": max(latencies),
+        })
+        print(f"预热第 {round_index}/{rounds} 轮（{len(prepared)} 个查询）: "
+              f"p50 {stats[-1]['p50_ms']:.1f}ms, p95 {stats[-1]['p95_ms']:.1f}ms, max {stats[-1]['max_ms']:.1f}ms")
+    return stats
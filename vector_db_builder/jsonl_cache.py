@@ -0,0 +1,220 @@
+"""
+JSONL流式缓存：逐行读写，内存占用与文件大小无关
+
+- 文件名以 .zst 结尾时使用zstd压缩（需要安装zstandard: pip install zstandard）
+- 向量以float32小端字节序打包后base64编码（embedding_b64字段），比JSON浮点数组小约3/4，解码后直接得到array('f')
+- 写入先写临时文件，完成后再改名，中断的阶段不会留下半个缓存
+
+嵌入阶段的缓存每行是一条经历及其chunk:
+    {"experience": {...}, "chunks": [{"chunk_id": ..., "full_text": ..., "embedding_b64": ...}]}
+"""
+import base64
+import io
+import json
+import os
+import sys
+from array import array
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Any, Iterable, Iterator, List, Tuple
+
+try:
+    from .records import ChunkRecord, pack_vector
+except ImportError:
+    from records import ChunkRecord, pack_vector
+
+
+def cache_path(cache_dir: Path, name: str, compress: bool = False) -> Path:
+    """
+    流式缓存文件路径
+
+    Args:
+        cache_dir: 缓存目录
+        name: 缓存名称（不含扩展名）
+        compress: 是否使用zstd压缩
+
+    Returns:
+        <name>.jsonl 或 <name>.jsonl.zst
+    """
+    return Path(cache_dir) / (f"{name}.jsonl.zst" if compress else f"{name}.jsonl")
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("读写 .zst 缓存需要安装zstandard: pip install zstandard") from e
+    return zstandard
+
+
+def open_jsonl(path: Path, mode: str = "r"):
+    """
+    以文本方式打开JSONL文件（.zst后缀自动压缩/解压）
+
+    Args:
+        path: 文件路径
+        mode: "r" 或 "w"
+
+    Returns:
+        文本文件对象
+    """
+    path = Path(path)
+    if path.suffix != ".zst":
+        return open(path, mode, encoding="utf-8")
+
+    zstandard = _zstandard()
+    raw = open(path, mode + "b")
+    if mode == "w":
+        stream = zstandard.ZstdCompressor(level=3).stream_writer(raw)
+    else:
+        stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+    return io.TextIOWrapper(stream, encoding="utf-8")
+
+
+def iter_jsonl(path: Path) -> Iterator[Dict[str, Any]]:
+    """
+    逐行读取JSONL
+
+    Args:
+        path: 文件路径
+
+    Yields:
+        每行解析后的对象
+    """
+    with open_jsonl(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_jsonl(path: Path, records: Iterable[Dict[str, Any]]) -> int:
+    """
+    逐条写入JSONL（写完后原子替换目标文件）
+
+    Args:
+        path: 文件路径
+        records: 对象的可迭代序列（可以是生成器）
+
+    Returns:
+        写入的行数
+    """
+    path = Path(path)
+    # 临时文件保留原后缀，open_jsonl按后缀决定是否压缩
+    tmp = path.with_name(f".tmp-{path.name}")
+    count = 0
+    try:
+        with open_jsonl(tmp, "w") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False))
+                f.write("\n")
+                count += 1
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, path)
+    return count
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    """按固定大小分批（最后一批可能不足size）"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def encode_vector(vector) -> str:
+    """
+    把向量编码为base64（float32，小端字节序）
+
+    Args:
+        vector: 向量
+
+    Returns:
+        base64字符串
+    """
+    packed = pack_vector(vector)
+    if sys.byteorder != "little":
+        packed = array("f", packed)
+        packed.byteswap()
+    return base64.b64encode(packed.tobytes()).decode("ascii")
+
+
+def decode_vector(data: str) -> array:
+    """
+    解码encode_vector的结果
+
+    Args:
+        data: base64字符串
+
+    Returns:
+        array('f')
+    """
+    vector = array("f")
+    vector.frombytes(base64.b64decode(data))
+    if sys.byteorder != "little":
+        vector.byteswap()
+    return vector
+
+
+def experience_record(experience: Dict[str, Any], chunks: List[ChunkRecord]) -> Dict[str, Any]:
+    """
+    组装嵌入阶段缓存的一行（经历 + 其chunk）
+
+    Args:
+        experience: 经历（需包含experience_id）
+        chunks: 该经历的chunk记录
+
+    Returns:
+        可写入JSONL的对象
+    """
+    return {
+        "experience": experience,
+        "chunks": [
+            {
+                "chunk_id": chunk.chunk_id,
+                "full_text": chunk.full_text,
+                "embedding_b64": encode_vector(chunk.embedding),
+            }
+            for chunk in chunks
+        ],
+    }
+
+
+def parse_experience_record(record: Dict[str, Any]) -> Tuple[Dict[str, Any], List[ChunkRecord]]:
+    """
+    解析嵌入阶段缓存的一行
+
+    Args:
+        record: experience_record 写出的对象
+
+    Returns:
+        (经历, chunk记录列表)
+    """
+    experience = record["experience"]
+    chunks = [
+        ChunkRecord(
+            chunk_id=item["chunk_id"],
+            experience_id=experience["experience_id"],
+            full_text=item.get("full_text", ""),
+            embedding=decode_vector(item.get("embedding_b64", "")),
+        )
+        for item in record.get("chunks", [])
+    ]
+    return experience, chunks
+
+
+def iter_experience_chunks(path: Path) -> Iterator[Tuple[Dict[str, Any], List[ChunkRecord]]]:
+    """
+    逐条读取嵌入阶段缓存
+
+    Args:
+        path: 缓存文件路径
+
+    Yields:
+        (经历, chunk记录列表)
+    """
+    for record in iter_jsonl(path):
+        yield parse_experience_record(record)
@@ -0,0 +1,452 @@
+"""
+指标模块：计数器、直方图和耗时span，支持导出Prometheus文本格式或JSON摘要
+
+默认关闭（METRICS_ENABLED=false），此时 get_metrics() 返回空实现，
+各组件中的埋点调用只是空方法调用，不做任何记录。
+
+用法:
+    metrics = get_metrics()
+    metrics.counter("embeddings_total", "生成的向量数").inc(len(texts), model=model)
+    with metrics.span("build_stage", stage="embed"):
+        ...
+    with metrics.api_call("embeddings", model) as call:
+        response = client.embeddings.create(...)
+        call.record_usage(response.usage)
+"""
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Tuple
+
+# 默认直方图桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# ES took 的直方图桶（毫秒）
+MILLISECOND_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _label_key(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = key + extra
+    if not items:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in items
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _summary_key(key: Tuple[Tuple[str, str], ...]) -> str:
+    return ",".join(f"{name}={value}" for name, value in key) or "_"
+
+
+class Counter:
+    """单调递增计数器（按标签分组）"""
+
+    def __init__(self, name: str, help_text: str = ""):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """指定标签的当前值"""
+        return self._values.get(_label_key(labels), 0)
+
+    def total(self) -> float:
+        """所有标签的合计"""
+        return sum(self._values.values())
+
+    def to_prometheus(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+    def summary(self) -> Dict[str, float]:
+        return {_summary_key(key): value for key, value in sorted(self._values.items())}
+
+
+class Histogram:
+    """分桶直方图（按标签分组），分位数由桶边界线性插值估计"""
+
+    def __init__(self, name: str, help_text: str = "", buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            index = len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    index = i
+                    break
+            series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(_label_key(labels))
+        return series["count"] if series else 0
+
+    def _quantile(self, series: Dict[str, Any], q: float) -> float:
+        target = q * series["count"]
+        cumulative = 0
+        lower = 0.0
+        for i, count in enumerate(series["counts"]):
+            upper = self.buckets[i] if i < len(self.buckets) else math.inf
+            if count and cumulative + count >= target:
+                if math.isinf(upper):
+                    return lower
+                return lower + (upper - lower) * (target - cumulative) / count
+            cumulative += count
+            lower = upper if not math.isinf(upper) else lower
+        return lower
+
+    def to_prometheus(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series["counts"]):
+                cumulative += count
+                le = "+Inf" if math.isinf(bound) else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for key, series in sorted(self._series.items()):
+            count = series["count"]
+            result[_summary_key(key)] = {
+                "count": count,
+                "sum": series["sum"],
+                "avg": series["sum"] / count if count else 0.0,
+                "p50": self._quantile(series, 0.50),
+                "p95": self._quantile(series, 0.95),
+                "p99": self._quantile(series, 0.99),
+            }
+        return result
+
+
+class Span:
+    """耗时span：退出时把耗时（秒）记录到 <name>_seconds 直方图，异常时计入 <name>_errors_total"""
+
+    __slots__ = ("registry", "name", "labels", "start", "seconds")
+
+    def __init__(self, registry: "MetricsRegistry", name: str, labels: Dict[str, Any]):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.start = None
+        self.seconds = 0.0
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self.start
+        self.registry.histogram(f"{self.name}_seconds").observe(self.seconds, **self.labels)
+        if exc_type is not None:
+            self.registry.counter(f"{self.name}_errors_total").inc(**self.labels)
+        return False
+
+
+class APICallSpan:
+    """
+    单次模型API调用：记录延迟、结果状态（ok/error/429）和token用量
+
+    429通过异常的status_code识别；token用量由调用方在拿到响应后通过record_usage传入。
+    """
+
+    __slots__ = ("registry", "endpoint", "model", "start")
+
+    def __init__(self, registry: "MetricsRegistry", endpoint: str, model: str):
+        self.registry = registry
+        self.endpoint = endpoint
+        self.model = model
+        self.start = None
+
+    def __enter__(self) -> "APICallSpan":
+        self.start = time.perf_counter()
+        return self
+
+    def record_usage(self, usage):
+        """
+        记录token用量
+
+        Args:
+            usage: 响应中的usage对象（或dict），可以为None
+        """
+        if usage is None:
+            return
+        get = usage.get if isinstance(usage, dict) else lambda name: getattr(usage, name, None)
+        tokens = self.registry.counter("api_tokens_total", "模型API消耗的token数")
+        prompt = get("prompt_tokens")
+        completion = get("completion_tokens")
+        if prompt:
+            tokens.inc(prompt, endpoint=self.endpoint, model=self.model, direction="in")
+        if completion:
+            tokens.inc(completion, endpoint=self.endpoint, model=self.model, direction="out")
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        if exc_type is None:
+            status = "ok"
+        elif getattr(exc, "status_code", None) == 429:
+            status = "429"
+        else:
+            status = "error"
+        self.registry.histogram("api_request_seconds", "模型API调用延迟").observe(
+            seconds, endpoint=self.endpoint, model=self.model
+        )
+        self.registry.counter("api_requests_total", "模型API调用次数").inc(
+            endpoint=self.endpoint, model=self.model, status=status
+        )
+        return False
+
+
+class MetricsRegistry:
+    """指标注册表：按名称获取或创建指标，并负责导出"""
+
+    enabled = True
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = cls(name, *args)
+        return metric
+
+    def counter(self, name: str, help_text: str = "") -> Counter:
+        return self._get_or_create(Counter, name, help_text)
+
+    def histogram(self, name: str, help_text: str = "", buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, buckets)
+
+    def span(self, name: str, **labels) -> Span:
+        return Span(self, name, labels)
+
+    def api_call(self, endpoint: str, model: str) -> APICallSpan:
+        return APICallSpan(self, endpoint, model)
+
+    def cache_lookup(self, cache: str, hit: bool):
+        """记录一次缓存查询（命中率在摘要中计算）"""
+        self.counter("cache_requests_total", "缓存查询次数").inc(cache=cache, result="hit" if hit else "miss")
+
+    def http_client(self, **kwargs):
+        """
+        返回带响应钩子的httpx客户端，用于统计SDK内部的重试和429
+
+        OpenAI SDK在重试请求上带有 x-stainless-retry-count 头，据此区分首次请求和重试。
+
+        Args:
+            **kwargs: 传给httpx客户端的其他参数（如连接池limits）
+        """
+        from openai import DefaultHttpxClient
+
+        def on_response(response):
+            endpoint = response.request.url.path.rsplit("/", 1)[-1]
+            if response.status_code == 429:
+                self.counter("api_rate_limited_total", "模型API返回429的次数").inc(endpoint=endpoint)
+            retry_count = response.request.headers.get("x-stainless-retry-count", "0")
+            if retry_count.isdigit() and int(retry_count) > 0:
+                self.counter("api_retries_total", "模型API重试次数").inc(endpoint=endpoint, source="sdk")
+
+        return DefaultHttpxClient(event_hooks={"response": [on_response]}, **kwargs)
+
+    def to_prometheus(self) -> str:
+        """导出为Prometheus文本格式"""
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].to_prometheus())
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        导出JSON摘要：计数器、直方图分位数，以及由计数器推导的速率和命中率
+
+        Returns:
+            摘要字典
+        """
+        counters = {}
+        histograms = {}
+        for name, metric in sorted(self._metrics.items()):
+            if isinstance(metric, Counter):
+                counters[name] = metric.summary()
+            else:
+                histograms[name] = metric.summary()
+
+        derived = {}
+        # 各构建阶段吞吐：build_stage_items_total / build_stage_seconds
+        stage_items = self._metrics.get("build_stage_items_total")
+        stage_seconds = self._metrics.get("build_stage_seconds")
+        if stage_items is not None and stage_seconds is not None:
+            for key, seconds in stage_seconds.summary().items():
+                items = stage_items.summary().get(key, 0)
+                derived[f"{key}_items_per_sec"] = items / seconds["sum"] if seconds["sum"] else 0.0
+        # 嵌入吞吐按嵌入阶段的墙钟时间计算（阶段内可能并发调用API）
+        embeddings = self._metrics.get("embeddings_total")
+        if embeddings is not None and stage_seconds is not None:
+            seconds = stage_seconds.summary().get("stage=embed", {}).get("sum", 0.0)
+            derived["embeddings_per_sec"] = embeddings.total() / seconds if seconds else 0.0
+        bulk_docs = self._metrics.get("es_bulk_docs_total")
+        bulk_seconds = self._metrics.get("es_bulk_seconds")
+        if bulk_docs is not None and bulk_seconds is not None:
+            seconds = sum(series["sum"] for series in bulk_seconds.summary().values())
+            indexed = sum(value for key, value in bulk_docs._values.items() if ("result", "ok") in key)
+            derived["es_bulk_docs_per_sec"] = indexed / seconds if seconds else 0.0
+        # 缓存命中率
+        cache = self._metrics.get("cache_requests_total")
+        if cache is not None:
+            totals = {}
+            for (labels, value) in cache._values.items():
+                labels = dict(labels)
+                entry = totals.setdefault(labels["cache"], [0, 0])
+                entry[0 if labels["result"] == "hit" else 1] += value
+            for name, (hits, misses) in totals.items():
+                derived[f"cache={name}_hit_rate"] = hits / (hits + misses) if hits + misses else 0.0
+
+        return {"counters": counters, "histograms": histograms, "derived": derived}
+
+    def export(self, path) -> Path:
+        """
+        写出指标文件：.prom/.txt 为Prometheus文本格式，其他后缀为JSON摘要
+
+        Args:
+            path: 输出路径
+
+        Returns:
+            输出路径
+        """
+        path = Path(path)
+        if path.suffix in (".prom", ".txt"):
+            path.write_text(self.to_prometheus(), encoding="utf-8")
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+        return path
+
+
+class _NoopMetric:
+    """空指标：所有记录方法都不做任何事"""
+
+    __slots__ = ()
+
+    def inc(self, amount: float = 1, **labels):
+        pass
+
+    def observe(self, value: float, **labels):
+        pass
+
+    def record_usage(self, usage):
+        pass
+
+    def value(self, **labels) -> float:
+        return 0
+
+    def count(self, **labels) -> int:
+        return 0
+
+    def total(self) -> float:
+        return 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_METRIC = _NoopMetric()
+
+
+class NoopMetrics:
+    """关闭指标时使用的空实现，接口与MetricsRegistry相同"""
+
+    enabled = False
+
+    def counter(self, name: str, help_text: str = ""):
+        return _NOOP_METRIC
+
+    def histogram(self, name: str, help_text: str = "", buckets=DEFAULT_BUCKETS):
+        return _NOOP_METRIC
+
+    def span(self, name: str, **labels):
+        return _NOOP_METRIC
+
+    def api_call(self, endpoint: str, model: str):
+        return _NOOP_METRIC
+
+    def cache_lookup(self, cache: str, hit: bool):
+        pass
+
+    def http_client(self, **kwargs):
+        # 没有额外参数时返回None，表示使用SDK默认的httpx客户端
+        if not kwargs:
+            return None
+        from openai import DefaultHttpxClient
+        return DefaultHttpxClient(**kwargs)
+
+    def to_prometheus(self) -> str:
+        return ""
+
+    def summary(self) -> Dict[str, Any]:
+        return {"counters": {}, "histograms": {}, "derived": {}}
+
+    def export(self, path):
+        return None
+
+
+_metrics = None
+
+
+def configure_metrics(enabled: bool = None):
+    """
+    初始化全局指标注册表
+
+    Args:
+        enabled: 是否启用，None时读取环境变量METRICS_ENABLED（默认false）
+
+    Returns:
+        全局指标注册表
+    """
+    global _metrics
+    if enabled is None:
+        enabled = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+    _metrics = MetricsRegistry() if enabled else NoopMetrics()
+    return _metrics
+
+
+def get_metrics():
+    """获取全局指标注册表（首次调用时按环境变量初始化）"""
+    if _metrics is None:
+        return configure_metrics()
+    return _metrics
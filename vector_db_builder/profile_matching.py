@@ -0,0 +1,244 @@
+"""
+多维度画像匹配：用户的多个困境（职业、健康、人际……）一次性匹配到名人
+
+各维度文本在一次嵌入请求中生成向量，所有维度的候选经历在一次_msearch中检索，
+然后用NumPy聚合得分：
+    - 经历得分：同一经历的多个chunk取最大相似度（max-sim），再按维度权重加权求和
+    - 名人得分：每个维度取该名人最匹配的经历，再按维度权重加权求和，
+      同时覆盖多个维度的名人排在只匹配单一维度的名人之前
+"""
+import os
+from typing import List, Dict, Any, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+try:
+    from .text_processing import TextProcessor
+    from .elasticsearch_setup import ElasticsearchSetup
+except ImportError:
+    from text_processing import TextProcessor
+    from elasticsearch_setup import ElasticsearchSetup
+
+
+Facet = Union[str, Tuple[str, float]]
+
+
+def normalize_facets(facets: Sequence[Facet]) -> Tuple[List[str], np.ndarray]:
+    """
+    解析画像维度，去掉空文本并把权重归一化为和为1
+
+    Args:
+        facets: 维度列表，每项为文本或 (文本, 权重)，只给文本时权重为1
+
+    Returns:
+        (维度文本列表, 归一化权重数组)
+    """
+    texts, weights = [], []
+    for facet in facets:
+        text, weight = (facet, 1.0) if isinstance(facet, str) else facet
+        if not text or not text.strip():
+            continue
+        if weight < 0:
+            raise ValueError(f"维度权重不能为负数: {text} ({weight})")
+        texts.append(text.strip())
+        weights.append(float(weight))
+
+    if not texts:
+        raise ValueError("至少需要一个非空的画像维度")
+    weights = np.asarray(weights, dtype=np.float32)
+    total = weights.sum()
+    if total <= 0:
+        raise ValueError("维度权重之和必须大于0")
+    return texts, weights / total
+
+
+def aggregate_matches(results: List[Optional[dict]], weights: np.ndarray, size: int = 10,
+                      experiences_per_celebrity: int = 3) -> List[Dict[str, Any]]:
+    """
+    把各维度的检索结果聚合为名人排名
+
+    Args:
+        results: 每个维度的搜索结果（与weights一一对应，失败的位置为None）
+        weights: 归一化的维度权重
+        size: 返回的名人数量
+        experiences_per_celebrity: 每个名人附带的支撑经历数量
+
+    Returns:
+        名人列表（按得分降序），每项包含总分、各维度得分和支撑经历
+    """
+    num_facets = len(weights)
+    experience_columns: Dict[str, int] = {}
+    experience_ids: List[str] = []
+    sources: List[Dict[str, Any]] = []
+    rows, columns, scores = [], [], []
+    for facet, result in enumerate(results):
+        if not result or "hits" not in result:
+            continue
+        for hit in result["hits"]["hits"]:
+            source = hit.get("_source", {})
+            # flat/compact布局的命中是chunk，按经历ID合并；nested布局直接是经历文档
+            experience_id = source.get("experience_id") or hit["_id"]
+            column = experience_columns.get(experience_id)
+            if column is None:
+                column = experience_columns[experience_id] = len(sources)
+                experience_ids.append(experience_id)
+                sources.append(source)
+            rows.append(facet)
+            columns.append(column)
+            scores.append(hit.get("_score") or 0.0)
+
+    if not sources:
+        return []
+
+    # 维度 × 经历 的得分矩阵，同一经历的多个chunk取最大值
+    experience_matrix = np.zeros((num_facets, len(sources)), dtype=np.float32)
+    np.maximum.at(experience_matrix, (np.asarray(rows), np.asarray(columns)),
+                  np.asarray(scores, dtype=np.float32))
+    experience_scores = weights @ experience_matrix
+
+    # 维度 × 名人 的得分矩阵：每个维度取该名人最匹配的经历
+    celebrity_names = [source.get("celebrity_name_en", "") for source in sources]
+    celebrities, owners = np.unique(np.asarray(celebrity_names, dtype=object), return_inverse=True)
+    celebrity_matrix = np.zeros((num_facets, len(celebrities)), dtype=np.float32)
+    np.maximum.at(
+        celebrity_matrix,
+        (np.arange(num_facets)[:, None], np.broadcast_to(owners, experience_matrix.shape)),
+        experience_matrix,
+    )
+    celebrity_scores = weights @ celebrity_matrix
+
+    ranked = np.argsort(-celebrity_scores, kind="stable")[:size]
+    # 经历按得分降序排列一次，之后按名人分组取前几条
+    experience_order = np.argsort(-experience_scores, kind="stable")
+
+    matches = []
+    for celebrity in ranked.tolist():
+        columns_of_celebrity = experience_order[owners[experience_order] == celebrity]
+        experiences = []
+        for column in columns_of_celebrity[:experiences_per_celebrity].tolist():
+            experiences.append({
+                "experience_id": experience_ids[column],
+                "score": float(experience_scores[column]),
+                "best_facet": int(np.argmax(experience_matrix[:, column])),
+                "facet_scores": experience_matrix[:, column].tolist(),
+                "source": sources[column],
+            })
+        first = sources[columns_of_celebrity[0]]
+        matches.append({
+            "celebrity_name_en": celebrities[celebrity],
+            "celebrity_name_cn": first.get("celebrity_name_cn", ""),
+            "profession": first.get("profession", ""),
+            "score": float(celebrity_scores[celebrity]),
+            "facet_scores": celebrity_matrix[:, celebrity].tolist(),
+            "facets_covered": int(np.count_nonzero(celebrity_matrix[:, celebrity])),
+            "experiences": experiences,
+        })
+    return matches
+
+
+class ProfileMatcher:
+    def __init__(self, text_processor: TextProcessor = None, es_setup: ElasticsearchSetup = None,
+                 index_name: str = None):
+        """
+        初始化画像匹配器
+
+        Args:
+            text_processor: 文本处理器，默认创建启用对冲请求的TextProcessor
+            es_setup: ElasticSearch设置，默认使用环境变量中的地址和布局
+            index_name: 索引名称，默认从环境变量ELASTICSEARCH_INDEX读取
+        """
+        self.text_processor = text_processor or TextProcessor(hedge=True, budget_stage="query")
+        self.es_setup = es_setup or ElasticsearchSetup()
+        self.index_name = index_name or os.getenv("ELASTICSEARCH_INDEX", "celebrity_experiences")
+
+    def match(self, facets: Sequence[Facet], size: int = 10, candidates_per_facet: int = 50,
+              experiences_per_celebrity: int = 3, filter_query: dict = None) -> List[Dict[str, Any]]:
+        """
+        按多维度画像匹配名人
+
+        Args:
+            facets: 维度列表，每项为文本或 (文本, 权重)
+            size: 返回的名人数量
+            candidates_per_facet: 每个维度检索的候选数量（flat/compact布局为chunk数）
+            experiences_per_celebrity: 每个名人附带的支撑经历数量
+            filter_query: 过滤条件（作用于所有维度）
+
+        Returns:
+            名人列表（按得分降序），见aggregate_matches
+        """
+        texts, weights = normalize_facets(facets)
+
+        embeddings = self.text_processor.get_embeddings(texts)
+        failed = [text for text, embedding in zip(texts, embeddings) if not embedding]
+        if failed:
+            print(f"警告: {len(failed)} 个维度生成向量失败，不参与匹配: {failed}")
+        valid = [i for i, embedding in enumerate(embeddings) if embedding]
+        if not valid:
+            return []
+
+        results = self.es_setup.multi_vector_search(
+            self.index_name, [embeddings[i] for i in valid], size=candidates_per_facet,
+            filter_query=filter_query,
+        )
+        # 失败的维度没有命中，得分为0，保持各维度在结果中的位置不变
+        facet_results: List[Optional[dict]] = [None] * len(texts)
+        for i, result in zip(valid, results):
+            facet_results[i] = result
+        return aggregate_matches(facet_results, weights, size=size,
+                                 experiences_per_celebrity=experiences_per_celebrity)
+
+
+def print_profile_matches(matches: List[Dict[str, Any]], texts: List[str]):
+    """
+    打印画像匹配结果
+
+    Args:
+        matches: ProfileMatcher.match的结果
+        texts: 维度文本（用于标注各经历最匹配的维度）
+    """
+    print(f"\n匹配到 {len(matches)} 位名人\n")
+    for i, match in enumerate(matches, 1):
+        print(f"{'='*60}")
+        print(f"{i}. {match['celebrity_name_cn']} ({match['celebrity_name_en']}) "
+              f"得分: {match['score']:.4f}，覆盖 {match['facets_covered']}/{len(texts)} 个维度")
+        print(f"{'='*60}")
+        print(f"职业: {match['profession']}")
+        for experience in match["experiences"]:
+            source = experience["source"]
+            print(f"  - [{texts[experience['best_facet']]}] ({experience['score']:.4f}) "
+                  f"{source.get('event_summary', '')}")
+            if source.get("coping_strategy"):
+                print(f"    应对策略: {source['coping_strategy']}")
+        print()
+
+
+def main():
+    """命令行入口"""
+    import argparse
+
+    try:
+        from .config import load_env
+    except ImportError:
+        from config import load_env
+    load_env()
+
+    parser = argparse.ArgumentParser(description="按多维度画像匹配名人经历")
+    parser.add_argument("--facet", nargs=2, action="append", metavar=("TEXT", "WEIGHT"), required=True,
+                        help="画像维度及权重，可重复（例如：--facet 创业融资困难 2 --facet 长期失眠 1）")
+    parser.add_argument("--size", type=int, default=10, help="返回的名人数量")
+    parser.add_argument("--candidates", type=int, default=50, help="每个维度检索的候选数量")
+    parser.add_argument("--experiences", type=int, default=3, help="每个名人附带的支撑经历数量")
+    parser.add_argument("--tags", type=str, nargs="+", help="标签过滤条件")
+    args = parser.parse_args()
+
+    facets = [(text, float(weight)) for text, weight in args.facet]
+    filter_query = {"terms": {"tags": args.tags}} if args.tags else None
+    matches = ProfileMatcher().match(
+        facets, size=args.size, candidates_per_facet=args.candidates,
+        experiences_per_celebrity=args.experiences, filter_query=filter_query,
+    )
+    print_profile_matches(matches, normalize_facets(facets)[0])
+
+
+if __name__ == "__main__":
+    main()
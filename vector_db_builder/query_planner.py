@@ -0,0 +1,270 @@
+"""
+过滤感知的kNN查询规划：按过滤条件的选择性自适应选择 k / num_candidates
+
+固定的 num_candidates = size * 10 对无过滤查询偏大，而过滤条件很有选择性时（如冷门标签），
+HNSW在候选池中找不到足够多满足过滤的文档，返回的结果少于size。这里：
+    - 用一次 size=0 的terms聚合统计 tags/profession/challenge_type/celebrity_name_en 各取值的文档数，
+      按索引缓存（QUERY_PLANNER_STATS_TTL秒）
+    - 按统计估算过滤条件命中的文档比例（term/terms求和，bool.filter各子句相乘，must_not取补，
+      无法估算的子句按1处理，即偏向保守的kNN）
+    - 预计命中的文档数不超过 QUERY_PLANNER_EXACT_MAX_DOCS 时改用script_score精确检索（只对过滤后的子集打分）
+    - 否则 num_candidates = size * QUERY_PLANNER_CANDIDATE_FACTOR / 选择性（上限10000）
+    - 返回结果少于预期时扩大候选池重试一次，仍不足则回退到精确检索
+"""
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple
+
+try:
+    from .elasticsearch_setup import ElasticsearchSetup
+except ImportError:
+    from elasticsearch_setup import ElasticsearchSetup
+
+
+# 参与统计的keyword字段
+STATS_FIELDS = ("tags", "profession", "challenge_type", "celebrity_name_en")
+# ES的num_candidates上限
+MAX_NUM_CANDIDATES = 10000
+# 结果不足时候选池的扩大倍数
+WIDEN_FACTOR = 4
+
+EXACT = "exact"
+KNN = "knn"
+
+
+@dataclass
+class FilterStats:
+    """索引的过滤字段统计"""
+    total: int
+    counts: Dict[str, Dict[str, int]]
+    # 各字段聚合未覆盖到的文档数（sum_other_doc_count），非0时未统计到的取值按最小的已统计取值估算
+    other: Dict[str, int]
+    fetched_at: float
+
+
+@dataclass
+class QueryPlan:
+    """一次向量检索的执行计划"""
+    strategy: str
+    k: int
+    num_candidates: int
+    selectivity: float
+    expected_matches: int
+
+
+def _terms_values(clause: dict) -> Tuple[Optional[str], List[Any]]:
+    """解析term/terms子句，返回 (字段, 取值列表)，不是term/terms时字段为None"""
+    for kind in ("term", "terms"):
+        if kind in clause:
+            field, value = next(iter(clause[kind].items()))
+            if isinstance(value, dict):
+                value = value.get("value")
+            return field, value if isinstance(value, list) else [value]
+    return None, []
+
+
+def estimate_selectivity(filter_query: Optional[dict], stats: FilterStats) -> float:
+    """
+    估算过滤条件命中的文档比例
+
+    Args:
+        filter_query: 过滤条件（term/terms/bool，或子句列表）
+        stats: 过滤字段统计
+
+    Returns:
+        0~1之间的比例，无法估算时返回1.0
+    """
+    if not filter_query or not stats.total:
+        return 1.0
+    if isinstance(filter_query, list):
+        return math.prod(estimate_selectivity(clause, stats) for clause in filter_query)
+
+    field, values = _terms_values(filter_query)
+    if field is not None:
+        if field not in stats.counts:
+            return 1.0
+        counts = stats.counts[field]
+        # 聚合没覆盖到的取值最多只有 sum_other_doc_count 个文档，不会超过最小的已统计取值
+        unseen = min(counts.values(), default=0) if stats.other.get(field) else 0
+        matched = sum(counts.get(value, unseen) for value in values)
+        return min(matched / stats.total, 1.0)
+
+    if "bool" in filter_query:
+        selectivity = 1.0
+        for key in ("filter", "must"):
+            clauses = filter_query["bool"].get(key)
+            if clauses:
+                selectivity *= estimate_selectivity(clauses, stats)
+        must_not = filter_query["bool"].get("must_not")
+        if must_not:
+            for clause in must_not if isinstance(must_not, list) else [must_not]:
+                selectivity *= 1.0 - estimate_selectivity(clause, stats)
+        should = filter_query["bool"].get("should")
+        if should:
+            should = should if isinstance(should, list) else [should]
+            selectivity *= min(sum(estimate_selectivity(clause, stats) for clause in should), 1.0)
+        return selectivity
+
+    return 1.0
+
+
+class QueryPlanner:
+    # 进程内共享的统计缓存：索引名 -> FilterStats
+    _stats_cache: Dict[str, FilterStats] = {}
+    _stats_lock = threading.Lock()
+
+    def __init__(self, es_setup: ElasticsearchSetup = None, index_name: str = None):
+        """
+        初始化查询规划器
+
+        Args:
+            es_setup: ElasticSearch设置，默认使用环境变量中的地址和布局
+            index_name: 索引名称，默认从环境变量ELASTICSEARCH_INDEX读取
+        """
+        self.es_setup = es_setup or ElasticsearchSetup()
+        self.index_name = index_name or os.getenv("ELASTICSEARCH_INDEX", "celebrity_experiences")
+        self.stats_ttl = float(os.getenv("QUERY_PLANNER_STATS_TTL", "300"))
+        self.exact_max_docs = int(os.getenv("QUERY_PLANNER_EXACT_MAX_DOCS", "2000"))
+        self.candidate_factor = int(os.getenv("QUERY_PLANNER_CANDIDATE_FACTOR", "5"))
+
+    def stats(self, refresh: bool = False) -> Optional[FilterStats]:
+        """
+        获取过滤字段统计（按TTL缓存）
+
+        Args:
+            refresh: 是否忽略缓存重新统计
+
+        Returns:
+            统计结果，统计失败时返回None
+        """
+        with self._stats_lock:
+            cached = self._stats_cache.get(self.index_name)
+        if cached and not refresh and time.time() - cached.fetched_at < self.stats_ttl:
+            return cached
+
+        aggs = {field: {"terms": {"field": field, "size": 1000}} for field in STATS_FIELDS}
+        result = self.es_setup.search(
+            self.index_name, {"query": {"match_all": {}}, "aggs": aggs, "track_total_hits": True}, size=0
+        )
+        if not result or "aggregations" not in result:
+            print("获取过滤字段统计失败，按无过滤规划")
+            return None
+
+        total = result["hits"]["total"]
+        stats = FilterStats(
+            total=total["value"] if isinstance(total, dict) else int(total),
+            counts={
+                field: {bucket["key"]: bucket["doc_count"] for bucket in agg["buckets"]}
+                for field, agg in result["aggregations"].items()
+            },
+            other={field: agg.get("sum_other_doc_count", 0) for field, agg in result["aggregations"].items()},
+            fetched_at=time.time(),
+        )
+        with self._stats_lock:
+            self._stats_cache[self.index_name] = stats
+        return stats
+
+    def plan(self, size: int, filter_query: dict = None) -> QueryPlan:
+        """
+        为一次向量检索选择执行策略
+
+        Args:
+            size: 返回结果数量
+            filter_query: 过滤条件
+
+        Returns:
+            执行计划
+        """
+        base_candidates = size * self.candidate_factor
+        stats = self.stats() if filter_query else None
+        if stats is None:
+            return QueryPlan(KNN, size, min(max(base_candidates, size), MAX_NUM_CANDIDATES), 1.0, -1)
+
+        selectivity = estimate_selectivity(filter_query, stats)
+        expected = int(math.ceil(selectivity * stats.total))
+        if expected <= self.exact_max_docs:
+            return QueryPlan(EXACT, size, 0, selectivity, expected)
+
+        # 过滤后HNSW图中满足条件的邻居按比例变少，候选池按选择性的倒数放大
+        num_candidates = int(math.ceil(base_candidates / max(selectivity, 1e-6)))
+        num_candidates = min(max(num_candidates, size), MAX_NUM_CANDIDATES)
+        return QueryPlan(KNN, size, num_candidates, selectivity, expected)
+
+    def search(self, embedding: list, size: int = 10, filter_query: dict = None, **kwargs) -> dict:
+        """
+        按计划执行向量检索，结果不足时扩大候选池重试
+
+        Args:
+            embedding: 查询向量
+            size: 返回结果数量
+            filter_query: 过滤条件
+            **kwargs: 透传给vector_search（如include_vectors）
+
+        Returns:
+            搜索结果
+        """
+        plan = self.plan(size, filter_query)
+        plans = self.es_setup.metrics.counter("query_plans_total", "向量检索的执行策略")
+        if plan.strategy == EXACT:
+            plans.inc(strategy=EXACT)
+            return self.es_setup.exact_vector_search(self.index_name, embedding, size, filter_query)
+
+        plans.inc(strategy=KNN)
+        result = self.es_setup.vector_search(
+            self.index_name, embedding, size=size, filter_query=filter_query,
+            num_candidates=plan.num_candidates, **kwargs
+        )
+        # 预计命中不足size时（或无法估算）以size为期望
+        wanted = size if plan.expected_matches < 0 else min(size, plan.expected_matches)
+        if not filter_query or self._hit_count(result) >= wanted:
+            return result
+
+        if plan.num_candidates < MAX_NUM_CANDIDATES:
+            plans.inc(strategy="widened")
+            widened = min(plan.num_candidates * WIDEN_FACTOR, MAX_NUM_CANDIDATES)
+            result = self.es_setup.vector_search(
+                self.index_name, embedding, size=size, filter_query=filter_query,
+                num_candidates=widened, **kwargs
+            )
+            if self._hit_count(result) >= wanted:
+                return result
+
+        plans.inc(strategy="exact_fallback")
+        exact = self.es_setup.exact_vector_search(self.index_name, embedding, size, filter_query)
+        return exact if self._hit_count(exact) > self._hit_count(result) else result
+
+    def hybrid_search(self, query_text: str, embedding: list, size: int = 10,
+                      filter_query: dict = None, **kwargs) -> dict:
+        """
+        按计划的候选数执行混合检索（kNN + 关键词）
+
+        混合检索的kNN部分不能换成script_score，精确策略下把候选池设为预计命中的文档数，
+        对很小的过滤子集同样是精确的。
+
+        Args:
+            query_text: 查询文本
+            embedding: 查询向量
+            size: 返回结果数量
+            filter_query: 过滤条件
+            **kwargs: 透传给hybrid_search（如vector_boost、keyword_boost）
+
+        Returns:
+            搜索结果
+        """
+        plan = self.plan(size, filter_query)
+        num_candidates = plan.num_candidates
+        if plan.strategy == EXACT:
+            num_candidates = min(max(plan.expected_matches, size), MAX_NUM_CANDIDATES)
+        self.es_setup.metrics.counter("query_plans_total", "向量检索的执行策略").inc(strategy="hybrid")
+        return self.es_setup.hybrid_search(
+            self.index_name, query_text, embedding, size=size, filter_query=filter_query,
+            num_candidates=num_candidates, **kwargs
+        )
+
+    @staticmethod
+    def _hit_count(result: Optional[dict]) -> int:
+        """搜索结果中的命中数"""
+        return len(result["hits"]["hits"]) if result and "hits" in result else 0
@@ -0,0 +1,310 @@
+"""
+限流模块：按 API端点 + 模型 共享的自适应限流器
+
+- 并发度采用AIMD控制：请求成功时并发上限加性增长（每个窗口约+1），
+  遇到429/5xx/连接错误时乘性减半（同一拥塞窗口内只减半一次）
+- 遵守Retry-After：收到后该限流器上的所有请求暂停到指定时间
+- 每分钟请求数（RPM）和每分钟token数（TPM）分别用令牌桶限制
+- 限流器负责重试，OpenAI客户端应设置max_retries=0
+
+配置（环境变量）:
+    RATE_LIMIT_RPM / RATE_LIMIT_TPM                 默认的RPM/TPM上限，未设置表示不限
+    RATE_LIMIT_CONCURRENCY                          初始并发度（默认4）
+    RATE_LIMIT_MAX_CONCURRENCY                      并发上限（默认16），也是各阶段线程池的大小
+    RATE_LIMITS                                     按模型覆盖，JSON，如 {"openai/gpt-4o-mini": {"rpm": 500, "tpm": 200000}}
+"""
+import json
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional, Any
+
+try:
+    from .metrics import get_metrics
+except ImportError:
+    from metrics import get_metrics
+
+
+# 视为服务端过载、需要降低并发的连接类异常（按类名判断，避免依赖具体SDK）
+CONNECTION_ERRORS = ("APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout", "ConnectTimeout")
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    从异常携带的响应中读取Retry-After（支持秒数、HTTP日期和retry-after-ms）
+
+    Args:
+        error: API异常
+
+    Returns:
+        等待秒数，没有该响应头时返回None
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_throttling_error(error: Exception) -> bool:
+    """429、5xx和连接错误：可重试，并且应当降低并发"""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(error).__name__ in CONNECTION_ERRORS
+
+
+class TokenBucket:
+    """每分钟额度的令牌桶，允许透支（大请求先放行，之后的请求等待补足）"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount: float) -> float:
+        """
+        预留额度，不足时阻塞到额度补足
+
+        Args:
+            amount: 需要的额度
+
+        Returns:
+            等待的秒数
+        """
+        with self._lock:
+            self._refill()
+            available = self.level
+            self.level -= amount
+            wait = max(0.0, (min(amount, self.capacity) - available) / self.rate)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def adjust(self, amount: float):
+        """按实际用量修正额度（正数为补扣，负数为退还），不阻塞"""
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level - amount)
+
+
+class AdaptiveRateLimiter:
+    """单个 端点 + 模型 的限流器"""
+
+    def __init__(self, name: str, rpm: float = None, tpm: float = None,
+                 initial_concurrency: int = 4, max_concurrency: int = 16,
+                 min_concurrency: int = 1, max_attempts: int = 6,
+                 base_backoff: float = 1.0, max_backoff: float = 60.0):
+        """
+        初始化限流器
+
+        Args:
+            name: 名称（用于日志和指标标签）
+            rpm: 每分钟请求数上限，None表示不限
+            tpm: 每分钟token数上限，None表示不限
+            initial_concurrency: 初始并发度
+            max_concurrency: 并发上限
+            min_concurrency: 并发下限
+            max_attempts: 每次调用的最大尝试次数
+            base_backoff: 没有Retry-After时的初始退避秒数（指数增长，带抖动）
+            max_backoff: 退避秒数上限
+        """
+        self.name = name
+        self.max_concurrency = max(max_concurrency, 1)
+        self.min_concurrency = max(min(min_concurrency, self.max_concurrency), 1)
+        self.limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.rpm_bucket = TokenBucket(rpm) if rpm else None
+        self.tpm_bucket = TokenBucket(tpm) if tpm else None
+        self.metrics = get_metrics()
+
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, tokens: int = 0) -> float:
+        """
+        获取一个请求槽位（等待暂停期、并发上限、RPM和TPM额度）
+
+        Args:
+            tokens: 本次请求预计消耗的token数
+
+        Returns:
+            请求开始时间（release时用于判断是否属于已处理过的拥塞窗口）
+        """
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    self._cond.wait(self.blocked_until - now)
+                elif self.in_flight >= int(self.limit):
+                    self._cond.wait()
+                else:
+                    break
+            self.in_flight += 1
+        if self.rpm_bucket is not None:
+            self.rpm_bucket.take(1)
+        if self.tpm_bucket is not None and tokens:
+            self.tpm_bucket.take(tokens)
+        self.metrics.histogram("rate_limit_wait_seconds", "限流器排队等待时间").observe(
+            time.monotonic() - start, limiter=self.name
+        )
+        return time.monotonic()
+
+    def release(self, started: float, outcome: str, retry_after: float = None):
+        """
+        释放槽位并按结果调整并发上限
+
+        Args:
+            started: acquire返回的请求开始时间
+            outcome: ok（加性增长）/ throttled（乘性减半）/ failed（不调整）
+            retry_after: 服务端要求的等待秒数
+        """
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if outcome == "ok":
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            elif outcome == "throttled":
+                # 减半之前发出的请求返回的429属于同一拥塞窗口，不再重复减半
+                if started >= self._last_decrease:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self._last_decrease = now
+                    self.metrics.counter("rate_limit_decreases_total", "限流器并发减半次数").inc(limiter=self.name)
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, now + retry_after)
+            self._cond.notify_all()
+
+    def token_cost(self, text: str) -> int:
+        """
+        估算请求的token数用于TPM预留（未限制TPM时返回0，不做编码）
+
+        Args:
+            text: 请求文本
+
+        Returns:
+            预计token数
+        """
+        if self.tpm_bucket is None:
+            return 0
+        try:
+            from .budget import estimate_tokens
+        except ImportError:
+            from budget import estimate_tokens
+        return estimate_tokens(text)
+
+    def record_tokens(self, estimated: int, actual: int):
+        """
+        请求完成后按实际token数修正TPM额度
+
+        Args:
+            estimated: acquire时预留的token数
+            actual: 实际消耗的token数
+        """
+        if self.tpm_bucket is not None and actual:
+            self.tpm_bucket.adjust(actual - estimated)
+
+    def call(self, fn: Callable[[], Any], tokens: int = 0) -> Any:
+        """
+        在限流下执行一次API调用，对429/5xx/连接错误自动重试
+
+        Args:
+            fn: 无参数的调用函数
+            tokens: 预计消耗的token数（用于TPM）
+
+        Returns:
+            fn的返回值（带usage时按实际token数修正TPM额度）；重试耗尽或遇到不可重试的错误时抛出最后一个异常
+        """
+        for attempt in range(self.max_attempts):
+            started = self.acquire(tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                throttled = is_throttling_error(e)
+                retry_after = retry_after_seconds(e) if throttled else None
+                self.release(started, "throttled" if throttled else "failed", retry_after)
+                if not throttled or attempt == self.max_attempts - 1:
+                    raise
+                self.metrics.counter("api_retries_total", "模型API重试次数").inc(
+                    endpoint=self.name, source="limiter"
+                )
+                if retry_after is None:
+                    # 没有Retry-After时指数退避（带抖动）；有Retry-After时由acquire统一等待
+                    backoff = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+                    time.sleep(backoff * (0.5 + random.random() / 2))
+                continue
+            self.release(started, "ok")
+            usage = getattr(result, "usage", None)
+            self.record_tokens(tokens, getattr(usage, "total_tokens", None) or 0)
+            return result
+
+    def __repr__(self) -> str:
+        return f"AdaptiveRateLimiter({self.name!r}, limit={self.limit:.1f}, in_flight={self.in_flight})"
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _limiter_config(model: str) -> dict:
+    """按环境变量生成某个模型的限流配置"""
+    config = {
+        "rpm": float(os.getenv("RATE_LIMIT_RPM")) if os.getenv("RATE_LIMIT_RPM") else None,
+        "tpm": float(os.getenv("RATE_LIMIT_TPM")) if os.getenv("RATE_LIMIT_TPM") else None,
+        "initial_concurrency": int(os.getenv("RATE_LIMIT_CONCURRENCY", "4")),
+        "max_concurrency": int(os.getenv("RATE_LIMIT_MAX_CONCURRENCY", "16")),
+    }
+    overrides = os.getenv("RATE_LIMITS")
+    if overrides:
+        config.update(json.loads(overrides).get(model, {}))
+    return config
+
+
+def get_rate_limiter(endpoint: str, model: str) -> AdaptiveRateLimiter:
+    """
+    获取 端点 + 模型 对应的共享限流器（同一进程内所有组件共用）
+
+    Args:
+        endpoint: API基础URL
+        model: 模型名称
+
+    Returns:
+        限流器
+    """
+    key = (endpoint.rstrip("/"), model)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                limiter = _limiters[key] = AdaptiveRateLimiter(model, **_limiter_config(model))
+    return limiter
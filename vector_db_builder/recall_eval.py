@@ -0,0 +1,207 @@
+"""
+召回评估模块：精确最近邻基准与Matryoshka截断召回对比
+
+用NumPy暴力计算全维度向量的精确top-k作为基准（相当于一个完全精确的全维度索引），
+再对截断到不同维度的向量计算top-k，比较两者的重合度（recall@k）。
+"""
+import time
+from pathlib import Path
+from typing import List, Dict, Any, Tuple
+
+import numpy as np
+
+try:
+    from .records import load_chunk_cache
+except ImportError:
+    from records import load_chunk_cache
+
+
+def to_matrix(vectors) -> np.ndarray:
+    """
+    将向量列表转换为float32矩阵并做L2归一化
+
+    Args:
+        vectors: 向量列表（长度相同）
+
+    Returns:
+        形状为(n, dims)的归一化矩阵
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def truncate_matrix(matrix: np.ndarray, dims: int) -> np.ndarray:
+    """
+    Matryoshka截断：保留前dims维并重新归一化
+
+    Args:
+        matrix: 归一化向量矩阵
+        dims: 截断维度
+
+    Returns:
+        截断后的归一化矩阵
+    """
+    return to_matrix(matrix[:, :dims])
+
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, k: int,
+                batch_size: int = 1024) -> np.ndarray:
+    """
+    暴力计算精确top-k（内积，输入需已归一化）
+
+    Args:
+        corpus: 语料向量矩阵 (n, dims)
+        queries: 查询向量矩阵 (q, dims)
+        k: 返回的近邻数
+        batch_size: 每批处理的查询数，控制内存占用
+
+    Returns:
+        形状为(q, k)的语料下标矩阵，按相似度降序
+    """
+    k = min(k, corpus.shape[0])
+    results = np.empty((queries.shape[0], k), dtype=np.int64)
+    for start in range(0, queries.shape[0], batch_size):
+        scores = queries[start:start + batch_size] @ corpus.T
+        # argpartition取出top-k后再对这k个排序
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        results[start:start + batch_size] = np.take_along_axis(top, order, axis=1)
+    return results
+
+
+def recall_at_k(ground_truth: np.ndarray, predicted: np.ndarray) -> float:
+    """
+    计算平均recall@k
+
+    Args:
+        ground_truth: 基准top-k下标 (q, k)
+        predicted: 待评估的top-k下标 (q, k')
+
+    Returns:
+        平均召回率
+    """
+    if ground_truth.size == 0:
+        return 0.0
+    hits = [
+        len(set(truth.tolist()) & set(pred.tolist()))
+        for truth, pred in zip(ground_truth, predicted)
+    ]
+    return float(np.mean(hits)) / ground_truth.shape[1]
+
+
+def split_queries(matrix: np.ndarray, num_queries: int,
+                  seed: int = 42) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    从向量中随机抽出一部分作为查询，其余作为语料
+
+    Args:
+        matrix: 向量矩阵
+        num_queries: 查询数量
+        seed: 随机种子
+
+    Returns:
+        (语料矩阵, 查询矩阵)
+    """
+    rng = np.random.default_rng(seed)
+    num_queries = min(num_queries, matrix.shape[0] // 2)
+    order = rng.permutation(matrix.shape[0])
+    return matrix[order[num_queries:]], matrix[order[:num_queries]]
+
+
+def matryoshka_recall(corpus: np.ndarray, queries: np.ndarray, dims_list: List[int],
+                      k: int = 10) -> List[Dict[str, Any]]:
+    """
+    对比各截断维度与全维度精确检索的recall@k
+
+    Args:
+        corpus: 全维度归一化语料矩阵
+        queries: 全维度归一化查询矩阵
+        dims_list: 要评估的截断维度列表
+        k: top-k
+
+    Returns:
+        每个维度一行的结果列表（dims、recall、单次查询耗时、向量存储大小）
+    """
+    full_dims = corpus.shape[1]
+    ground_truth = exact_top_k(corpus, queries, k)
+
+    rows = []
+    for dims in sorted(set(dims_list + [full_dims]), reverse=True):
+        if dims > full_dims:
+            continue
+        corpus_d = truncate_matrix(corpus, dims)
+        queries_d = truncate_matrix(queries, dims)
+
+        start = time.perf_counter()
+        predicted = exact_top_k(corpus_d, queries_d, k)
+        elapsed = time.perf_counter() - start
+
+        rows.append({
+            "dims": dims,
+            "recall": recall_at_k(ground_truth, predicted),
+            "ms_per_query": elapsed * 1000 / max(len(queries_d), 1),
+            "vector_mb": corpus_d.shape[0] * dims * 4 / (1024 * 1024),
+        })
+    return rows
+
+
+def print_recall_table(rows: List[Dict[str, Any]], k: int):
+    """打印截断召回对比表"""
+    print(f"\n{'维度':>6} | {'recall@' + str(k):>10} | {'暴力检索(ms/查询)':>16} | {'float向量(MB)':>12}")
+    print("-" * 56)
+    for row in rows:
+        print(f"{row['dims']:>6} | {row['recall']:>10.4f} | {row['ms_per_query']:>16.3f} | {row['vector_mb']:>12.2f}")
+
+
+def main():
+    """命令行入口：评估Matryoshka截断对召回的影响"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="评估Matryoshka截断维度相对全维度的召回率")
+    parser.add_argument("--cache-file", type=str,
+                        default=str(Path(__file__).parent / "cache" / "chunks_with_embeddings.json"),
+                        help="包含全维度向量的chunk缓存文件")
+    parser.add_argument("--dims", type=int, nargs="+", default=[256, 512, 768],
+                        help="要评估的截断维度")
+    parser.add_argument("--k", type=int, default=10, help="top-k")
+    parser.add_argument("--num-queries", type=int, default=200,
+                        help="从语料中抽出作为查询的向量数量")
+    parser.add_argument("--query-file", type=str,
+                        help="查询文本文件（每行一条），提供时用完整维度实时嵌入作为查询")
+
+    args = parser.parse_args()
+
+    _, chunks = load_chunk_cache(Path(args.cache_file))
+    vectors = [chunk.embedding for chunk in chunks if len(chunk.embedding)]
+    if not vectors:
+        raise ValueError(f"缓存中没有向量: {args.cache_file}")
+    matrix = to_matrix(vectors)
+
+    if args.query_file:
+        try:
+            from .text_processing import TextProcessor
+        except ImportError:
+            from text_processing import TextProcessor
+        # output_dims=0：查询向量保留完整维度，截断在评估时完成
+        processor = TextProcessor(output_dims=0, budget_stage="query")
+        with open(args.query_file, 'r', encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+        query_vectors = [processor.get_embedding(text) for text in texts]
+        queries = to_matrix([v for v in query_vectors if v])
+        if queries.shape[1] > matrix.shape[1]:
+            # 缓存向量已被截断时，只能在缓存维度以内比较
+            queries = truncate_matrix(queries, matrix.shape[1])
+        corpus = matrix
+    else:
+        corpus, queries = split_queries(matrix, args.num_queries)
+
+    print(f"语料向量: {corpus.shape[0]} × {corpus.shape[1]} 维，查询: {queries.shape[0]}")
+    rows = matryoshka_recall(corpus, queries, args.dims, k=args.k)
+    print_recall_table(rows, args.k)
+
+
+if __name__ == "__main__":
+    main()
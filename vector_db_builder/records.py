@@ -0,0 +1,274 @@
+"""
+数据记录模块：经历与chunk的紧凑表示
+
+经历（experience）只保存一份；chunk只保存自身文本、向量和父经历ID，
+在写入缓存或ElasticSearch时再按需要的索引布局组装文档。
+"""
+import hashlib
+import json
+from array import array
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
+
+
+# 经历的元数据字段
+EXPERIENCE_FIELDS = (
+    "celebrity_name_en",
+    "celebrity_name_cn",
+    "profession",
+    "event_summary",
+    "challenge_type",
+    "coping_strategy",
+    "final_result",
+    "tags",
+)
+
+# compact布局下冗余到每个chunk文档上的字段（用于kNN过滤）
+FILTER_FIELDS = ("celebrity_name_en", "profession", "challenge_type", "tags")
+
+CHUNK_CACHE_FORMAT = "compact"
+
+
+def make_experience_id(experience: Dict[str, Any]) -> str:
+    """
+    生成经历的稳定ID（名人英文名 + 经历在该名人提取结果中的序号 + 经历内容的哈希）
+
+    只用事件摘要时，同一名人摘要相同（包括为空）的不同经历会得到相同ID并在索引中互相覆盖，
+    因此序号（experience_index，由提取阶段写入）和挑战类型、应对策略、结果都参与哈希。
+
+    Args:
+        experience: 经历字典
+
+    Returns:
+        经历ID，如果经历中已有experience_id则直接返回
+    """
+    if experience.get("experience_id"):
+        return experience["experience_id"]
+
+    name_en = experience.get("celebrity_name_en", "unknown")
+    key = "\n".join(
+        str(experience.get(field, ""))
+        for field in ("experience_index", "challenge_type", "event_summary", "coping_strategy", "final_result")
+    )
+    key = f"{name_en}\n{key}"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+    return f"{name_en}_{digest}"
+
+
+def assign_experience_ids(experiences: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    为经历列表补充experience_id字段（原地修改）
+
+    Args:
+        experiences: 经历列表
+
+    Returns:
+        同一个经历列表
+    """
+    for exp in experiences:
+        exp["experience_id"] = make_experience_id(exp)
+    return experiences
+
+
+def pack_vector(values) -> array:
+    """
+    把向量打包为float32数组（每维4字节；Python float列表每维约32字节）
+
+    Args:
+        values: 向量（列表、NumPy数组或array）
+
+    Returns:
+        array('f')
+    """
+    if isinstance(values, array) and values.typecode == "f":
+        return values
+    if hasattr(values, "dtype"):
+        packed = array("f")
+        packed.frombytes(values.astype("float32", copy=False).tobytes())
+        return packed
+    return array("f", values if values is not None else ())
+
+
+def unpack_vector(vector) -> List[float]:
+    """
+    把float32向量转为可写入JSON的浮点列表
+
+    float32转为Python float后会带上加宽后的尾数（0.1变成0.10000000149011612），
+    JSON缓存和bulk请求体因此大一半；保留9位有效数字即可无损还原float32。
+
+    Args:
+        vector: array('f')或其他float32向量
+
+    Returns:
+        浮点数列表
+    """
+    return [float(f"{value:.9g}") for value in vector]
+
+
+class ChunkRecord:
+    """单个chunk：只保存文本、向量和父经历ID（向量以float32打包存放）"""
+
+    __slots__ = ("chunk_id", "experience_id", "full_text", "_embedding")
+
+    def __init__(self, chunk_id: str, experience_id: str, full_text: str,
+                 embedding: List[float] = None):
+        self.chunk_id = chunk_id
+        self.experience_id = experience_id
+        self.full_text = full_text
+        self.embedding = embedding
+
+    @property
+    def embedding(self) -> array:
+        return self._embedding
+
+    @embedding.setter
+    def embedding(self, values):
+        self._embedding = pack_vector(values)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "chunk_id": self.chunk_id,
+            "experience_id": self.experience_id,
+            "full_text": self.full_text,
+            "embedding": unpack_vector(self.embedding),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ChunkRecord":
+        return cls(
+            chunk_id=data["chunk_id"],
+            experience_id=data["experience_id"],
+            full_text=data.get("full_text", ""),
+            embedding=data.get("embedding") or [],
+        )
+
+    def __repr__(self) -> str:
+        return f"ChunkRecord(chunk_id={self.chunk_id!r}, dims={len(self.embedding)})"
+
+
+def save_chunk_cache(path: Path, experiences: List[Dict[str, Any]],
+                     chunks: List[ChunkRecord]):
+    """
+    保存chunk缓存：经历只写一次，chunk通过experience_id引用
+
+    Args:
+        path: 缓存文件路径
+        experiences: 经历列表（需已包含experience_id）
+        chunks: chunk记录列表
+    """
+    data = {
+        "format": CHUNK_CACHE_FORMAT,
+        "experiences": experiences,
+        "chunks": [chunk.to_dict() for chunk in chunks],
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def load_chunk_cache(path: Path) -> Tuple[List[Dict[str, Any]], List[ChunkRecord]]:
+    """
+    加载chunk缓存，兼容旧版（每个chunk复制完整经历字段）的列表格式
+
+    Args:
+        path: 缓存文件路径
+
+    Returns:
+        (经历列表, chunk记录列表)
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    if isinstance(data, dict) and data.get("format") == CHUNK_CACHE_FORMAT:
+        chunks = [ChunkRecord.from_dict(item) for item in data.get("chunks", [])]
+        return data.get("experiences", []), chunks
+
+    # 旧版格式：chunk文档列表，按事件去重还原经历
+    experiences = {}
+    chunk_counts = {}
+    chunks = []
+    for doc in data:
+        experience_id = make_experience_id(doc)
+        if experience_id not in experiences:
+            experience = {field: doc[field] for field in EXPERIENCE_FIELDS if field in doc}
+            experience["experience_id"] = experience_id
+            experiences[experience_id] = experience
+        chunk_index = chunk_counts.get(experience_id, 0)
+        chunk_counts[experience_id] = chunk_index + 1
+        chunks.append(ChunkRecord(
+            chunk_id=f"{experience_id}_{chunk_index}",
+            experience_id=experience_id,
+            full_text=doc.get("full_text", ""),
+            embedding=doc.get("embedding") or [],
+        ))
+    return list(experiences.values()), chunks
+
+
+def flat_documents(experiences: List[Dict[str, Any]],
+                   chunks: Iterable[ChunkRecord]) -> Iterator[Dict[str, Any]]:
+    """
+    flat布局：每个chunk一个文档，合并父经历的全部字段
+
+    Args:
+        experiences: 经历列表
+        chunks: chunk记录
+
+    Yields:
+        ES文档
+    """
+    by_id = {exp["experience_id"]: exp for exp in experiences}
+    for chunk in chunks:
+        doc = dict(by_id.get(chunk.experience_id, {}))
+        doc.update(chunk.to_dict())
+        yield doc
+
+
+def compact_chunk_documents(experiences: List[Dict[str, Any]],
+                            chunks: Iterable[ChunkRecord]) -> Iterator[Dict[str, Any]]:
+    """
+    compact布局：chunk文档只带过滤字段，其余经历字段存放在父索引中
+
+    Args:
+        experiences: 经历列表
+        chunks: chunk记录
+
+    Yields:
+        ES文档
+    """
+    by_id = {exp["experience_id"]: exp for exp in experiences}
+    for chunk in chunks:
+        parent = by_id.get(chunk.experience_id, {})
+        doc = {field: parent[field] for field in FILTER_FIELDS if field in parent}
+        doc.update(chunk.to_dict())
+        yield doc
+
+
+def nested_documents(experiences: List[Dict[str, Any]],
+                     chunks: Iterable[ChunkRecord]) -> Iterator[Dict[str, Any]]:
+    """
+    nested布局：每个经历一个文档，chunk作为nested对象放在chunks字段中
+
+    Args:
+        experiences: 经历列表
+        chunks: chunk记录
+
+    Yields:
+        ES文档
+    """
+    chunks_by_experience = {}
+    for chunk in chunks:
+        # 单个nested chunk写入失败会导致整个经历文档被拒绝，跳过没有向量的chunk
+        if not len(chunk.embedding):
+            continue
+        chunks_by_experience.setdefault(chunk.experience_id, []).append({
+            "chunk_id": chunk.chunk_id,
+            "full_text": chunk.full_text,
+            "embedding": unpack_vector(chunk.embedding),
+        })
+
+    for exp in experiences:
+        nested_chunks = chunks_by_experience.get(exp["experience_id"])
+        if not nested_chunks:
+            continue
+        doc = dict(exp)
+        doc["chunks"] = nested_chunks
+        yield doc
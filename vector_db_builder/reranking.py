@@ -0,0 +1,373 @@
+"""
+检索结果重排：可插拔的重排器 + 批量打分、并发上限、打分缓存和延迟预算
+
+纯余弦相似度会把只是字面相近的经历排得很靠前。这里在一阶段检索（kNN/混合检索）之后
+对候选做一次重排：
+    - LexicalReranker: 查询与经历文本的词/字二元组重合度，无需模型，CPU上几乎没有开销
+    - CrossEncoderReranker: 本地交叉编码器（需要 pip install sentence-transformers）
+    - LLMJudgeReranker: 通过OpenAI兼容接口让LLM按批给候选打相关性分（共享限流器和预算）
+
+RerankStage把候选按batch_size分批，用有上限的线程池并发打分，(重排器, 查询, 文档) 的分数进程内缓存；
+超过延迟预算仍未打完分时整体回退到一阶段顺序（未完成的批次在后台继续，结果写入缓存供下次使用）。
+
+配置（环境变量）:
+    RERANKER                    默认重排器（none/lexical/cross_encoder/llm，默认none）
+    RERANK_CANDIDATES           一阶段取回的候选数量（默认50）
+    RERANK_BATCH_SIZE           每批打分的候选数（默认16）
+    RERANK_MAX_CONCURRENCY      同时打分的批次数（默认4）
+    RERANK_BUDGET_MS            重排的延迟预算，毫秒（默认800）
+    RERANK_CACHE_SIZE           打分缓存的条目数上限（默认10000）
+    RERANK_CROSS_ENCODER_MODEL  交叉编码器模型（默认BAAI/bge-reranker-base）
+    RERANK_LLM_MODEL            LLM打分使用的模型（默认openai/gpt-4o-mini）
+"""
+import json
+import math
+import os
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Optional, Tuple
+
+try:
+    from .metrics import get_metrics, MILLISECOND_BUCKETS
+    from .budget import get_budget
+except ImportError:
+    from metrics import get_metrics, MILLISECOND_BUCKETS
+    from budget import get_budget
+
+
+# 参与重排的经历字段（按顺序拼接为候选文本）
+RERANK_FIELDS = ("event_summary", "challenge_type", "coping_strategy", "final_result", "full_text")
+# 候选文本的最大字符数（交叉编码器和LLM的输入长度有限）
+MAX_DOCUMENT_CHARS = 600
+
+
+def hit_text(hit: Dict[str, Any]) -> str:
+    """把命中结果的经历字段拼接为重排用的候选文本"""
+    source = hit.get("_source", {})
+    parts = [str(source[field]) for field in RERANK_FIELDS if source.get(field)]
+    return "\n".join(parts)[:MAX_DOCUMENT_CHARS]
+
+
+def hit_key(hit: Dict[str, Any]) -> str:
+    """缓存键中的文档标识（chunk命中用chunk_id，nested命中用经历ID）"""
+    source = hit.get("_source", {})
+    return source.get("chunk_id") or source.get("experience_id") or hit["_id"]
+
+
+class Reranker(ABC):
+    """重排器接口：对一批候选文本打分，分数越大越相关"""
+
+    name = "base"
+
+    @abstractmethod
+    def score(self, query: str, documents: List[str]) -> List[float]:
+        """
+        为一批候选打分
+
+        Args:
+            query: 查询文本
+            documents: 候选文本
+
+        Returns:
+            与documents一一对应的分数
+        """
+
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[\u4e00-\u9fff]+")
+
+
+def _terms(text: str) -> List[str]:
+    """切分词项：英文/数字按单词，中文按字二元组（单字的词保留单字）"""
+    terms = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        if token[0].isascii() or len(token) == 1:
+            terms.append(token)
+        else:
+            terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+    return terms
+
+
+class LexicalReranker(Reranker):
+    """词项重合度：查询词项在候选中的覆盖率，词频按BM25方式饱和，长文档按长度归一化"""
+
+    name = "lexical"
+
+    def __init__(self, k1: float = 1.2, b: float = 0.5, avg_length: int = 200):
+        self.k1 = k1
+        self.b = b
+        self.avg_length = avg_length
+
+    def score(self, query: str, documents: List[str]) -> List[float]:
+        query_terms = set(_terms(query))
+        if not query_terms:
+            return [0.0] * len(documents)
+        scores = []
+        for document in documents:
+            terms = _terms(document)
+            counts = {}
+            for term in terms:
+                if term in query_terms:
+                    counts[term] = counts.get(term, 0) + 1
+            norm = self.k1 * (1 - self.b + self.b * len(terms) / self.avg_length)
+            saturated = sum(tf * (self.k1 + 1) / (tf + norm) for tf in counts.values())
+            scores.append(saturated / ((self.k1 + 1) * len(query_terms)))
+        return scores
+
+
+class CrossEncoderReranker(Reranker):
+    """本地交叉编码器（sentence-transformers的CrossEncoder，CPU上按批推理）"""
+
+    name = "cross_encoder"
+
+    def __init__(self, model_name: str = None):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError("交叉编码器重排需要安装sentence-transformers: pip install sentence-transformers") from e
+        self.model_name = model_name or os.getenv("RERANK_CROSS_ENCODER_MODEL", "BAAI/bge-reranker-base")
+        self.model = CrossEncoder(self.model_name, device=os.getenv("RERANK_DEVICE", "cpu"))
+
+    def score(self, query: str, documents: List[str]) -> List[float]:
+        scores = self.model.predict([(query, document) for document in documents],
+                                    batch_size=len(documents), show_progress_bar=False)
+        # 输出logit，用sigmoid压到0~1，和其他重排器的分数范围一致
+        return [1.0 / (1.0 + math.exp(-float(score))) for score in scores]
+
+
+class LLMJudgeReranker(Reranker):
+    """LLM打分：一次请求为一批候选给出0~10的相关性分数（共享 端点+模型 的限流器和预算）"""
+
+    name = "llm"
+
+    def __init__(self, api_key: str = None, model: str = None):
+        try:
+            from .clients import get_openai_client
+            from .rate_limit import get_rate_limiter
+        except ImportError:
+            from clients import get_openai_client
+            from rate_limit import get_rate_limiter
+
+        self.api_key = api_key or os.getenv("OPENROUTER_API_KEY")
+        if not self.api_key:
+            raise ValueError("OPENROUTER_API_KEY not found in environment variables")
+        self.model = model or os.getenv("RERANK_LLM_MODEL", "openai/gpt-4o-mini")
+        self.base_url = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+        self.client = get_openai_client(self.base_url, self.api_key)
+        self.limiter = get_rate_limiter(self.base_url, self.model)
+        self.metrics = get_metrics()
+        self.budget = get_budget()
+
+    def score(self, query: str, documents: List[str]) -> List[float]:
+        # 预算接近用完时不再调用LLM，由RerankStage回退到一阶段顺序
+        self.budget.check("rerank")
+        if self.budget.should_degrade("rerank"):
+            raise RuntimeError("重排预算不足")
+
+        candidates = "\n\n".join(f"[{i}] {document}" for i, document in enumerate(documents))
+        prompt = f"""请对以下候选经历与用户困境的相关性评分（0-10分，10分表示经历与困境高度相关、应对方式可借鉴）。
+
+用户困境：{query}
+
+候选经历：
+{candidates}
+
+只返回一个JSON数组，按候选编号顺序给出 {len(documents)} 个分数，例如 [7, 3, 9]，不要其他说明。"""
+
+        def request():
+            with self.metrics.api_call("rerank", self.model) as call:
+                completion = self.client.chat.completions.create(
+                    extra_headers={
+                        "HTTP-Referer": "https://github.com/InspireMatch",
+                        "X-Title": "InspireMatch",
+                    },
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0,
+                )
+                call.record_usage(getattr(completion, "usage", None))
+            return completion
+
+        completion = self.limiter.call(request, tokens=self.limiter.token_cost(prompt))
+        response = completion.choices[0].message.content.strip()
+        self.budget.record_usage("rerank", self.model, getattr(completion, "usage", None),
+                                 prompt_text=prompt, completion_text=response)
+
+        match = re.search(r"\[.*?\]", response, re.DOTALL)
+        scores = json.loads(match.group(0)) if match else []
+        if len(scores) != len(documents):
+            raise ValueError(f"LLM返回的分数数量不匹配: 期望 {len(documents)}，实际 {len(scores)}")
+        return [min(max(float(score), 0.0), 10.0) / 10.0 for score in scores]
+
+
+RERANKERS = {
+    "lexical": LexicalReranker,
+    "cross_encoder": CrossEncoderReranker,
+    "llm": LLMJudgeReranker,
+}
+
+
+class ScoreCache:
+    """(重排器, 查询, 文档) -> 分数 的LRU缓存（线程安全）"""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._scores: "OrderedDict[Tuple[str, str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[float]:
+        with self._lock:
+            score = self._scores.get(key)
+            if score is not None:
+                self._scores.move_to_end(key)
+            return score
+
+    def put(self, key: Tuple[str, str, str], score: float):
+        with self._lock:
+            self._scores[key] = score
+            self._scores.move_to_end(key)
+            while len(self._scores) > self.max_size:
+                self._scores.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+
+class RerankStage:
+    def __init__(self, reranker: Reranker, batch_size: int = None, max_concurrency: int = None,
+                 budget_ms: float = None, cache: ScoreCache = None):
+        """
+        初始化重排阶段
+
+        Args:
+            reranker: 重排器
+            batch_size: 每批打分的候选数，默认从环境变量RERANK_BATCH_SIZE读取
+            max_concurrency: 同时打分的批次数，默认从环境变量RERANK_MAX_CONCURRENCY读取
+            budget_ms: 延迟预算（毫秒），默认从环境变量RERANK_BUDGET_MS读取，0表示不限制
+            cache: 打分缓存，默认使用进程内共享的缓存
+        """
+        self.reranker = reranker
+        self.batch_size = batch_size or int(os.getenv("RERANK_BATCH_SIZE", "16"))
+        self.max_concurrency = max_concurrency or int(os.getenv("RERANK_MAX_CONCURRENCY", "4"))
+        self.budget_ms = float(os.getenv("RERANK_BUDGET_MS", "800")) if budget_ms is None else budget_ms
+        self.cache = cache if cache is not None else get_score_cache()
+        self.metrics = get_metrics()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                            thread_name_prefix=f"rerank-{reranker.name}")
+
+    def _score_batch(self, query: str, keys: List[str], documents: List[str]):
+        """为一批候选打分并写入缓存"""
+        scores = self.reranker.score(query, documents)
+        for key, score in zip(keys, scores):
+            self.cache.put((self.reranker.name, query, key), float(score))
+
+    def rerank(self, query: str, result: dict, size: int = None) -> dict:
+        """
+        重排一次检索的命中
+
+        重排成功时命中按重排分数降序排列，_rerank_score为重排分数；超过延迟预算或打分出错时
+        保持一阶段顺序。两种情况下都截断到size，并在result["rerank"]中记录是否生效。
+
+        Args:
+            query: 查询文本
+            result: 一阶段搜索结果
+            size: 返回结果数量，None表示不截断
+
+        Returns:
+            重排后的搜索结果（附带rerank字段）
+        """
+        if not result or "hits" not in result or not result["hits"]["hits"]:
+            return result
+        # ES客户端的响应对象不支持添加顶层字段，复制为dict（命中列表仍然共享）
+        result = dict(result)
+        hits = result["hits"]["hits"]
+        start = time.perf_counter()
+        name = self.reranker.name
+
+        keys = [hit_key(hit) for hit in hits]
+        missing: Dict[str, str] = {}
+        for key, hit in zip(keys, hits):
+            hit_cached = self.cache.get((name, query, key)) is not None
+            self.metrics.cache_lookup("rerank", hit_cached)
+            if not hit_cached and key not in missing:
+                missing[key] = hit_text(hit)
+
+        reason = None
+        if missing:
+            pending_keys = list(missing)
+            futures = [
+                self._executor.submit(self._score_batch, query, batch, [missing[key] for key in batch])
+                for batch in (pending_keys[i:i + self.batch_size]
+                              for i in range(0, len(pending_keys), self.batch_size))
+            ]
+            timeout = self.budget_ms / 1000 if self.budget_ms else None
+            done, not_done = wait(futures, timeout=timeout)
+            if not_done:
+                reason = "timeout"
+            elif any(future.exception() is not None for future in done):
+                reason = "error"
+                print(f"重排打分出错，保持一阶段顺序: {next(f.exception() for f in done if f.exception())}")
+
+        scores = [self.cache.get((name, query, key)) for key in keys]
+        if reason is None and any(score is None for score in scores):
+            # 缓存容量小于候选数时刚写入的分数可能已被淘汰
+            reason = "evicted"
+
+        if reason is None:
+            order = sorted(range(len(hits)), key=lambda i: -scores[i])
+            for hit, score in zip(hits, scores):
+                hit["_first_stage_score"] = hit.get("_score")
+                hit["_rerank_score"] = score
+            hits = [hits[i] for i in order]
+        else:
+            self.metrics.counter("rerank_fallbacks_total", "重排回退到一阶段顺序的次数").inc(
+                reranker=name, reason=reason
+            )
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.metrics.histogram("rerank_ms", "重排耗时（毫秒）", MILLISECOND_BUCKETS).observe(
+            elapsed_ms, reranker=name
+        )
+        result["hits"]["hits"] = hits[:size] if size else hits
+        result["rerank"] = {"reranker": name, "applied": reason is None, "fallback_reason": reason,
+                            "scored": len(missing), "took_ms": round(elapsed_ms, 1)}
+        return result
+
+
+_score_cache = None
+_stages: Dict[str, RerankStage] = {}
+_registry_lock = threading.Lock()
+
+
+def get_score_cache() -> ScoreCache:
+    """进程内共享的打分缓存"""
+    global _score_cache
+    with _registry_lock:
+        if _score_cache is None:
+            _score_cache = ScoreCache(int(os.getenv("RERANK_CACHE_SIZE", "10000")))
+        return _score_cache
+
+
+def get_rerank_stage(name: str = None) -> Optional[RerankStage]:
+    """
+    获取指定重排器的共享重排阶段（模型和线程池在进程内只创建一次）
+
+    Args:
+        name: 重排器名称（lexical/cross_encoder/llm），默认从环境变量RERANKER读取
+
+    Returns:
+        重排阶段，name为none时返回None
+    """
+    name = name or os.getenv("RERANKER", "none")
+    if name == "none":
+        return None
+    if name not in RERANKERS:
+        raise ValueError(f"不支持的重排器: {name}，可选: none, {', '.join(RERANKERS)}")
+    cache = get_score_cache()
+    with _registry_lock:
+        if name not in _stages:
+            _stages[name] = RerankStage(RERANKERS[name](), cache=cache)
+        return _stages[name]
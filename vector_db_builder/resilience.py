@@ -0,0 +1,265 @@
+"""
+容错模块：熔断器与对冲请求（按 API端点 + 模型 共享状态）
+
+- CircuitBreaker: 连续失败达到阈值后打开，打开期间直接失败；冷却时间过后进入半开状态，
+  放行一个探测请求，成功则关闭，失败则重新打开
+- Hedger: 记录最近请求的延迟，请求超过p95仍未返回时再发一个相同请求，取先返回的结果
+
+配置（环境变量）:
+    CIRCUIT_FAILURE_THRESHOLD   连续失败多少次后熔断（默认5）
+    CIRCUIT_RESET_TIMEOUT       熔断后多少秒进入半开状态（默认30）
+    HEDGE_QUANTILE              对冲延迟取最近延迟的分位数（默认0.95）
+    HEDGE_MIN_SAMPLES           积累多少个延迟样本后才开始对冲（默认20）
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Any
+
+import numpy as np
+
+try:
+    from .metrics import get_metrics
+    from .rate_limit import is_throttling_error
+except ImportError:
+    from metrics import get_metrics
+    from rate_limit import is_throttling_error
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器处于打开状态，请求被直接拒绝"""
+
+
+class CircuitBreaker:
+    """连续失败熔断器"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        初始化熔断器
+
+        Args:
+            name: 名称（用于日志和指标标签）
+            failure_threshold: 连续失败多少次后打开
+            reset_timeout: 打开后多少秒允许半开探测
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.metrics = get_metrics()
+
+    def _transition(self, state: str):
+        self.state = state
+        self.metrics.counter("circuit_transitions_total", "熔断器状态变化次数").inc(breaker=self.name, state=state)
+        if state == self.OPEN:
+            print(f"熔断器 {self.name} 已打开：连续失败 {self.consecutive_failures} 次，"
+                  f"{self.reset_timeout:.0f} 秒内直接失败")
+        elif state == self.CLOSED:
+            print(f"熔断器 {self.name} 已恢复")
+
+    def allow(self) -> bool:
+        """
+        是否放行本次请求（放行后必须调用record_success、record_error或release）
+
+        Returns:
+            True表示放行；打开状态或半开状态下已有探测请求时返回False
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+        self.metrics.counter("circuit_rejected_total", "熔断器直接拒绝的请求数").inc(breaker=self.name)
+        return False
+
+    def record_success(self):
+        """记录一次成功（半开探测成功时关闭熔断器）"""
+        with self._lock:
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def record_failure(self):
+        """记录一次失败（达到阈值或半开探测失败时打开熔断器）"""
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.opened_at = time.monotonic()
+                self._transition(self.OPEN)
+
+    def release(self):
+        """归还放行名额但不计入成败（半开探测遇到与端点可用性无关的错误时使用）"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_error(self, error: Exception):
+        """
+        按错误类型记录一次失败：只有429、5xx和连接/超时错误计入熔断，其余错误（如400）只归还放行名额
+
+        Args:
+            error: 调用抛出的异常
+        """
+        if is_throttling_error(error):
+            self.record_failure()
+        else:
+            self.release()
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        """
+        在熔断器保护下执行调用
+
+        Args:
+            fn: 无参数的调用函数
+
+        Returns:
+            fn的返回值；熔断时抛出CircuitOpenError
+        """
+        if not self.allow():
+            raise CircuitOpenError(f"熔断器 {self.name} 处于打开状态")
+        try:
+            result = fn()
+        except Exception as e:
+            self.record_error(e)
+            raise
+        self.record_success()
+        return result
+
+
+class Hedger:
+    """对冲请求：等待超过最近延迟的p95后再发一个相同请求，取先成功的结果"""
+
+    def __init__(self, name: str, quantile: float = 0.95, min_samples: int = 20,
+                 window: int = 200, min_delay: float = 0.01, max_workers: int = 32):
+        """
+        初始化对冲器
+
+        Args:
+            name: 名称（用于指标标签）
+            quantile: 对冲延迟使用的延迟分位数
+            min_samples: 样本不足时不对冲
+            window: 保留最近多少个延迟样本
+            min_delay: 最小对冲延迟（秒）
+            max_workers: 执行请求的线程数
+        """
+        self.name = name
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"hedge-{name}")
+        self.metrics = get_metrics()
+
+    def hedge_delay(self) -> float:
+        """当前的对冲延迟（秒），样本不足时返回None"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            samples = np.fromiter(self._latencies, dtype=np.float64)
+        return max(float(np.quantile(samples, self.quantile)), self.min_delay)
+
+    def _timed(self, fn: Callable[[], Any]) -> Any:
+        start = time.perf_counter()
+        result = fn()
+        with self._lock:
+            self._latencies.append(time.perf_counter() - start)
+        return result
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        """
+        执行调用，超过对冲延迟仍未返回时发出第二个相同请求
+
+        Args:
+            fn: 无参数的调用函数（必须是幂等的）
+
+        Returns:
+            先成功返回的结果；两个请求都失败时抛出先失败的那个异常
+        """
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._timed(fn)
+
+        primary = self._executor.submit(self._timed, fn)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        self.metrics.counter("hedge_requests_total", "发出的对冲请求数").inc(endpoint=self.name)
+        hedge = self._executor.submit(self._timed, fn)
+        pending = {primary, hedge}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self.metrics.counter("hedge_wins_total", "对冲请求先返回的次数").inc(endpoint=self.name)
+                    return future.result()
+                first_error = first_error or future.exception()
+        raise first_error
+
+
+_breakers = {}
+_hedgers = {}
+_registry_lock = threading.Lock()
+
+
+def get_circuit_breaker(endpoint: str, model: str) -> CircuitBreaker:
+    """
+    获取 端点 + 模型 对应的共享熔断器
+
+    Args:
+        endpoint: API基础URL
+        model: 模型名称
+
+    Returns:
+        熔断器
+    """
+    key = (endpoint.rstrip("/"), model)
+    with _registry_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker(
+                model,
+                failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+                reset_timeout=float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30")),
+            )
+        return _breakers[key]
+
+
+def get_hedger(endpoint: str, model: str) -> Hedger:
+    """
+    获取 端点 + 模型 对应的共享对冲器（延迟样本在同一进程内共享）
+
+    Args:
+        endpoint: API基础URL
+        model: 模型名称
+
+    Returns:
+        对冲器
+    """
+    key = (endpoint.rstrip("/"), model)
+    with _registry_lock:
+        if key not in _hedgers:
+            _hedgers[key] = Hedger(
+                model,
+                quantile=float(os.getenv("HEDGE_QUANTILE", "0.95")),
+                min_samples=int(os.getenv("HEDGE_MIN_SAMPLES", "20")),
+            )
+        return _hedgers[key]
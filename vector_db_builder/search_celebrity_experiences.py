@@ -1,11 +1,31 @@
 """
 搜索模块：使用sonar-pro-search搜索名人经历
 """
-from openai import OpenAI
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Tuple
 from pathlib import Path
 
+try:
+    from .metrics import get_metrics
+except ImportError:
+    from metrics import get_metrics
+
+try:
+    from .budget import get_budget
+except ImportError:
+    from budget import get_budget
+
+try:
+    from .rate_limit import get_rate_limiter
+except ImportError:
+    from rate_limit import get_rate_limiter
+
+try:
+    from .clients import get_openai_client
+except ImportError:
+    from clients import get_openai_client
+
 
 class CelebrityExperienceSearcher:
     def __init__(self, api_key: str = None):
@@ -19,10 +39,13 @@ class CelebrityExperienceSearcher:
         if not self.api_key:
             raise ValueError("OPENROUTER_API_KEY not found in environment variables")
         
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=self.api_key
-        )
+        self.metrics = get_metrics()
+        self.budget = get_budget()
+        self.model = "perplexity/sonar-pro-search"
+        self.base_url = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+        # 同一端点共享客户端和连接池，重试由共享限流器负责
+        self.client = get_openai_client(self.base_url, self.api_key)
+        self.limiter = get_rate_limiter(self.base_url, self.model)
     
     def search_celebrity_experiences(self, celebrity_name_en: str, celebrity_name_cn: str) -> str:
         """
@@ -37,26 +60,35 @@ class CelebrityExperienceSearcher:
         """
         query = f"请详细介绍{celebrity_name_cn}({celebrity_name_en})的人生经历、面临的挑战、应对策略和最终结果。包括职业发展、创业历程、遇到的困难、如何克服困难以及取得的成就。"
         
+        def request():
+            with self.metrics.api_call("search", self.model) as call:
+                completion = self.client.chat.completions.create(
+                    extra_headers={
+                        "HTTP-Referer": "https://github.com/InspireMatch",
+                        "X-Title": "InspireMatch",
+                    },
+                    model=self.model,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": [
+                                {
+                                    "type": "text",
+                                    "text": query
+                                }
+                            ]
+                        }
+                    ]
+                )
+                call.record_usage(getattr(completion, "usage", None))
+            return completion
+        
         try:
-            completion = self.client.chat.completions.create(
-                extra_headers={
-                    "HTTP-Referer": "https://github.com/InspireMatch",
-                    "X-Title": "InspireMatch",
-                },
-                model="perplexity/sonar-pro-search",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": query
-                            }
-                        ]
-                    }
-                ]
-            )
-            return completion.choices[0].message.content
+            completion = self.limiter.call(request, tokens=self.limiter.token_cost(query))
+            content = completion.choices[0].message.content
+            self.budget.record_usage("search", self.model, getattr(completion, "usage", None),
+                                     prompt_text=query, completion_text=content)
+            return content
         except Exception as e:
             print(f"搜索 {celebrity_name_cn} 时出错: {str(e)}")
             return ""
@@ -107,33 +139,51 @@ class CelebrityExperienceSearcher:
         
         return celebrities
     
-    def search_all_celebrities(self, data_dir: str = None) -> Dict[str, Dict[str, str]]:
+    def search_all_celebrities(self, data_dir: str = None,
+                               celebrities: Dict[str, List[Tuple[str, str]]] = None) -> Dict[str, Dict[str, str]]:
         """
         搜索所有名人的经历
         
         Args:
             data_dir: 数据目录路径
+            celebrities: 要搜索的名人（格式同load_celebrities的返回值），默认从data_dir加载全部名人
         
         Returns:
             嵌套字典：{职业: {名人英文名: 搜索结果文本}}
         """
-        celebrities = self.load_celebrities(data_dir)
-        results = {}
-        
-        for profession, celeb_list in celebrities.items():
-            print(f"\n开始搜索 {profession} 职业的名人...")
-            results[profession] = {}
-            
-            for en_name, cn_name in celeb_list:
-                print(f"  搜索: {cn_name} ({en_name})")
-                search_result = self.search_celebrity_experiences(en_name, cn_name)
-                results[profession][en_name] = {
-                    "chinese_name": cn_name,
-                    "search_result": search_result
-                }
-                # 添加延迟以避免API限流
-                import time
-                time.sleep(1)
+        if celebrities is None:
+            celebrities = self.load_celebrities(data_dir)
+        tasks = [
+            (profession, en_name, cn_name)
+            for profession, celeb_list in celebrities.items()
+            for en_name, cn_name in celeb_list
+        ]
+        print(f"\n开始搜索 {len(tasks)} 位名人...")
+        
+        def search(task):
+            profession, en_name, cn_name = task
+            # 预算用完后不再发起新的搜索，已有结果照常返回
+            if self.budget.exhausted("search"):
+                return None
+            print(f"  搜索: {cn_name} ({en_name})")
+            return self.search_celebrity_experiences(en_name, cn_name)
+        
+        # 并发度由共享限流器按429/Retry-After自适应控制
+        with ThreadPoolExecutor(max_workers=self.limiter.max_concurrency) as executor:
+            search_results = list(executor.map(search, tasks))
+        
+        results = {profession: {} for profession in celebrities}
+        skipped = 0
+        for (profession, en_name, cn_name), search_result in zip(tasks, search_results):
+            if search_result is None:
+                skipped += 1
+                continue
+            results[profession][en_name] = {
+                "chinese_name": cn_name,
+                "search_result": search_result
+            }
+        if skipped:
+            print(f"  搜索预算已用完，跳过 {skipped} 位名人")
         
         return results
 
@@ -0,0 +1,339 @@
+"""
+标签榜单：构建时为每个标签和每个标签类别预先算好最具代表性的经历
+
+标签集合（data_construct/flags）是固定的，按标签浏览时不必每次都做带过滤的kNN。构建时：
+    - 标签向量：标签名（英文 + 中文）的嵌入；类别向量：该类别所有标签向量的均值
+    - 候选：带有该标签（或该类别任一标签）的经历，按经历向量与标签向量的相似度排序
+    - 按名人分散：先取每位名人最好的一条，再取每位名人的第二条……每位名人最多per_celebrity条
+
+结果写入一个JSON查找文件（默认 cache/tag_lists.json），标签页直接按键读取。
+"""
+import heapq
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+import numpy as np
+
+try:
+    from .records import ChunkRecord
+    from .centroids import experience_vector
+    from .tag_matching import load_tags
+    from .jsonl_cache import batched
+except ImportError:
+    from records import ChunkRecord
+    from centroids import experience_vector
+    from tag_matching import load_tags
+    from jsonl_cache import batched
+
+
+TAG_LISTS_FILE = "tag_lists.json"
+
+# 榜单中为每条经历保存的字段（足够渲染标签页，不需要再查ES）
+SUMMARY_FIELDS = ("celebrity_name_en", "celebrity_name_cn", "profession", "event_summary", "challenge_type")
+
+
+def default_tag_lists_path() -> Path:
+    """标签榜单文件路径（环境变量TAG_LISTS_FILE，缺省为 cache/tag_lists.json）"""
+    return Path(os.getenv("TAG_LISTS_FILE") or Path(__file__).parent / "cache" / TAG_LISTS_FILE)
+
+
+def tag_label(tag: Dict[str, str]) -> str:
+    """用于嵌入的标签文本"""
+    return f"{tag['en']} {tag['cn']}"
+
+
+class TagListBuilder:
+    def __init__(self, tags: Dict[str, List[Dict[str, str]]], tag_vectors: Dict[str, np.ndarray],
+                 k: int = 20, per_celebrity: int = 2):
+        """
+        初始化标签榜单累加器（每个榜单最多保留k位名人、每位per_celebrity条，内存与语料规模无关）
+
+        Args:
+            tags: 标签类别 -> 标签列表（load_tags的结果）
+            tag_vectors: 英文标签名 -> 归一化的标签向量（缺失的标签不生成榜单）
+            k: 每个榜单的经历数量
+            per_celebrity: 每个榜单中每位名人最多出现的次数
+        """
+        self.k = k
+        self.per_celebrity = per_celebrity
+        # 榜单条目：("tag", 英文标签名) 或 ("category", 类别名)，按行对应self.vectors
+        self.entries: List[Tuple[str, str]] = []
+        self.meta: List[Dict[str, Any]] = []
+        vectors = []
+        # 英文标签名 -> 该标签及其类别的榜单下标
+        self.tag_entries: Dict[str, List[int]] = {}
+
+        for category, tag_list in tags.items():
+            members = [tag for tag in tag_list if tag["en"] in tag_vectors]
+            if not members:
+                continue
+            category_vector = np.mean([tag_vectors[tag["en"]] for tag in members], axis=0)
+            category_index = len(self.entries)
+            self.entries.append(("category", category))
+            self.meta.append({"num_tags": len(members)})
+            vectors.append(category_vector / (np.linalg.norm(category_vector) or 1.0))
+            for tag in members:
+                self.tag_entries.setdefault(tag["en"], []).extend([category_index, len(self.entries)])
+                self.entries.append(("tag", tag["en"]))
+                self.meta.append({"cn": tag["cn"], "category": category})
+                vectors.append(tag_vectors[tag["en"]])
+
+        self.vectors = np.asarray(vectors, dtype=np.float64)
+        # 每个榜单：名人 -> 该名人得分最高的per_celebrity条（小顶堆），最多k位名人
+        self._best: List[Dict[str, list]] = [{} for _ in self.entries]
+
+    def add(self, experience: Dict[str, Any], chunks: List[ChunkRecord]):
+        """
+        累加一条经历
+
+        Args:
+            experience: 经历（需包含tags）
+            chunks: 该经历的chunk记录
+        """
+        entries = sorted({
+            entry for tag in experience.get("tags") or [] for entry in self.tag_entries.get(tag, ())
+        })
+        if not entries:
+            return
+        vector = experience_vector(chunks)
+        if vector is None:
+            return
+
+        scores = self.vectors[entries] @ vector
+        summary = {"experience_id": experience["experience_id"]}
+        summary.update({field: experience.get(field, "") for field in SUMMARY_FIELDS})
+        celebrity = summary["celebrity_name_en"]
+        for entry, score in zip(entries, scores.tolist()):
+            heap = self._best[entry].setdefault(celebrity, [])
+            item = (score, summary["experience_id"], summary)
+            if len(heap) < self.per_celebrity:
+                heapq.heappush(heap, item)
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, item)
+            self._evict(entry)
+
+    def _evict(self, entry: int):
+        """
+        榜单中超过k位名人时，淘汰最高分最低的名人
+
+        超过k位名人时榜单只由各名人的第1条组成（按名人轮流取），只需要最高分排在前k的名人；
+        被淘汰的名人之后出现更高分的经历时会重新进入，此时它的其他条目已经用不到。
+        """
+        best = self._best[entry]
+        if len(best) <= self.k:
+            return
+        weakest = min(best, key=lambda celebrity: max(item[0] for item in best[celebrity]))
+        del best[weakest]
+
+    def _ranked(self, entry: int) -> List[Dict[str, Any]]:
+        """按名人轮流取：先比较各名人的第1条，再比较第2条……"""
+        candidates = []
+        for heap in self._best[entry].values():
+            for rank, (score, _, summary) in enumerate(sorted(heap, key=lambda item: -item[0])):
+                candidates.append((rank, -score, summary))
+        candidates.sort(key=lambda item: (item[0], item[1]))
+        return [
+            {**summary, "score": round(-negative_score, 6)}
+            for _, negative_score, summary in candidates[:self.k]
+        ]
+
+    def lists(self) -> Dict[str, Dict[str, Any]]:
+        """
+        生成全部榜单
+
+        Returns:
+            {"tags": {英文标签名: {...}}, "categories": {类别名: {...}}}，
+            每个榜单包含元数据和experiences列表
+        """
+        result = {"tags": {}, "categories": {}}
+        for entry, (kind, name) in enumerate(self.entries):
+            section = result["tags" if kind == "tag" else "categories"]
+            section[name] = {**self.meta[entry], "experiences": self._ranked(entry)}
+        return result
+
+
+def embed_tags(text_processor, tags: Dict[str, List[Dict[str, str]]],
+               batch_size: int = 64) -> Dict[str, np.ndarray]:
+    """
+    批量嵌入所有标签名
+
+    Args:
+        text_processor: 文本处理器
+        tags: 标签类别 -> 标签列表
+        batch_size: 每次请求的标签数量
+
+    Returns:
+        英文标签名 -> 归一化的标签向量（嵌入失败的标签不在结果中）
+    """
+    all_tags = [tag for tag_list in tags.values() for tag in tag_list]
+    vectors = {}
+    for batch in batched(all_tags, batch_size):
+        embeddings = text_processor.get_embeddings([tag_label(tag) for tag in batch], stage="tag_lists")
+        for tag, embedding in zip(batch, embeddings):
+            if not embedding:
+                continue
+            vector = np.asarray(embedding, dtype=np.float64)
+            norm = np.linalg.norm(vector)
+            if norm:
+                vectors[tag["en"]] = vector / norm
+    if len(vectors) < len(all_tags):
+        print(f"警告: {len(all_tags) - len(vectors)} 个标签嵌入失败，不生成对应榜单")
+    return vectors
+
+
+def build_tag_lists(records: Iterable[Tuple[Dict[str, Any], List[ChunkRecord]]], text_processor,
+                    output_path: Path, flags_dir: Path = None, k: int = 20,
+                    per_celebrity: int = 2) -> int:
+    """
+    计算并写入标签榜单文件
+
+    Args:
+        records: (经历, 该经历的chunk记录列表) 的可迭代对象
+        text_processor: 文本处理器（用于嵌入标签名，需与构建索引时的模型一致）
+        output_path: 输出文件路径
+        flags_dir: flags目录路径
+        k: 每个榜单的经历数量
+        per_celebrity: 每个榜单中每位名人最多出现的次数
+
+    Returns:
+        写入的榜单数量（标签 + 类别）
+    """
+    tags = load_tags(flags_dir)
+    tag_vectors = embed_tags(text_processor, tags)
+    if not tag_vectors:
+        print("没有可用的标签向量，跳过标签榜单")
+        return 0
+
+    builder = TagListBuilder(tags, tag_vectors, k=k, per_celebrity=per_celebrity)
+    for experience, chunks in records:
+        builder.add(experience, chunks)
+
+    data = {
+        "model": text_processor.model,
+        "k": k,
+        "per_celebrity": per_celebrity,
+        **builder.lists(),
+    }
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = output_path.with_name(f".{output_path.name}.tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, output_path)
+    load_tag_lists.cache_clear()
+
+    count = len(data["tags"]) + len(data["categories"])
+    print(f"已写入 {count} 个标签榜单到: {output_path}")
+    return count
+
+
+@lru_cache(maxsize=None)
+def load_tag_lists(path: Path = None) -> Dict[str, Any]:
+    """
+    读取标签榜单文件（进程内只读取一次）
+
+    Args:
+        path: 文件路径，默认见default_tag_lists_path
+
+    Returns:
+        榜单数据，另加 cn_index（中文标签名 -> 英文标签名）
+    """
+    path = Path(path) if path else default_tag_lists_path()
+    if not path.exists():
+        raise FileNotFoundError(f"标签榜单文件不存在: {path}（运行 build_vector_database.py 生成）")
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    data["cn_index"] = {value["cn"]: name for name, value in data["tags"].items()}
+    return data
+
+
+def browse_tag(name: str, size: int = None, path: Path = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    按标签或类别读取预先计算的榜单
+
+    Args:
+        name: 英文标签名、中文标签名或类别名
+        size: 返回数量，默认返回榜单中的全部经历
+        path: 榜单文件路径
+
+    Returns:
+        经历列表（按代表性降序），名称不存在时返回None
+    """
+    data = load_tag_lists(path)
+    name = data["cn_index"].get(name, name)
+    entry = data["tags"].get(name) or data["categories"].get(name)
+    if entry is None:
+        return None
+    return entry["experiences"][:size] if size else entry["experiences"]
+
+
+def main():
+    """命令行入口"""
+    import argparse
+
+    try:
+        from .config import load_env
+    except ImportError:
+        from config import load_env
+    load_env()
+
+    parser = argparse.ArgumentParser(description="按标签或类别浏览预先计算的经历榜单")
+    parser.add_argument("name", type=str, nargs="?", help="英文/中文标签名或类别名")
+    parser.add_argument("--size", type=int, default=10, help="返回数量")
+    parser.add_argument("--file", type=str, help="榜单文件路径，默认读取TAG_LISTS_FILE或cache/tag_lists.json")
+    parser.add_argument("--list", action="store_true", help="列出所有榜单及其经历数量")
+    parser.add_argument("--rebuild-from", type=str,
+                        help="从嵌入阶段缓存重新生成榜单（chunks_with_embeddings.json 或 .jsonl/.jsonl.zst）")
+    parser.add_argument("--k", type=int, default=20, help="重新生成时每个榜单的经历数量")
+    parser.add_argument("--per-celebrity", type=int, default=2, help="重新生成时每位名人最多出现的次数")
+    args = parser.parse_args()
+
+    path = Path(args.file) if args.file else default_tag_lists_path()
+
+    if args.rebuild_from:
+        try:
+            from .text_processing import TextProcessor
+            from .records import load_chunk_cache
+            from .jsonl_cache import iter_experience_chunks
+            from .centroids import group_chunks
+        except ImportError:
+            from text_processing import TextProcessor
+            from records import load_chunk_cache
+            from jsonl_cache import iter_experience_chunks
+            from centroids import group_chunks
+        cache_file = Path(args.rebuild_from)
+        if cache_file.suffix == ".json":
+            records = group_chunks(*load_chunk_cache(cache_file))
+        else:
+            records = iter_experience_chunks(cache_file)
+        build_tag_lists(records, TextProcessor(), path, k=args.k, per_celebrity=args.per_celebrity)
+
+    if args.list:
+        data = load_tag_lists(path)
+        for section in ("categories", "tags"):
+            print(f"\n{section}:")
+            for name, entry in data[section].items():
+                label = f"{name} ({entry['cn']})" if "cn" in entry else name
+                print(f"  {label}: {len(entry['experiences'])}")
+        return
+
+    if not args.name:
+        if not args.rebuild_from:
+            parser.error("需要提供标签名，或使用 --list / --rebuild-from")
+        return
+
+    experiences = browse_tag(args.name, size=args.size, path=path)
+    if experiences is None:
+        print(f"没有找到标签或类别: {args.name}")
+        return
+    print(f"\n{args.name}: {len(experiences)} 条经历\n")
+    for i, experience in enumerate(experiences, 1):
+        print(f"{i}. [{experience['score']:.4f}] {experience['celebrity_name_cn']} "
+              f"({experience['celebrity_name_en']}): {experience['event_summary']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,80 @@
 """
 标签匹配模块：将经历与flags标签进行关联
 """
-from openai import OpenAI
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
 from pathlib import Path
 import json
 
+try:
+    from .metrics import get_metrics
+except ImportError:
+    from metrics import get_metrics
+
+try:
+    from .budget import get_budget
+except ImportError:
+    from budget import get_budget
+
+try:
+    from .rate_limit import get_rate_limiter
+except ImportError:
+    from rate_limit import get_rate_limiter
+
+try:
+    from .clients import get_openai_client
+except ImportError:
+    from clients import get_openai_client
+
+
+# 标签类别 -> 标签文件
+FLAG_FILES = {
+    "career_development_and_challenges": "career_development_and_challenges.txt",
+    "mental_health_emotional_challenges": "mental_health_emotional_challenges.txt",
+    "personal_growth_and_self-improvement": "personal_growth_and_self-improvement.txt",
+    "relationships_interpersonal_communication": "relationships_interpersonal_communication.txt",
+    "financial_life_challenges": "financial_life_challenges.txt",
+    "physical_health_fitness": "physical_health_fitness.txt",
+    "enterpreneurship_and_innovation": "enterpreneurship_and_innovation.txt",
+    "education_and_learning": "education_and_learning.txt",
+    "social_responsibility_and_impact": "social_responsibility_and_impact.txt",
+    "resilience_and_comebacks": "resilience_and_comebacks.txt",
+}
+
+DEFAULT_FLAGS_DIR = Path(__file__).parent.parent / "data_construct" / "flags"
+
+
+def load_tags(flags_dir: Path = None) -> Dict[str, List[Dict[str, str]]]:
+    """
+    加载所有标签文件（不需要API密钥）
+    
+    Args:
+        flags_dir: flags目录路径，默认为 data_construct/flags
+    
+    Returns:
+        字典，键为标签类别名，值为标签列表（每个标签包含en和cn）
+    """
+    flags_dir = Path(flags_dir) if flags_dir else DEFAULT_FLAGS_DIR
+    tags = {}
+    
+    for category, filename in FLAG_FILES.items():
+        file_path = flags_dir / filename
+        if file_path.exists():
+            tags[category] = []
+            with open(file_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line and '--' in line:
+                        parts = line.split('--')
+                        if len(parts) == 2:
+                            tags[category].append({
+                                "en": parts[0].strip(),
+                                "cn": parts[1].strip()
+                            })
+    
+    return tags
+
 
 class TagMatcher:
     def __init__(self, api_key: str = None, flags_dir: str = None):
@@ -21,19 +89,16 @@ class TagMatcher:
         if not self.api_key:
             raise ValueError("OPENROUTER_API_KEY not found in environment variables")
         
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=self.api_key
-        )
+        self.metrics = get_metrics()
+        self.budget = get_budget()
+        self.model = "openai/gpt-4o-mini"
+        self.base_url = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+        # 同一端点共享客户端和连接池，重试由共享限流器负责
+        self.client = get_openai_client(self.base_url, self.api_key)
+        self.limiter = get_rate_limiter(self.base_url, self.model)
         
         # 加载所有标签
-        if flags_dir is None:
-            current_dir = Path(__file__).parent.parent
-            flags_dir = current_dir / "data_construct" / "flags"
-        else:
-            flags_dir = Path(flags_dir)
-        
-        self.tags = self._load_tags(flags_dir)
+        self.tags = self._load_tags(Path(flags_dir) if flags_dir else DEFAULT_FLAGS_DIR)
     
     def _load_tags(self, flags_dir: Path) -> Dict[str, List[Dict[str, str]]]:
         """
@@ -45,37 +110,7 @@ class TagMatcher:
         Returns:
             字典，键为标签类别名，值为标签列表（每个标签包含en和cn）
         """
-        tags = {}
-        
-        flag_files = {
-            "career_development_and_challenges": "career_development_and_challenges.txt",
-            "mental_health_emotional_challenges": "mental_health_emotional_challenges.txt",
-            "personal_growth_and_self-improvement": "personal_growth_and_self-improvement.txt",
-            "relationships_interpersonal_communication": "relationships_interpersonal_communication.txt",
-            "financial_life_challenges": "financial_life_challenges.txt",
-            "physical_health_fitness": "physical_health_fitness.txt",
-            "enterpreneurship_and_innovation": "enterpreneurship_and_innovation.txt",
-            "education_and_learning": "education_and_learning.txt",
-            "social_responsibility_and_impact": "social_responsibility_and_impact.txt",
-            "resilience_and_comebacks": "resilience_and_comebacks.txt",
-        }
-        
-        for category, filename in flag_files.items():
-            file_path = flags_dir / filename
-            if file_path.exists():
-                tags[category] = []
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        line = line.strip()
-                        if line and '--' in line:
-                            parts = line.split('--')
-                            if len(parts) == 2:
-                                tags[category].append({
-                                    "en": parts[0].strip(),
-                                    "cn": parts[1].strip()
-                                })
-        
-        return tags
+        return load_tags(flags_dir)
     
     def match_tags(self, experience: Dict[str, Any], use_llm: bool = True) -> List[str]:
         """
@@ -91,6 +126,10 @@ class TagMatcher:
         # 先进行关键词匹配
         keyword_tags = self._keyword_match(experience)
         
+        # 预算接近用完时降级为仅关键词匹配
+        if use_llm and self.budget.should_degrade("tags"):
+            use_llm = False
+        
         if not use_llm:
             return keyword_tags[:3]  # 最多返回3个标签
         
@@ -172,23 +211,31 @@ class TagMatcher:
 
 请选择1-3个最相关的标签，只返回标签的英文名，用逗号分隔。如果关键词匹配结果合理，可以优先使用。只返回标签名，不要其他说明。"""
 
+        def request():
+            with self.metrics.api_call("tags", self.model) as call:
+                completion = self.client.chat.completions.create(
+                    extra_headers={
+                        "HTTP-Referer": "https://github.com/InspireMatch",
+                        "X-Title": "InspireMatch",
+                    },
+                    model=self.model,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": prompt
+                        }
+                    ],
+                    temperature=0.2
+                )
+                call.record_usage(getattr(completion, "usage", None))
+            return completion
+        
         try:
-            completion = self.client.chat.completions.create(
-                extra_headers={
-                    "HTTP-Referer": "https://github.com/InspireMatch",
-                    "X-Title": "InspireMatch",
-                },
-                model="openai/gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.2
-            )
+            completion = self.limiter.call(request, tokens=self.limiter.token_cost(prompt))
             
             response = completion.choices[0].message.content.strip()
+            self.budget.record_usage("tags", self.model, getattr(completion, "usage", None),
+                                     prompt_text=prompt, completion_text=response)
             
             # 解析响应
             matched_tags = []
@@ -221,17 +268,16 @@ class TagMatcher:
         """
         print(f"\n开始为 {len(experiences)} 条经历匹配标签...")
         
-        for i, exp in enumerate(experiences):
+        def match(item):
+            i, exp = item
+            exp["tags"] = self.match_tags(exp, use_llm=use_llm)
             if (i + 1) % 10 == 0:
                 print(f"  已处理 {i + 1}/{len(experiences)} 条经历")
-            
-            tags = self.match_tags(exp, use_llm=use_llm)
-            exp["tags"] = tags
-            
-            # 添加延迟
-            if use_llm and (i + 1) % 5 == 0:
-                import time
-                time.sleep(0.5)
+        
+        # 并发度由共享限流器按429/Retry-After自适应控制
+        workers = self.limiter.max_concurrency if use_llm else 1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(match, enumerate(experiences)))
         
         print(f"标签匹配完成")
         return experiences
@@ -1,15 +1,184 @@
 """
 文本处理模块：文本切块和向量嵌入
 """
-from openai import OpenAI
 import os
 from typing import List, Dict, Any, Optional
-import tiktoken
+import threading
 import time
+import re
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .records import ChunkRecord, make_experience_id
+except ImportError:
+    from records import ChunkRecord, make_experience_id
+
+try:
+    from .metrics import get_metrics
+except ImportError:
+    from metrics import get_metrics
+
+try:
+    from .budget import get_budget
+except ImportError:
+    from budget import get_budget
+
+try:
+    from .rate_limit import get_rate_limiter, is_throttling_error
+except ImportError:
+    from rate_limit import get_rate_limiter, is_throttling_error
+
+try:
+    from .resilience import get_circuit_breaker, get_hedger, CircuitBreaker, CircuitOpenError
+except ImportError:
+    from resilience import get_circuit_breaker, get_hedger, CircuitBreaker, CircuitOpenError
+
+try:
+    from .clients import get_openai_client
+except ImportError:
+    from clients import get_openai_client
+
+
+# 句子边界：中文句末标点（可带右引号/右括号）或换行
+SENTENCE_PATTERN = re.compile(r"[^。！？\n]*(?:[。！？]+[”’」』）)]*|\n+|$)")
+
+# 相邻chunk之间默认的重叠token数
+DEFAULT_CHUNK_OVERLAP = 50
+
+
+# 常用嵌入模型的输出维度，可通过环境变量EMBEDDING_DIMS覆盖
+EMBEDDING_MODEL_DIMS = {
+    "Qwen/Qwen3-Embedding-0.6B": 1024,
+    "Qwen/Qwen3-Embedding-4B": 2560,
+    "Qwen/Qwen3-Embedding-8B": 4096,
+    "openai/text-embedding-3-small": 1536,
+    "openai/text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+
+# 未知模型时使用的维度（与旧索引一致）
+DEFAULT_EMBEDDING_DIMS = 1024
+
+# 支持Matryoshka（MRL）截断的模型前缀：截取向量前N维并重新归一化后仍可直接使用
+MATRYOSHKA_MODEL_PREFIXES = (
+    "Qwen/Qwen3-Embedding",
+    "openai/text-embedding-3",
+    "text-embedding-3",
+)
+
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+
+def resolve_embedding_base_url(base_url: str = None) -> str:
+    """
+    解析嵌入API端点
+
+    Args:
+        base_url: 显式指定的端点，默认读取EMBEDDING_API_BASE_URL，都没有时使用OpenRouter
+
+    Returns:
+        以/v1结尾的端点（OpenAI客户端会自动添加/embeddings）
+    """
+    base_url = base_url or os.getenv("EMBEDDING_API_BASE_URL") or OPENROUTER_BASE_URL
+    if base_url.endswith("/v1"):
+        return base_url
+    if base_url.endswith("/v1/embeddings"):
+        return base_url.replace("/v1/embeddings", "/v1")
+    return base_url.rstrip("/") + "/v1"
+
+
+def resolve_embedding_model(model: str = None, base_url: str = None) -> str:
+    """
+    解析嵌入模型名称（TextProcessor与按模型推断维度的地方共用，保证两边一致）
+
+    Args:
+        model: 显式指定的模型
+        base_url: 嵌入API端点，默认按resolve_embedding_base_url解析
+
+    Returns:
+        模型名称：显式参数、EMBEDDING_MODEL，否则自定义端点为Qwen3-Embedding-0.6B，
+        OpenRouter为text-embedding-3-small
+    """
+    if model:
+        return model
+    if os.getenv("EMBEDDING_MODEL"):
+        return os.getenv("EMBEDDING_MODEL")
+    if resolve_embedding_base_url(base_url) != OPENROUTER_BASE_URL:
+        return "Qwen/Qwen3-Embedding-0.6B"
+    return "openai/text-embedding-3-small"
+
+
+def resolve_output_dims(output_dims: int = None) -> Optional[int]:
+    """
+    解析Matryoshka截断维度
+
+    Args:
+        output_dims: 显式指定的维度，0表示不截断
+
+    Returns:
+        截断维度，不截断时返回None（显式参数优先，其次是环境变量EMBEDDING_OUTPUT_DIMS）
+    """
+    if output_dims is None and os.getenv("EMBEDDING_OUTPUT_DIMS"):
+        output_dims = int(os.getenv("EMBEDDING_OUTPUT_DIMS"))
+    return output_dims or None
+
+
+def resolve_embedding_dims(model: str = None, output_dims: int = None) -> int:
+    """
+    根据嵌入模型推断向量维度
+
+    Args:
+        model: 嵌入模型名称
+        output_dims: Matryoshka截断维度（默认从EMBEDDING_OUTPUT_DIMS读取）
+
+    Returns:
+        向量维度（EMBEDDING_DIMS环境变量优先，截断维度不超过模型原始维度）
+    """
+    if os.getenv("EMBEDDING_DIMS"):
+        dims = int(os.getenv("EMBEDDING_DIMS"))
+    else:
+        dims = EMBEDDING_MODEL_DIMS.get(model, DEFAULT_EMBEDDING_DIMS)
+    output_dims = resolve_output_dims(output_dims)
+    return min(dims, output_dims) if output_dims else dims
+
+
+def normalize_vector(vector: List[float]) -> List[float]:
+    """
+    L2归一化向量（零向量原样返回）
+
+    Args:
+        vector: 输入向量
+
+    Returns:
+        单位长度向量
+    """
+    arr = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(arr))
+    if norm == 0.0:
+        return list(vector)
+    return (arr / norm).tolist()
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    按句子边界切分文本，保留分隔符，拼接后与原文完全一致
+
+    Args:
+        text: 输入文本
+
+    Returns:
+        句子列表
+    """
+    return [match.group(0) for match in SENTENCE_PATTERN.finditer(text) if match.group(0)]
 
 
 class TextProcessor:
-    def __init__(self, api_key: str = None, model: str = None, base_url: str = None):
+    def __init__(self, api_key: str = None, model: str = None, base_url: str = None,
+                 normalize: bool = None, output_dims: int = None, hedge: bool = None,
+                 budget_stage: str = "embed"):
         """
         初始化文本处理器
         
@@ -17,47 +186,44 @@ class TextProcessor:
             api_key: API密钥（优先从环境变量EMBEDDING_API_KEY读取，否则从OPENROUTER_API_KEY读取）
             model: 嵌入模型名称（优先从环境变量EMBEDDING_MODEL读取）
             base_url: API基础URL（优先从环境变量EMBEDDING_API_BASE_URL读取）
+            normalize: 是否在嵌入时L2归一化向量（默认从环境变量EMBEDDING_NORMALIZE读取，缺省为开启），
+                       dot_product相似度的索引要求开启
+            output_dims: Matryoshka截断维度（如256/512），默认从环境变量EMBEDDING_OUTPUT_DIMS读取，
+                         0表示保留完整维度；截断后的向量总会重新归一化
+            hedge: 是否启用对冲请求（超过近期p95延迟时再发一次相同请求），默认从环境变量
+                   EMBEDDING_HEDGE读取，缺省关闭；主要用于查询路径降低尾延迟
+            budget_stage: 嵌入调用默认计入的预算阶段（查询路径为query），单次调用可用stage参数覆盖
         """
         # 优先从环境变量读取自定义embedding配置
-        self.base_url = base_url or os.getenv("EMBEDDING_API_BASE_URL")
+        self.base_url = resolve_embedding_base_url(base_url)
         self.api_key = api_key or os.getenv("EMBEDDING_API_KEY") or os.getenv("OPENROUTER_API_KEY")
         
         if not self.api_key:
             raise ValueError("API密钥未找到，请设置 EMBEDDING_API_KEY 或 OPENROUTER_API_KEY 环境变量")
         
-        # 如果没有设置自定义端点，使用OpenRouter
-        if not self.base_url:
-            self.base_url = "https://openrouter.ai/api/v1"
-        
-        # 确保base_url以/v1结尾（OpenAI客户端会自动添加/embeddings）
-        if not self.base_url.endswith("/v1"):
-            if self.base_url.endswith("/v1/embeddings"):
-                self.base_url = self.base_url.replace("/v1/embeddings", "/v1")
-            elif self.base_url.endswith("/"):
-                self.base_url = self.base_url.rstrip("/") + "/v1"
-            else:
-                self.base_url = self.base_url.rstrip("/") + "/v1"
-        
-        self.client = OpenAI(
-            base_url=self.base_url,
-            api_key=self.api_key
-        )
-        
-        # 模型名称：优先使用环境变量，否则使用传入参数，最后使用默认值
-        if model:
-            self.model = model
-        elif os.getenv("EMBEDDING_MODEL"):
-            self.model = os.getenv("EMBEDDING_MODEL")
-        elif self.base_url != "https://openrouter.ai/api/v1":
-            # 自定义端点，使用默认模型
-            self.model = "Qwen/Qwen3-Embedding-0.6B"
-        else:
-            # OpenRouter，使用OpenAI模型
-            self.model = "openai/text-embedding-3-small"
+        self.metrics = get_metrics()
+        self.budget = get_budget()
+        # 嵌入调用默认计入的预算阶段
+        self.budget_stage = budget_stage
+        # OpenAI客户端和tiktoken编码在首次使用时才创建（导入openai较慢，只做查询时不需要tiktoken）
+        self._client = None
+        self._encoding = None
+        self._lazy_lock = threading.Lock()
+        # 长期复用的线程池：tiktoken按线程缓存正则状态，每批新建线程会让这些缓存随批数增长
+        self._executors = {}
+        
+        self.model = resolve_embedding_model(model, self.base_url)
+        
+        self.limiter = get_rate_limiter(self.base_url, self.model)
+        # 熔断器和对冲器按 端点+模型 在进程内共享
+        self.breaker = get_circuit_breaker(self.base_url, self.model)
+        if hedge is None:
+            hedge = os.getenv("EMBEDDING_HEDGE", "false").lower() in ("1", "true", "yes")
+        self.hedger = get_hedger(self.base_url, self.model) if hedge else None
         
         # 从环境变量读取 OpenRouter headers（仅在使用OpenRouter时有效）
         self.extra_headers = {}
-        if self.base_url == "https://openrouter.ai/api/v1":
+        if self.base_url == OPENROUTER_BASE_URL:
             http_referer = os.getenv("OPENROUTER_HTTP_REFERER")
             x_title = os.getenv("OPENROUTER_X_TITLE")
             if http_referer:
@@ -65,89 +231,291 @@ class TextProcessor:
             if x_title:
                 self.extra_headers["X-Title"] = x_title
         
-        self.encoding = tiktoken.get_encoding("cl100k_base")  # text-embedding-3-small使用的编码
+        # 向量维度和归一化配置
+        self.output_dims = resolve_output_dims(output_dims)
+        self.dims = resolve_embedding_dims(self.model, output_dims=self.output_dims or 0)
+        if self.output_dims and not self.model.startswith(MATRYOSHKA_MODEL_PREFIXES):
+            print(f"警告: 模型 {self.model} 可能不支持Matryoshka截断，截断到 {self.output_dims} 维会明显降低检索质量")
+        if normalize is None:
+            normalize = os.getenv("EMBEDDING_NORMALIZE", "true").lower() in ("1", "true", "yes")
+        self.normalize = normalize
         
         # 打印配置信息（用于调试）
         print(f"[TextProcessor] 初始化完成:")
         print(f"  API端点: {self.base_url}")
         print(f"  模型: {self.model}")
+        print(f"  向量维度: {self.dims}（归一化: {'开启' if self.normalize else '关闭'}）")
         print(f"  API密钥: {'已设置' if self.api_key else '未设置'}")
     
-    def chunk_text(self, text: str, max_tokens: int = 500, overlap: int = 50) -> List[str]:
+    @property
+    def client(self):
+        """OpenAI客户端（同一端点共享，429/5xx重试由共享限流器负责）"""
+        if self._client is None:
+            self._client = get_openai_client(self.base_url, self.api_key)
+        return self._client
+
+    @property
+    def encoding(self):
+        """tiktoken编码（text-embedding-3-small使用的cl100k_base），只在切块时需要"""
+        if self._encoding is None:
+            with self._lazy_lock:
+                if self._encoding is None:
+                    import tiktoken
+                    self._encoding = tiktoken.get_encoding("cl100k_base")
+        return self._encoding
+
+    def chunk_text(self, text: str, max_tokens: int = 500, overlap: int = None) -> List[str]:
         """
         将文本切分为chunks
-        
+
+        按句子边界（。！？/换行）打包整句，保证chunk不会在句子或字符中间断开；
+        相邻chunk之间保留不超过overlap个token的重叠。
+
         Args:
             text: 输入文本
             max_tokens: 每个chunk的最大token数
+            overlap: chunk之间的重叠token数，默认50（不超过max_tokens - 1）
+
+        Returns:
+            chunk列表
+        """
+        return self.chunk_many([text], max_tokens=max_tokens, overlap=overlap)[0]
+
+    def _executor(self, name: str, max_workers: int) -> ThreadPoolExecutor:
+        """
+        按名称和线程数复用的线程池（进程内长期存在）
+
+        tiktoken为每个线程保存一份正则的匹配缓存；每批都新建线程池（包括encode_batch内部）时，
+        新线程会不断占用新的缓存槽位，常驻内存随处理的批数增长，复用固定的线程可以避免。
+
+        Args:
+            name: 用途（线程名前缀）
+            max_workers: 线程数
+
+        Returns:
+            线程池
+        """
+        key = (name, max_workers)
+        with self._lazy_lock:
+            if key not in self._executors:
+                self._executors[key] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+            return self._executors[key]
+
+    def chunk_many(self, texts: List[str], max_tokens: int = 500, overlap: int = None,
+                   num_threads: int = 8) -> List[List[str]]:
+        """
+        批量切分多段文本
+
+        所有文本先切成句子，再在复用的线程池中按num_threads份一次性编码，
+        之后只在token计数上做打包，不再重复编码或解码整段文本。
+
+        Args:
+            texts: 输入文本列表
+            max_tokens: 每个chunk的最大token数
+            overlap: chunk之间的重叠token数，默认50（不超过max_tokens - 1）
+            num_threads: 批量编码使用的线程数
+
+        Returns:
+            与texts一一对应的chunk列表
+        """
+        if overlap is None:
+            overlap = min(DEFAULT_CHUNK_OVERLAP, max_tokens - 1)
+        if overlap >= max_tokens:
+            raise ValueError(f"overlap ({overlap}) 必须小于 max_tokens ({max_tokens})")
+
+        sentence_lists = [
+            split_sentences(text) if text and text.strip() else []
+            for text in texts
+        ]
+        all_sentences = [sentence for sentences in sentence_lists for sentence in sentences]
+        # 不用encode_batch：它每次调用都新建线程池
+        encoding = self.encoding
+        step = -(-len(all_sentences) // num_threads) or 1
+        parts = [all_sentences[i:i + step] for i in range(0, len(all_sentences), step)]
+        all_tokens = [
+            tokens
+            for part in self._executor("tokenize", num_threads).map(
+                lambda part: [encoding.encode(sentence) for sentence in part], parts
+            )
+            for tokens in part
+        ]
+
+        results = []
+        offset = 0
+        for text, sentences in zip(texts, sentence_lists):
+            token_lists = all_tokens[offset:offset + len(sentences)]
+            offset += len(sentences)
+
+            if not sentences:
+                results.append([])
+            elif sum(len(tokens) for tokens in token_lists) <= max_tokens:
+                # 与打包出的chunk一样去掉首尾空白，缓存键和嵌入输入保持一致
+                results.append([text.strip()])
+            else:
+                results.append(self._pack_sentences(sentences, token_lists, max_tokens, overlap))
+
+        return results
+
+    def _pack_sentences(self, sentences: List[str], token_lists: List[List[int]],
+                        max_tokens: int, overlap: int) -> List[str]:
+        """
+        将已编码的句子打包为不超过max_tokens的chunk
+
+        Args:
+            sentences: 句子列表
+            token_lists: 每个句子对应的token列表
+            max_tokens: 每个chunk的最大token数
             overlap: chunk之间的重叠token数
-        
+
         Returns:
             chunk列表
         """
-        if not text or len(text.strip()) == 0:
-            return []
-        
-        # 将文本编码为tokens
-        tokens = self.encoding.encode(text)
-        
-        if len(tokens) <= max_tokens:
-            return [text]
-        
+        # 超长句子按token窗口切开（切点对齐到字符边界）
+        units = []
+        for sentence, tokens in zip(sentences, token_lists):
+            if len(tokens) <= max_tokens:
+                units.append((sentence, tokens))
+            else:
+                units.extend(self._split_long_sentence(sentence, tokens, max_tokens))
+
         chunks = []
+        window = []
+        window_tokens = 0
+
+        for unit_text, unit_tokens in units:
+            if window and window_tokens + len(unit_tokens) > max_tokens:
+                chunks.append("".join(text for text, _ in window).strip())
+
+                # 从上一个窗口末尾携带重叠部分，且为当前句子留出空间
+                carry_budget = min(overlap, max_tokens - len(unit_tokens))
+                window = self._overlap_tail(window, carry_budget)
+                window_tokens = sum(len(tokens) for _, tokens in window)
+
+            window.append((unit_text, unit_tokens))
+            window_tokens += len(unit_tokens)
+
+        if window:
+            chunks.append("".join(text for text, _ in window).strip())
+
+        return [chunk for chunk in chunks if chunk]
+
+    def _overlap_tail(self, window: list, budget: int) -> list:
+        """
+        取窗口末尾不超过budget个token的内容作为下一个窗口的开头
+
+        优先携带完整句子；如果最后一个句子本身超过budget，则截取其末尾的token。
+        """
+        if budget <= 0:
+            return []
+
+        tail = []
+        tail_tokens = 0
+        for unit_text, unit_tokens in reversed(window):
+            if tail_tokens + len(unit_tokens) > budget:
+                if not tail:
+                    tail.append(self._token_suffix(unit_text, unit_tokens, budget))
+                break
+            tail.insert(0, (unit_text, unit_tokens))
+            tail_tokens += len(unit_tokens)
+
+        return [(text, tokens) for text, tokens in tail if tokens]
+
+    def _token_suffix(self, text: str, tokens: List[int], n: int) -> tuple:
+        """截取文本末尾约n个token，切点对齐到字符边界"""
+        _, offsets = self.encoding.decode_with_offsets(tokens)
+        start = len(tokens) - n
+        # 跳过起始于同一字符内部的token
+        while start < len(tokens) and start > 0 and offsets[start] == offsets[start - 1]:
+            start += 1
+        if start >= len(tokens):
+            return ("", [])
+        return (text[offsets[start]:], tokens[start:])
+
+    def _split_long_sentence(self, sentence: str, tokens: List[int],
+                             max_tokens: int) -> List[tuple]:
+        """按max_tokens切开超长句子，切点对齐到字符边界"""
+        _, offsets = self.encoding.decode_with_offsets(tokens)
+        pieces = []
         start = 0
-        
         while start < len(tokens):
-            # 获取当前chunk的tokens
             end = min(start + max_tokens, len(tokens))
-            chunk_tokens = tokens[start:end]
-            
-            # 解码为文本
-            chunk_text = self.encoding.decode(chunk_tokens)
-            chunks.append(chunk_text)
-            
-            # 移动到下一个chunk，考虑重叠
-            start = end - overlap
-            if start >= len(tokens):
-                break
-        
-        return chunks
-    
-    def chunk_experience(self, experience: Dict[str, Any], 
-                        max_tokens: int = 500) -> List[Dict[str, Any]]:
+            # 不在字符内部切开：回退到该字符的第一个token
+            while end < len(tokens) and end > start + 1 and offsets[end] == offsets[end - 1]:
+                end -= 1
+            char_start = offsets[start]
+            char_end = offsets[end] if end < len(tokens) else len(sentence)
+            pieces.append((sentence[char_start:char_end], tokens[start:end]))
+            start = end
+        return pieces
+
+    @staticmethod
+    def build_experience_text(experience: Dict[str, Any]) -> str:
         """
-        将单条经历切分为chunks
-        
+        构建用于切块和嵌入的经历全文
+
         Args:
             experience: 经历字典
-            max_tokens: 每个chunk的最大token数
-        
+
         Returns:
-            chunk列表，每个chunk包含原始字段和chunk_id
+            经历全文
         """
-        # 构建完整文本用于切块
         full_text_parts = [
             f"事件摘要：{experience.get('event_summary', '')}",
             f"挑战类型：{experience.get('challenge_type', '')}",
             f"应对策略：{experience.get('coping_strategy', '')}",
             f"最终结果：{experience.get('final_result', '')}"
         ]
-        full_text = "\n".join(full_text_parts)
-        
-        # 切块
-        text_chunks = self.chunk_text(full_text, max_tokens=max_tokens)
+        return "\n".join(full_text_parts)
+
+    def chunk_experience(self, experience: Dict[str, Any], 
+                        max_tokens: int = 500,
+                        text_chunks: List[str] = None) -> List[ChunkRecord]:
+        """
+        将单条经历切分为chunks
         
-        # 为每个chunk创建文档
-        chunk_docs = []
-        for i, chunk_text in enumerate(text_chunks):
-            chunk_doc = experience.copy()
-            chunk_doc["full_text"] = chunk_text
-            chunk_doc["chunk_id"] = f"{experience.get('celebrity_name_en', 'unknown')}_{i}"
-            chunk_docs.append(chunk_doc)
+        Args:
+            experience: 经历字典（会被补充experience_id字段）
+            max_tokens: 每个chunk的最大token数
+            text_chunks: 预先切好的文本chunks（由chunk_many批量生成），为None时现场切分
         
-        return chunk_docs
+        Returns:
+            chunk记录列表，每个chunk通过experience_id引用父经历，不复制经历字段
+        """
+        if text_chunks is None:
+            text_chunks = self.chunk_text(self.build_experience_text(experience), max_tokens=max_tokens)
+        
+        experience_id = make_experience_id(experience)
+        experience["experience_id"] = experience_id
+        
+        return [
+            ChunkRecord(
+                chunk_id=f"{experience_id}_{i}",
+                experience_id=experience_id,
+                full_text=chunk_text,
+            )
+            for i, chunk_text in enumerate(text_chunks)
+        ]
     
-    def get_embedding(self, text: str, max_retries: int = 3, retry_delay: float = 1.0) -> Optional[List[float]]:
+    def postprocess_embedding(self, embedding: List[float]) -> List[float]:
+        """
+        对原始嵌入向量做Matryoshka截断和归一化
+
+        对已处理过的向量重复调用结果不变，因此也可用于旧缓存中的向量。
+
+        Args:
+            embedding: 原始嵌入向量
+
+        Returns:
+            截断并（按配置）归一化后的向量
+        """
+        if self.output_dims and len(embedding) > self.output_dims:
+            return normalize_vector(embedding[:self.output_dims])
+        if self.normalize:
+            return normalize_vector(embedding)
+        return embedding
+    
+    def get_embedding(self, text: str, max_retries: int = 3, retry_delay: float = 1.0,
+                      stage: str = None) -> Optional[List[float]]:
         """
         获取文本的向量嵌入
         
@@ -155,6 +523,7 @@ class TextProcessor:
             text: 输入文本
             max_retries: 最大重试次数
             retry_delay: 重试延迟（秒），会指数增长
+            stage: 计入的预算阶段，默认为budget_stage
         
         Returns:
             向量列表，失败时返回None
@@ -164,8 +533,19 @@ class TextProcessor:
             print(f"警告: 输入文本为空，跳过嵌入向量生成")
             return None
         
+        # 向量不可缺少，无法降级：预算用完时直接停止
+        stage = stage or self.budget_stage
+        self.budget.check(stage)
+        
         # 重试循环
         for attempt in range(max_retries):
+            if attempt:
+                self.metrics.counter("api_retries_total", "模型API重试次数").inc(
+                    endpoint="embeddings", source="app"
+                )
+            # 端点持续失败时熔断，直接失败而不是逐条等待重试
+            if not self.breaker.allow():
+                return None
             try:
                 # 使用OpenRouter调用OpenAI的嵌入API
                 # 根据OpenRouter官方文档格式调用
@@ -179,7 +559,25 @@ class TextProcessor:
                 if self.extra_headers:
                     create_params["extra_headers"] = self.extra_headers
                 
-                response = self.client.embeddings.create(**create_params)
+                def request():
+                    with self.metrics.api_call("embeddings", self.model) as call:
+                        response = self.client.embeddings.create(**create_params)
+                        call.record_usage(getattr(response, "usage", None))
+                    return response
+                
+                tokens = self.limiter.token_cost(text)
+                try:
+                    if self.hedger is not None:
+                        response = self.hedger.call(lambda: self.limiter.call(request, tokens=tokens))
+                    else:
+                        response = self.limiter.call(request, tokens=tokens)
+                except Exception as e:
+                    self.breaker.record_error(e)
+                    raise
+                # 端点有响应即视为可用（响应内容的校验失败不计入熔断）
+                self.breaker.record_success()
+                self.budget.record_usage(stage, self.model, getattr(response, "usage", None),
+                                         prompt_text=text)
                 
                 # 首先检查响应中是否有错误
                 if hasattr(response, 'error') and response.error:
@@ -259,8 +657,9 @@ class TextProcessor:
                         continue
                     return None
                 
-                # 成功获取嵌入向量
-                return embedding
+                # 成功获取嵌入向量（截断和归一化只在这里做一次，索引和查询都直接使用）
+                self.metrics.counter("embeddings_total", "生成的嵌入向量数").inc(model=self.model)
+                return self.postprocess_embedding(embedding)
                 
             except Exception as e:
                 error_msg = str(e)
@@ -274,6 +673,10 @@ class TextProcessor:
                     print(f"文本内容 (前100字符): {text[:100] if len(text) > 100 else text}")
                     print(f"模型: {self.model}")
                 
+                # 429/5xx/连接错误已由限流器退避重试过，不再重复重试
+                if is_throttling_error(e):
+                    return None
+                
                 # 如果不是最后一次尝试，等待后重试
                 if attempt < max_retries - 1:
                     wait_time = retry_delay * (2 ** attempt)
@@ -281,73 +684,161 @@ class TextProcessor:
                     time.sleep(wait_time)
                 else:
                     return None
-        
+
         return None
-    
+
+    def get_embeddings(self, texts: List[str], stage: str = None) -> List[Optional[List[float]]]:
+        """
+        在一次API请求中获取多段文本的向量嵌入
+
+        批量请求失败或返回的条数不对时，逐条回退到get_embedding。
+
+        Args:
+            texts: 输入文本列表
+            stage: 计入的预算阶段，默认为budget_stage
+
+        Returns:
+            与texts一一对应的向量列表，失败或空文本的位置为None
+        """
+        valid = [i for i, text in enumerate(texts) if text and text.strip()]
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        if not valid:
+            return embeddings
+        stage = stage or self.budget_stage
+        if len(valid) == 1:
+            embeddings[valid[0]] = self.get_embedding(texts[valid[0]], stage=stage)
+            return embeddings
+
+        self.budget.check(stage)
+        batch = [texts[i] for i in valid]
+        create_params = {
+            "model": self.model,
+            "input": batch,
+            "encoding_format": "float"
+        }
+        if self.extra_headers:
+            create_params["extra_headers"] = self.extra_headers
+
+        def request():
+            with self.metrics.api_call("embeddings", self.model) as call:
+                response = self.client.embeddings.create(**create_params)
+                call.record_usage(getattr(response, "usage", None))
+            return response
+
+        data = None
+        if self.breaker.allow():
+            tokens = sum(self.limiter.token_cost(text) for text in batch)
+            try:
+                if self.hedger is not None:
+                    response = self.hedger.call(lambda: self.limiter.call(request, tokens=tokens))
+                else:
+                    response = self.limiter.call(request, tokens=tokens)
+                self.breaker.record_success()
+                self.budget.record_usage(stage, self.model, getattr(response, "usage", None),
+                                         prompt_text="\n".join(batch))
+                data = getattr(response, "data", None)
+            except Exception as e:
+                self.breaker.record_error(e)
+                print(f"批量获取嵌入向量失败: {type(e).__name__}: {e}")
+
+        if not data or len(data) != len(batch):
+            print(f"批量嵌入不可用，逐条请求 {len(batch)} 段文本")
+            for i in valid:
+                embeddings[i] = self.get_embedding(texts[i], stage=stage)
+            return embeddings
+
+        # 响应按index字段对应输入顺序（部分服务端不保证按顺序返回）
+        ordered = sorted(data, key=lambda item: getattr(item, "index", 0))
+        for i, item in zip(valid, ordered):
+            embedding = getattr(item, "embedding", None)
+            embeddings[i] = self.postprocess_embedding(embedding) if embedding else None
+        self.metrics.counter("embeddings_total", "生成的嵌入向量数").inc(
+            sum(1 for i in valid if embeddings[i] is not None), model=self.model
+        )
+        return embeddings
+
+    def _raise_if_circuit_open(self, chunk: ChunkRecord):
+        """
+        熔断器未关闭时chunk缺少向量属于暂时性故障：中止本阶段，端点恢复后重跑即可补齐，
+        而不是把没有向量的chunk写入缓存（缓存复用后这些chunk再也不会补上向量）
+        """
+        if self.breaker.state != CircuitBreaker.CLOSED:
+            raise CircuitOpenError(
+                f"熔断器 {self.breaker.name} 未关闭，chunk {chunk.chunk_id} 未生成嵌入向量；"
+                f"端点恢复后重新运行嵌入阶段"
+            )
+
     def process_experience(self, experience: Dict[str, Any], 
-                          max_tokens: int = 500) -> List[Dict[str, Any]]:
+                          max_tokens: int = 500,
+                          text_chunks: List[str] = None) -> List[ChunkRecord]:
         """
         处理单条经历：切块并生成嵌入
         
         Args:
             experience: 经历字典
             max_tokens: 每个chunk的最大token数
+            text_chunks: 预先切好的文本chunks，为None时现场切分
         
         Returns:
-            处理后的chunk列表，每个chunk包含embedding字段
+            处理后的chunk记录列表，每个chunk包含embedding
+        
+        Raises:
+            CircuitOpenError: 熔断器未关闭导致chunk缺少向量时抛出，避免把缺少向量的chunk写入缓存
         """
         # 切块
-        chunks = self.chunk_experience(experience, max_tokens=max_tokens)
+        chunks = self.chunk_experience(experience, max_tokens=max_tokens, text_chunks=text_chunks)
         
         # 为每个chunk生成嵌入
         for chunk in chunks:
             # 使用full_text生成嵌入
-            embedding = self.get_embedding(chunk["full_text"])
+            embedding = self.get_embedding(chunk.full_text)
             if embedding:
-                chunk["embedding"] = embedding
+                chunk.embedding = embedding
             else:
-                # 如果失败，使用event_summary作为备选
-                fallback_text = chunk.get("event_summary", "")
+                self._raise_if_circuit_open(chunk)
+                # 如果失败，使用父经历的event_summary作为备选
+                fallback_text = experience.get("event_summary", "")
                 if fallback_text:
                     embedding = self.get_embedding(fallback_text)
                     if embedding:
-                        chunk["embedding"] = embedding
+                        chunk.embedding = embedding
                     else:
-                        print(f"警告: chunk {chunk.get('chunk_id', 'unknown')} 的嵌入向量生成失败（包括备选方案）")
-                        chunk["embedding"] = []
+                        self._raise_if_circuit_open(chunk)
+                        print(f"警告: chunk {chunk.chunk_id} 的嵌入向量生成失败（包括备选方案）")
                 else:
-                    print(f"警告: chunk {chunk.get('chunk_id', 'unknown')} 的嵌入向量生成失败，且没有可用的备选文本")
-                    chunk["embedding"] = []
+                    print(f"警告: chunk {chunk.chunk_id} 的嵌入向量生成失败，且没有可用的备选文本")
         
         return chunks
     
     def process_all_experiences(self, experiences: List[Dict[str, Any]], 
-                               max_tokens: int = 500) -> List[Dict[str, Any]]:
+                               max_tokens: int = 500) -> List[ChunkRecord]:
         """
         批量处理所有经历
         
         Args:
-            experiences: 经历列表
+            experiences: 经历列表（会被补充experience_id字段）
             max_tokens: 每个chunk的最大token数
         
         Returns:
-            所有处理后的chunks
+            所有处理后的chunk记录
         """
-        all_chunks = []
-        
         print(f"\n开始处理 {len(experiences)} 条经历...")
         
-        for i, exp in enumerate(experiences):
+        # 一次性批量切块，避免逐条编码
+        texts = [self.build_experience_text(exp) for exp in experiences]
+        all_text_chunks = self.chunk_many(texts, max_tokens=max_tokens)
+        
+        def process(item):
+            i, (exp, text_chunks) = item
+            chunks = self.process_experience(exp, max_tokens=max_tokens, text_chunks=text_chunks)
             if (i + 1) % 10 == 0:
                 print(f"  已处理 {i + 1}/{len(experiences)} 条经历")
-            
-            chunks = self.process_experience(exp, max_tokens=max_tokens)
-            all_chunks.extend(chunks)
-            
-            # 添加延迟以避免API限流
-            if (i + 1) % 5 == 0:
-                import time
-                time.sleep(0.5)
+            return chunks
+        
+        # 并发度由共享限流器按429/Retry-After自适应控制；结果按输入顺序合并
+        executor = self._executor("embed", self.limiter.max_concurrency)
+        results = executor.map(process, enumerate(zip(experiences, all_text_chunks)))
+        all_chunks = [chunk for chunks in results for chunk in chunks]
         
         print(f"处理完成，共生成 {len(all_chunks)} 个chunks")
         return all_chunks
@@ -358,7 +849,7 @@ if __name__ == "__main__":
     
     # 测试
     test_text = "这是一段测试文本。" * 100
-    chunks = processor.chunk_text(test_text, max_tokens=50)
+    chunks = processor.chunk_text(test_text, max_tokens=50, overlap=10)
     print(f"切分为 {len(chunks)} 个chunks")
     
     # 测试嵌入
@@ -3,79 +3,31 @@
 """
 import os
 import sys
-import re
+from functools import lru_cache
 from pathlib import Path
 
-# 尝试加载python-dotenv，如果不存在则使用自定义加载函数
-try:
-    from dotenv import load_dotenv
-    HAS_DOTENV = True
-except ImportError:
-    HAS_DOTENV = False
-
-def load_env_file(env_path: Path):
-    """
-    加载.env文件，支持两种格式：
-    1. KEY=value (标准格式)
-    2. export KEY=value (shell格式)
-    """
-    if not env_path.exists():
-        return False
-    
-    with open(env_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            # 跳过空行和注释
-            if not line or line.startswith('#'):
-                continue
-            
-            # 移除export关键字（如果存在）
-            line = re.sub(r'^export\s+', '', line)
-            
-            # 解析KEY=value
-            if '=' in line:
-                key, value = line.split('=', 1)
-                key = key.strip()
-                value = value.strip()
-                
-                # 移除引号（如果存在）
-                if (value.startswith('"') and value.endswith('"')) or \
-                   (value.startswith("'") and value.endswith("'")):
-                    value = value[1:-1]
-                
-                # 设置环境变量
-                os.environ[key] = value
-    
-    return True
+# 添加当前目录到路径
+sys.path.insert(0, str(Path(__file__).parent))
 
 # 加载环境变量（必须在导入其他模块之前）
-# 首先尝试从项目根目录的env/.env加载
-env_path = Path(__file__).parent.parent / "env" / ".env"
-if env_path.exists():
-    if HAS_DOTENV:
-        load_dotenv(env_path)
-    else:
-        load_env_file(env_path)
-else:
-    # 如果不存在，尝试从项目根目录的.env加载
-    root_env = Path(__file__).parent.parent / ".env"
-    if root_env.exists():
-        if HAS_DOTENV:
-            load_dotenv(root_env)
-        else:
-            load_env_file(root_env)
-    else:
-        # 最后尝试默认位置（如果使用dotenv）
-        if HAS_DOTENV:
-            load_dotenv()
-
-sys.path.insert(0, str(Path(__file__).parent))
+from config import load_env
+load_env()
 
 from text_processing import TextProcessor
 from elasticsearch_setup import ElasticsearchSetup
+from diversify import diverse_search
+from query_planner import QueryPlanner
+from reranking import get_rerank_stage
 
 
-def search_experiences(query_text: str, size: int = 10, filter_tags: list = None):
+@lru_cache(maxsize=None)
+def _text_processor(embedding_model: str) -> TextProcessor:
+    """按模型复用TextProcessor（OpenAI和ES客户端由clients模块在进程内共享）"""
+    # 查询路径启用对冲请求，降低嵌入接口的尾延迟
+    return TextProcessor(model=embedding_model, hedge=True, budget_stage="query")
+
+
+def search_experiences(query_text: str, size: int = 10, filter_tags: list = None, rerank: str = None):
     """
     搜索名人经历
     
@@ -83,6 +35,7 @@ def search_experiences(query_text: str, size: int = 10, filter_tags: list = None
         query_text: 查询文本（例如："如何应对创业困难"）
         size: 返回结果数量
         filter_tags: 标签过滤条件（例如：["Entrepreneurial Challenges"]）
+        rerank: 重排器（lexical/cross_encoder/llm），默认从环境变量RERANKER读取，none表示不重排
     
     Returns:
         搜索结果
@@ -92,7 +45,7 @@ def search_experiences(query_text: str, size: int = 10, filter_tags: list = None
     # 初始化 TextProcessor，使用 Qwen 模型（如果未设置环境变量）
     # 优先使用环境变量 EMBEDDING_MODEL，否则使用 Qwen 模型
     embedding_model = os.getenv("EMBEDDING_MODEL", "Qwen/Qwen3-Embedding-8B")
-    text_processor = TextProcessor(model=embedding_model)
+    text_processor = _text_processor(embedding_model)
     es_setup = ElasticsearchSetup()
     index_name = os.getenv("ELASTICSEARCH_INDEX", "celebrity_experiences")
     
@@ -113,24 +66,132 @@ def search_experiences(query_text: str, size: int = 10, filter_tags: list = None
         }
         print(f"应用标签过滤: {filter_tags}")
     
-    # 向量搜索
-    print(f"执行向量搜索...")
-    results = es_setup.vector_search(
-        index_name, 
-        embedding, 
+    # 启用重排时一阶段多取候选，重排后再截断到size
+    stage = get_rerank_stage(rerank)
+    candidates = max(size, int(os.getenv("RERANK_CANDIDATES", "50"))) if stage else size
+    
+    # 向量搜索（按过滤条件的选择性选择num_candidates，很有选择性的过滤改用精确检索）
+    planner = QueryPlanner(es_setup, index_name)
+    plan = planner.plan(candidates, filter_query)
+    if plan.strategy == "exact":
+        print(f"执行精确向量搜索（预计命中 {plan.expected_matches} 个文档）...")
+    else:
+        print(f"执行向量搜索（num_candidates={plan.num_candidates}）...")
+    results = planner.search(embedding, size=candidates, filter_query=filter_query)
+    
+    if stage:
+        results = stage.rerank(query_text, results, size=size)
+        info = (results or {}).get("rerank")
+        if info and not info["applied"]:
+            print(f"重排未生效（{info['fallback_reason']}），使用向量检索顺序")
+        print_experience_results(results, score_label="重排分数" if info and info["applied"] else "相似度分数")
+    else:
+        print_experience_results(results, score_label="相似度分数")
+    
+    return results
+
+
+def diverse_search_experiences(query_text: str, size: int = 10, filter_tags: list = None,
+                               mmr_lambda: float = 0.7, per_celebrity: int = 2, collapse: bool = False):
+    """
+    多样化向量搜索：一次取候选，按MMR重排并限制每位名人的结果数量
+    
+    Args:
+        query_text: 查询文本
+        size: 返回结果数量
+        filter_tags: 标签过滤条件
+        mmr_lambda: 相关度权重（1为纯按相关度，越小越强调多样性）
+        per_celebrity: 每位名人最多返回的数量
+        collapse: 是否在ES端按名人折叠（每位名人一条）
+    
+    Returns:
+        搜索结果
+    """
+    embedding_model = os.getenv("EMBEDDING_MODEL", "Qwen/Qwen3-Embedding-8B")
+    text_processor = _text_processor(embedding_model)
+    es_setup = ElasticsearchSetup()
+    index_name = os.getenv("ELASTICSEARCH_INDEX", "celebrity_experiences")
+    
+    print(f"生成查询向量: {query_text}")
+    embedding = text_processor.get_embedding(query_text)
+    if not embedding:
+        print("生成向量失败")
+        return None
+    
+    filter_query = {"terms": {"tags": filter_tags}} if filter_tags else None
+    
+    print(f"执行多样化搜索（lambda={mmr_lambda}，每位名人最多 {per_celebrity} 条{'，ES折叠' if collapse else ''}）...")
+    results = diverse_search(
+        es_setup,
+        index_name,
+        embedding,
+        size=size,
+        filter_query=filter_query,
+        mmr_lambda=mmr_lambda,
+        per_celebrity=per_celebrity,
+        collapse=collapse
+    )
+    
+    print_experience_results(results, score_label="相似度分数")
+    
+    return results
+
+
+def hybrid_search(query_text: str, size: int = 10, filter_tags: list = None):
+    """
+    混合搜索（向量 + 关键词，在同一请求中完成）
+    
+    Args:
+        query_text: 查询文本
+        size: 返回结果数量
+        filter_tags: 标签过滤条件
+    
+    Returns:
+        搜索结果
+    """
+    embedding_model = os.getenv("EMBEDDING_MODEL", "Qwen/Qwen3-Embedding-8B")
+    text_processor = _text_processor(embedding_model)
+    es_setup = ElasticsearchSetup()
+    index_name = os.getenv("ELASTICSEARCH_INDEX", "celebrity_experiences")
+    
+    print(f"生成查询向量: {query_text}")
+    embedding = text_processor.get_embedding(query_text)
+    if not embedding:
+        print("生成向量失败")
+        return None
+    
+    filter_query = {"terms": {"tags": filter_tags}} if filter_tags else None
+    
+    print(f"执行混合搜索...")
+    results = QueryPlanner(es_setup, index_name).hybrid_search(
+        query_text,
+        embedding,
         size=size,
         filter_query=filter_query
     )
     
+    print_experience_results(results, score_label="混合得分")
+    
+    return results
+
+
+def print_experience_results(results: dict, score_label: str = "相似度分数"):
+    """
+    打印向量/混合搜索结果
+    
+    Args:
+        results: 搜索结果
+        score_label: 分数名称
+    """
     if results and "hits" in results:
         print(f"\n找到 {results['hits']['total']['value']} 条相关经历\n")
         
         for i, hit in enumerate(results['hits']['hits'], 1):
             source = hit['_source']
-            score = hit['_score']
+            score = hit.get('_rerank_score', hit['_score'])
             
             print(f"{'='*60}")
-            print(f"结果 {i} (相似度分数: {score:.4f})")
+            print(f"结果 {i} ({score_label}: {score:.4f})")
             print(f"{'='*60}")
             print(f"名人: {source.get('celebrity_name_cn', '')} ({source.get('celebrity_name_en', '')})")
             print(f"职业: {source.get('profession', '')}")
@@ -140,8 +201,6 @@ def search_experiences(query_text: str, size: int = 10, filter_tags: list = None
             print(f"最终结果: {source.get('final_result', '')}")
             print(f"标签: {', '.join(source.get('tags', []))}")
             print()
-    
-    return results
 
 
 def keyword_search(query_text: str, size: int = 10):
@@ -164,7 +223,7 @@ def keyword_search(query_text: str, size: int = 10):
         "query": {
             "multi_match": {
                 "query": query_text,
-                "fields": ["event_summary", "coping_strategy", "final_result", "full_text"],
+                "fields": es_setup.keyword_fields,
                 "type": "best_fields"
             }
         }
@@ -198,13 +257,25 @@ if __name__ == "__main__":
     parser.add_argument("--size", type=int, default=10, help="返回结果数量")
     parser.add_argument("--tags", type=str, nargs="+", help="标签过滤条件")
     parser.add_argument("--keyword", action="store_true", help="使用关键词搜索而非向量搜索")
+    parser.add_argument("--hybrid", action="store_true", help="使用混合搜索（向量 + 关键词）")
+    parser.add_argument("--diverse", action="store_true", help="多样化结果（MMR重排 + 每位名人数量上限）")
+    parser.add_argument("--mmr-lambda", type=float, default=0.7, help="MMR相关度权重（越小越强调多样性）")
+    parser.add_argument("--per-celebrity", type=int, default=2, help="多样化时每位名人最多返回的数量")
+    parser.add_argument("--collapse", action="store_true", help="多样化时在ES端按名人折叠（每位名人一条）")
+    parser.add_argument("--rerank", type=str, choices=["none", "lexical", "cross_encoder", "llm"],
+                        help="对向量搜索的候选重排（默认环境变量RERANKER）")
     
     args = parser.parse_args()
     
     if args.keyword:
         keyword_search(args.query, args.size)
+    elif args.hybrid:
+        hybrid_search(args.query, args.size, args.tags)
+    elif args.diverse or args.collapse:
+        diverse_search_experiences(args.query, args.size, args.tags, mmr_lambda=args.mmr_lambda,
+                                   per_celebrity=args.per_celebrity, collapse=args.collapse)
     else:
-        search_experiences(args.query, args.size, args.tags)
+        search_experiences(args.query, args.size, args.tags, rerank=args.rerank)
 
 
 